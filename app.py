@@ -1,65 +1,1307 @@
-from flask import Flask, render_template, request, jsonify, send_file, Response
+from flask import Blueprint, Flask, render_template, request, jsonify, Response
 from googleapiclient.discovery import build
-from datetime import datetime, timedelta
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest, build_http
+from datetime import datetime, timedelta, timezone
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 import os
 from dotenv import load_dotenv
+import httplib2
 import isodate
+import requests
+from requests.adapters import HTTPAdapter
+import copy
 import csv
+from array import array
+import hashlib
+import heapq
+import json
+import random
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
 from io import StringIO
+from operator import attrgetter
+from xml.sax.saxutils import escape as xml_escape
 
 # 載入環境變數
 load_dotenv()
 
-app = Flask(__name__)
+bp = Blueprint('main', __name__)
 
 # YouTube API 設定
 YOUTUBE_API_SERVICE_NAME = 'youtube'
 YOUTUBE_API_VERSION = 'v3'
 
-# 儲存最新搜尋結果用於匯出
-last_search_results = []
-# 儲存搜尋條件用於檔案命名
-last_search_params = {}
-
-# 真實的 API 配額追蹤（每日累積）
-daily_quota_usage = {
-    'date': datetime.now().strftime('%Y-%m-%d'),
-    'search_calls': 0,
-    'video_calls': 0,
-    'category_calls': 0,
-    'total_cost': 0
+# .env 檔案位置（API Key 只在此檔案修改後重新讀取）
+ENV_FILE_PATH = os.getenv('ENV_FILE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'))
+
+def get_env_int(name, default):
+    """讀取整數型環境變數，格式錯誤時使用預設值"""
+    try:
+        return int(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def get_env_float(name, default):
+    """讀取浮點數型環境變數，格式錯誤時使用預設值"""
+    try:
+        return float(os.getenv(name, default))
+    except (TypeError, ValueError):
+        return default
+
+def get_env_bool(name, default):
+    """讀取布林型環境變數（true/false、1/0、yes/no）"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+# 本機資料目錄（快取資料庫等）
+DATA_DIR = os.getenv('DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+
+# 搜尋結果快取設定
+SEARCH_CACHE_ENABLED = get_env_bool('SEARCH_CACHE_ENABLED', True)
+SEARCH_CACHE_PATH = os.getenv('SEARCH_CACHE_PATH', os.path.join(DATA_DIR, 'search_cache.db'))
+SEARCH_CACHE_TTL = get_env_int('SEARCH_CACHE_TTL', 1800)  # 秒
+SEARCH_CACHE_MAX_ENTRIES = get_env_int('SEARCH_CACHE_MAX_ENTRIES', 5000)
+# 同一快取時間窗內固定隨機排序與時間範圍，讓重複查詢能命中快取
+SEARCH_CACHE_DETERMINISTIC = get_env_bool('SEARCH_CACHE_DETERMINISTIC', True)
+
+# 影片詳細資訊快取設定（標題/長度等幾乎不變的資料保留較久，觀看數等統計資料較快過期）
+VIDEO_CACHE_ENABLED = get_env_bool('VIDEO_CACHE_ENABLED', True)
+VIDEO_CACHE_PATH = os.getenv('VIDEO_CACHE_PATH', os.path.join(DATA_DIR, 'video_cache.db'))
+VIDEO_META_TTL = get_env_int('VIDEO_META_TTL', 7 * 24 * 3600)  # 秒
+VIDEO_STATS_TTL = get_env_int('VIDEO_STATS_TTL', 1800)  # 秒
+VIDEO_CACHE_MAX_ENTRIES = get_env_int('VIDEO_CACHE_MAX_ENTRIES', 50000)
+
+# 觀看速度追蹤：搜尋結果中的影片會被追蹤，定期重新查詢觀看數以計算每小時觀看增加數
+VELOCITY_TRACKING_ENABLED = get_env_bool('VELOCITY_TRACKING_ENABLED', True)
+VELOCITY_DB_PATH = os.getenv('VELOCITY_DB_PATH', os.path.join(DATA_DIR, 'velocity.db'))
+VELOCITY_MAX_TRACKED = get_env_int('VELOCITY_MAX_TRACKED', 20000)  # 最多追蹤的影片數
+VELOCITY_TRACK_TTL = get_env_int('VELOCITY_TRACK_TTL', 7 * 24 * 3600)  # 影片超過此秒數未出現在搜尋結果即停止追蹤
+VELOCITY_MAX_SNAPSHOTS = get_env_int('VELOCITY_MAX_SNAPSHOTS', 48)  # 每個影片保留的快照數
+VELOCITY_MIN_SNAPSHOT_INTERVAL = get_env_int('VELOCITY_MIN_SNAPSHOT_INTERVAL', 600)  # 間隔太短的快照合併（秒）
+VELOCITY_POLL_INTERVAL = get_env_int('VELOCITY_POLL_INTERVAL', 3600)  # 背景重新查詢觀看數的間隔（秒）
+VELOCITY_DAILY_UNITS = get_env_int('VELOCITY_DAILY_UNITS', 200)  # 背景查詢每日最多使用的配額（每 50 個影片 1 單位）
+
+# 本機影片資料庫：保存每次取得的影片資料並建立全文索引，供 /search_local 離線搜尋
+VIDEO_INDEX_ENABLED = get_env_bool('VIDEO_INDEX_ENABLED', True)
+VIDEO_INDEX_PATH = os.getenv('VIDEO_INDEX_PATH', os.path.join(DATA_DIR, 'video_index.db'))
+# 本機搜尋每次最多取出的候選影片數（依觀看次數由高到低）
+VIDEO_INDEX_QUERY_LIMIT = get_env_int('VIDEO_INDEX_QUERY_LIMIT', 5000)
+
+# YouTube API 單次 videos().list 最多 50 個 ID
+VIDEO_BATCH_SIZE = 50
+# 一頁搜尋的預估配額：search.list 100 單位 + 該頁影片詳情（完整資料與統計更新最多各一次 videos.list，每次 1 單位）
+VIDEO_PAGE_DETAIL_UNITS = 2
+SEARCH_PAGE_UNITS = 100 + VIDEO_PAGE_DETAIL_UNITS
+
+# 影片欄位定義：(API part, 欄位名稱, 預設值)
+# 搜尋結果與匯出使用的欄位皆由此表產生，API 請求的 fields 參數也由此表自動推導，
+# 新增欄位時只需在此加入一行；預設值為整數的欄位會在解析時轉為整數
+VIDEO_FIELD_SCHEMA = (
+    ('snippet', 'title', ''),
+    ('snippet', 'description', ''),
+    ('snippet', 'channelTitle', ''),
+    ('snippet', 'channelId', ''),
+    ('snippet', 'publishedAt', ''),
+    ('snippet', 'thumbnails', {}),
+    ('snippet', 'categoryId', ''),
+    ('snippet', 'defaultLanguage', ''),
+    ('snippet', 'defaultAudioLanguage', ''),
+    ('snippet', 'tags', []),
+    ('statistics', 'viewCount', 0),
+    ('statistics', 'likeCount', 0),
+    ('statistics', 'commentCount', 0),
+    ('contentDetails', 'duration', ''),
+    ('contentDetails', 'definition', ''),
+    ('contentDetails', 'caption', ''),
+    ('contentDetails', 'licensedContent', False),
+    ('contentDetails', 'projection', ''),
+)
+
+# 只需要部分子欄位的欄位（縮圖只取網頁會用到的尺寸）
+VIDEO_FIELD_SELECTORS = {
+    'thumbnails': 'thumbnails(default/url,medium/url)',
 }
 
+def build_video_fields_param(parts):
+    """依欄位定義產生 videos().list 的 fields 參數，只取回實際使用的欄位"""
+    part_fields = []
+    for part in parts:
+        selectors = [
+            VIDEO_FIELD_SELECTORS.get(name, name)
+            for field_part, name, _ in VIDEO_FIELD_SCHEMA
+            if field_part == part
+        ]
+        part_fields.append(f"{part}({','.join(selectors)})")
+    return f"items(id,{','.join(part_fields)})"
+
+# search().list 只需要影片 ID 與下一頁標記
+SEARCH_LIST_PART = 'id'
+SEARCH_LIST_FIELDS = 'nextPageToken,items/id/videoId'
+
+# 每次搜尋最多取得的搜尋頁數，以及預設的配額預算（單位）
+MAX_SEARCH_PAGES = get_env_int('MAX_SEARCH_PAGES', 10)
+SEARCH_UNIT_BUDGET = get_env_int('SEARCH_UNIT_BUDGET', 1500)
+# 相同條件的搜尋進行中時，其他請求最多等待的秒數（逾時後自行搜尋）
+SEARCH_COALESCE_TIMEOUT = get_env_int('SEARCH_COALESCE_TIMEOUT', 300)
+# 熱門模式（videos().list chart=mostPopular）最多讀取的頁數，每頁 50 個影片、1 單位
+TRENDING_MAX_PAGES = get_env_int('TRENDING_MAX_PAGES', 4)
+
+# 影片詳細資訊查詢的背景執行緒數（搜尋下一頁的同時查詢上一頁的影片）
+DETAIL_FETCH_WORKERS = max(1, get_env_int('DETAIL_FETCH_WORKERS', 4))
+
+# 多地區搜尋：同時搜尋的地區數與單次搜尋最多可選的地區數
+REGION_SEARCH_WORKERS = max(1, get_env_int('REGION_SEARCH_WORKERS', 4))
+MAX_SEARCH_REGIONS = get_env_int('MAX_SEARCH_REGIONS', 10)
+
+# 各地區搜尋時偏好的語言（relevanceLanguage），未列出的地區不指定
+REGION_LANGUAGES = {
+    'TW': 'zh', 'CN': 'zh', 'HK': 'zh', 'SG': 'zh',
+    'JP': 'ja',
+    'KR': 'ko',
+    'NO': 'no',
+    'CH': 'de', 'DE': 'de',
+    'DK': 'da',
+    'AE': 'ar', 'SA': 'ar',
+    'US': 'en', 'GB': 'en', 'CA': 'en', 'AU': 'en', 'IN': 'en',
+    'FR': 'fr',
+    'RU': 'ru',
+}
+
+# YouTube API 連線方式：requests（連線池、keep-alive）或 httplib2（googleapiclient 預設）
+YOUTUBE_HTTP_TRANSPORT = os.getenv('YOUTUBE_HTTP_TRANSPORT', 'requests').strip().lower()
+HTTP_CONNECT_TIMEOUT = get_env_int('HTTP_CONNECT_TIMEOUT', 5)  # 秒
+HTTP_READ_TIMEOUT = get_env_int('HTTP_READ_TIMEOUT', 30)  # 秒
+HTTP_POOL_SIZE = get_env_int('HTTP_POOL_SIZE', max(10, DETAIL_FETCH_WORKERS + 4))  # 每個主機的連線數
+
+# API 呼叫失敗重試：請求頻率過高、伺服器錯誤與連線失敗時以指數退避（含隨機抖動）重試
+API_CALL_DEADLINE = get_env_float('API_CALL_DEADLINE', 20)  # 單一 API 請求含重試的總秒數上限
+API_RETRY_BASE_DELAY = get_env_float('API_RETRY_BASE_DELAY', 0.5)  # 第一次重試前的等待秒數
+API_RETRY_MAX_DELAY = get_env_float('API_RETRY_MAX_DELAY', 8)  # 單次等待秒數上限
+# 所有 Key 配額用完或無效時，此秒數內的呼叫直接失敗（斷路器）
+API_CIRCUIT_COOLDOWN = get_env_int('API_CIRCUIT_COOLDOWN', 300)
+
+# 影片類別快取設定（各地區類別幾乎不會變動）
+CATEGORY_CACHE_TTL = get_env_int('CATEGORY_CACHE_TTL', 7 * 24 * 3600)  # 秒
+CATEGORY_RETRY_INTERVAL = get_env_int('CATEGORY_RETRY_INTERVAL', 300)  # 查詢失敗後重試間隔（秒）
+# 啟動時預先載入類別的地區（逗號分隔）
+CATEGORY_WARMUP_REGIONS = [
+    region.strip().upper()
+    for region in os.getenv('CATEGORY_WARMUP_REGIONS', 'TW,US,JP,KR,IN').split(',')
+    if region.strip()
+]
+
+# 搜尋結果暫存（供匯出使用），依搜尋編號區分各使用者的結果
+RESULT_STORE_TTL = get_env_int('RESULT_STORE_TTL', 3600)  # 秒
+RESULT_STORE_MAX_ENTRIES = get_env_int('RESULT_STORE_MAX_ENTRIES', 200)
+RESULT_STORE_MAX_MB = get_env_int('RESULT_STORE_MAX_MB', 100)
+# 搜尋回應中每個影片的摘要欄位（逗號分隔），完整資料由 /results/<搜尋編號> 依需要取得
+RESULT_SUMMARY_FIELDS = [
+    name.strip()
+    for name in os.getenv(
+        'RESULT_SUMMARY_FIELDS',
+        'videoId,title,channelTitle,url,thumbnail,formattedViewCount,likeCount,commentCount,'
+        'formattedDuration,publishedAt,categoryName,filterTier,viewVelocity'
+    ).split(',')
+    if name.strip()
+]
+# 多個工作程序共用的狀態（搜尋結果暫存、進行中的搜尋）：sqlite（預設）或 memory（只適用單一程序）
+STATE_BACKEND = os.getenv('STATE_BACKEND', 'sqlite').strip().lower()
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', os.path.join(DATA_DIR, 'state.db'))
+# /results 分頁：未指定時每頁筆數與單頁上限
+RESULTS_PAGE_LIMIT = get_env_int('RESULTS_PAGE_LIMIT', 50)
+RESULTS_PAGE_MAX = get_env_int('RESULTS_PAGE_MAX', 500)
+
+# 真實的 API 配額追蹤（每日累積，寫入本機資料庫，重新啟動後仍保留）；DAILY_QUOTA_LIMIT 為每組 API Key 的每日配額
+DAILY_QUOTA_LIMIT = get_env_int('DAILY_QUOTA_LIMIT', 10000)
+QUOTA_LEDGER_PATH = os.getenv('QUOTA_LEDGER_PATH', os.path.join(DATA_DIR, 'quota.db'))
+# 搜尋開始前保留的配額在此秒數後自動失效（避免程式中斷後一直佔用）
+QUOTA_RESERVATION_TIMEOUT = get_env_int('QUOTA_RESERVATION_TIMEOUT', 600)
+
+# httplib2.Http 不是執行緒安全的，每個執行緒各自保留一個連線物件
+_http_local = threading.local()
+
+def build_thread_safe_request(http, *args, **kwargs):
+    """建立 API 請求時改用目前執行緒專屬的 httplib2.Http，讓同一個服務物件可跨執行緒共用"""
+    if not hasattr(_http_local, 'http'):
+        _http_local.http = build_http()
+    return HttpRequest(_http_local.http, *args, **kwargs)
+
+class RequestsHttp:
+    """以 requests.Session 實作 googleapiclient 需要的 httplib2.Http 介面
+
+    共用連線池並保持連線（keep-alive），避免每次 API 呼叫都重新做 TLS 握手；
+    gzip 回應由 requests 自動解壓縮。Session 可跨執行緒共用。
+    """
+
+    # 已由 requests 處理的標頭，不再交給 googleapiclient
+    _HOP_HEADERS = ('content-encoding', 'content-length', 'transfer-encoding', 'connection')
+
+    def __init__(self, connect_timeout, read_timeout, pool_size):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        response = self.session.request(
+            method, uri,
+            data=body,
+            headers=headers,
+            timeout=self.timeout,
+            allow_redirects=redirections > 0
+        )
+        info = {
+            key.lower(): value
+            for key, value in response.headers.items()
+            if key.lower() not in self._HOP_HEADERS
+        }
+        info['status'] = str(response.status_code)
+        return httplib2.Response(info), response.content
+
+    def close(self):
+        self.session.close()
+
+def get_build_transport_kwargs():
+    """依 YOUTUBE_HTTP_TRANSPORT 設定回傳建立服務時使用的連線參數"""
+    if YOUTUBE_HTTP_TRANSPORT == 'httplib2':
+        return {'requestBuilder': build_thread_safe_request}
+    return {'http': RequestsHttp(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_POOL_SIZE)}
+
+# 每組 Key 的配額用完或失效時改用下一組 Key 重試同一個請求
+KEY_QUOTA_ERROR_REASONS = {'quotaExceeded', 'dailyLimitExceeded'}
+KEY_INVALID_ERROR_REASONS = {'keyInvalid', 'keyExpired', 'API_KEY_INVALID', 'accessNotConfigured', 'ipRefererBlocked'}
+# 請求頻率過高（短暫性錯誤，稍後重試即可）
+RATE_LIMIT_ERROR_REASONS = {'rateLimitExceeded', 'userRateLimitExceeded', 'RATE_LIMIT_EXCEEDED'}
+# 重試後可能成功的錯誤分類
+RETRYABLE_ERROR_KINDS = ('rate_limit', 'server', 'network')
+# 各 API 每次呼叫消耗的配額單位
+API_METHOD_COSTS = {'search': 100, 'videos': 1, 'videoCategories': 1}
+
+class YouTubeApiError(Exception):
+    """YouTube API 呼叫失敗（不可重試或重試後仍失敗）
+
+    kind 為錯誤分類：quota（配額用完）、auth（Key 無效）、rate_limit（請求過於頻繁）、
+    server（YouTube 伺服器錯誤）、network（連線失敗或逾時）、client（請求參數錯誤）。
+    retry_after 為斷路器開啟時建議的等待秒數。
+    """
+
+    def __init__(self, message, kind, retry_after=None):
+        super().__init__(message)
+        self.kind = kind
+        self.retry_after = retry_after
+
+def get_http_error_reasons(error):
+    """從 HttpError 的回應內容取出錯誤原因（errors[].reason 與 details[].reason）"""
+    try:
+        payload = json.loads(error.content.decode('utf-8') if isinstance(error.content, bytes) else error.content)
+        error_body = payload.get('error', {})
+    except (ValueError, AttributeError):
+        return set()
+    if not isinstance(error_body, dict):
+        return set()
+    reasons = {item.get('reason') for item in error_body.get('errors', []) if isinstance(item, dict)}
+    reasons.update(item.get('reason') for item in error_body.get('details', []) if isinstance(item, dict))
+    reasons.discard(None)
+    return reasons
+
+def classify_api_error(error):
+    """將 API 呼叫的例外分類（見 YouTubeApiError.kind），無法分類時回傳 None"""
+    if isinstance(error, HttpError):
+        reasons = get_http_error_reasons(error)
+        if reasons & KEY_QUOTA_ERROR_REASONS:
+            return 'quota'
+        if reasons & KEY_INVALID_ERROR_REASONS:
+            return 'auth'
+        if reasons & RATE_LIMIT_ERROR_REASONS:
+            return 'rate_limit'
+        status = getattr(error.resp, 'status', 0)
+        if status == 429:
+            return 'rate_limit'
+        if status == 401:
+            return 'auth'
+        if status >= 500:
+            return 'server'
+        return 'client'
+    if isinstance(error, (requests.RequestException, httplib2.HttpLib2Error, OSError)):
+        return 'network'
+    return None
+
+def get_retry_delay(attempt):
+    """第 attempt 次重試前的等待秒數：指數退避加上隨機抖動，避免多個請求同時重試"""
+    delay = min(API_RETRY_MAX_DELAY, API_RETRY_BASE_DELAY * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class ApiCircuitBreaker:
+    """配額用完或 Key 無效時開啟斷路器：冷卻時間內的呼叫直接失敗，不再送出注定失敗的請求
+
+    冷卻時間結束後自動關閉，下一次呼叫重新嘗試；再次失敗時重新開啟。
+    """
+
+    def __init__(self, cooldown):
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._error = None
+        self._open_until = 0
+
+    def check(self):
+        """斷路器開啟中時拋出 YouTubeApiError"""
+        error = self._error
+        if error is None:
+            return
+        remaining = self._open_until - time.time()
+        if remaining <= 0:
+            with self._lock:
+                if self._error is error:
+                    self._error = None
+            return
+        raise YouTubeApiError(str(error), error.kind, retry_after=int(remaining) + 1)
+
+    def trip(self, error):
+        with self._lock:
+            self._error = error
+            self._open_until = time.time() + self.cooldown
+        print(f"⛔ YouTube API 斷路器開啟 {self.cooldown} 秒（{error.kind}）: {error}")
+
+    def is_open(self):
+        return self._error is not None and time.time() < self._open_until
+
+def mask_api_key(api_key):
+    """顯示用的遮蔽 Key"""
+    return f"{api_key[:10]}...{api_key[-4:]}"
+
+def get_api_key_id(api_key):
+    """帳本中代表 Key 的編號（不儲存 Key 本身）"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+class ApiKeyPool:
+    """多組 API Key 共用池
+
+    每次呼叫時選擇今日剩餘配額最多的 Key（各 Key 用量記錄在配額帳本），
+    遇到 quotaExceeded 時將該 Key 標記為今日已用完、遇到 Key 無效時停用該 Key，
+    並以下一組 Key 重送同一個請求，分頁位置（pageToken）不受影響。
+    """
+
+    def __init__(self, api_keys, per_key_limit):
+        self.api_keys = list(api_keys)
+        self.key_ids = {api_key: get_api_key_id(api_key) for api_key in self.api_keys}
+        self.per_key_limit = per_key_limit
+        self._lock = threading.Lock()
+        self._services = {}
+        self._invalid = {}  # api_key -> 停用到期時間，到期後重新嘗試
+        self.breaker = ApiCircuitBreaker(API_CIRCUIT_COOLDOWN)
+        # 所有 Key 共用同一個連線池（Key 只出現在網址參數中）
+        self._transport_kwargs = get_build_transport_kwargs()
+
+    def _get_service(self, api_key):
+        service = self._services.get(api_key)
+        if service is not None:
+            return service
+        with self._lock:
+            if api_key not in self._services:
+                self._services[api_key] = build(
+                    YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION,
+                    developerKey=api_key,
+                    static_discovery=True,
+                    cache_discovery=False,
+                    **self._transport_kwargs
+                )
+            return self._services[api_key]
+
+    def _key_usage(self):
+        if not quota_ledger:
+            return {}
+        try:
+            return quota_ledger.key_usage()
+        except sqlite3.Error as e:
+            print(f"⚠️  讀取 API Key 用量失敗: {e}")
+            return {}
+
+    def _is_invalid(self, api_key):
+        return self._invalid.get(api_key, 0) > time.time()
+
+    def choose_key(self, exclude=()):
+        """選擇今日剩餘配額最多且可用的 Key，沒有可用的 Key 時回傳 None"""
+        usage = self._key_usage()
+        best_key = None
+        best_remaining = None
+        for api_key in self.api_keys:
+            if api_key in exclude or self._is_invalid(api_key):
+                continue
+            units, exhausted = usage.get(self.key_ids[api_key], (0, False))
+            if exhausted:
+                continue
+            remaining = self.per_key_limit - units
+            if best_remaining is None or remaining > best_remaining:
+                best_key, best_remaining = api_key, remaining
+        return best_key
+
+    def daily_limit(self):
+        """今日可用的總配額：可用的 Key 各 per_key_limit 單位，已用完或停用的 Key 只計已使用量"""
+        usage = self._key_usage()
+        total = 0
+        for api_key in self.api_keys:
+            units, exhausted = usage.get(self.key_ids[api_key], (0, False))
+            total += units if exhausted or self._is_invalid(api_key) else max(units, self.per_key_limit)
+        return total
+
+    def key_quota_info(self):
+        """各 Key 今日的用量"""
+        usage = self._key_usage()
+        info = []
+        for api_key in self.api_keys:
+            units, exhausted = usage.get(self.key_ids[api_key], (0, False))
+            info.append({
+                'key': '...' + api_key[-4:],
+                'used': units,
+                'remaining': 0 if exhausted else max(0, self.per_key_limit - units),
+                'exhausted': exhausted,
+                'invalid': self._is_invalid(api_key)
+            })
+        return info
+
+    def execute(self, resource, method, kwargs):
+        """以剩餘配額最多的 Key 執行請求
+
+        配額用完或 Key 無效時換下一組 Key 重送；請求頻率過高、伺服器錯誤與連線失敗以指數退避
+        重試，總時間不超過 API_CALL_DEADLINE 秒。所有 Key 都無法使用時開啟斷路器。
+        失敗時拋出 YouTubeApiError。
+        """
+        self.breaker.check()
+        deadline = time.monotonic() + API_CALL_DEADLINE
+        failed_keys = set()
+        last_kind = None
+        attempt = 0
+        while True:
+            api_key = self.choose_key(failed_keys)
+            if api_key is None:
+                if last_kind == 'auth' or (last_kind is None and all(map(self._is_invalid, self.api_keys))):
+                    error = YouTubeApiError('API Key 無效，請檢查 .env 中的 API Key 設定', 'auth')
+                else:
+                    error = YouTubeApiError('所有 API Key 今日配額皆已用完，請於太平洋時間午夜配額重置後再試', 'quota')
+                self.breaker.trip(error)
+                raise error
+            request = getattr(getattr(self._get_service(api_key), resource)(), method)(**kwargs)
+            try:
+                response = request.execute()
+            except Exception as e:
+                kind = classify_api_error(e)
+                if kind is None:
+                    raise
+                if kind == 'quota':
+                    print(f"🔁 API Key {mask_api_key(api_key)} 今日配額已用完，改用其他 Key 重試")
+                    self._mark_exhausted(api_key)
+                elif kind == 'auth':
+                    print(f"🔁 API Key {mask_api_key(api_key)} 無效，停用後改用其他 Key 重試")
+                    with self._lock:
+                        self._invalid[api_key] = time.time() + API_CIRCUIT_COOLDOWN
+                elif kind in RETRYABLE_ERROR_KINDS:
+                    delay = get_retry_delay(attempt)
+                    if time.monotonic() + delay > deadline:
+                        raise YouTubeApiError(f'YouTube API {resource}.{method} 重試 {attempt} 次後仍失敗: {e}', kind) from e
+                    attempt += 1
+                    print(f"⏳ YouTube API {resource}.{method} 暫時失敗（{kind}），{delay:.1f} 秒後第 {attempt} 次重試: {e}")
+                    time.sleep(delay)
+                    continue
+                else:
+                    raise YouTubeApiError(f'YouTube API {resource}.{method} 請求錯誤: {e}', kind) from e
+                failed_keys.add(api_key)
+                last_kind = kind
+                continue
+            self._record(api_key, API_METHOD_COSTS.get(resource, 1))
+            return response
+
+    def _record(self, api_key, units):
+        if not quota_ledger:
+            return
+        try:
+            quota_ledger.record_key(self.key_ids[api_key], units)
+        except sqlite3.Error as e:
+            print(f"⚠️  API Key 用量記錄失敗: {e}")
+
+    def _mark_exhausted(self, api_key):
+        if not quota_ledger:
+            return
+        try:
+            quota_ledger.mark_key_exhausted(self.key_ids[api_key])
+        except sqlite3.Error as e:
+            print(f"⚠️  API Key 用量記錄失敗: {e}")
+
+class PooledRequest:
+    """延遲到 execute() 才選擇 Key 的 API 請求"""
+
+    def __init__(self, pool, resource, method, kwargs):
+        self.pool = pool
+        self.resource = resource
+        self.method = method
+        self.kwargs = kwargs
+
+    def execute(self):
+        return self.pool.execute(self.resource, self.method, self.kwargs)
+
+class PooledResource:
+    def __init__(self, pool, resource):
+        self.pool = pool
+        self.resource = resource
+
+    def list(self, **kwargs):
+        return PooledRequest(self.pool, self.resource, 'list', kwargs)
+
+class PooledYouTubeService:
+    """與 googleapiclient 服務相同用法（youtube.search().list(...).execute()），呼叫時由 Key 池選擇 Key"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __getattr__(self, resource):
+        if resource not in API_METHOD_COSTS:
+            raise AttributeError(resource)
+        return lambda: PooledResource(self.pool, resource)
+
+def is_valid_api_key_format(api_key):
+    return api_key.startswith('AIzaSy') and len(api_key) == 39
+
+class YouTubeClientHolder:
+    """全程序共用的 YouTube API 服務
+
+    服務只建立一次（使用套件內建的靜態 discovery 文件，不需連網下載），
+    只有在 .env 檔案修改時間改變時才重新讀取 API Key，Key 改變時才重建 Key 池。
+    YOUTUBE_API_KEYS 可設定多組 Key（逗號分隔），未設定時使用 YOUTUBE_API_KEY。
+    """
+
+    def __init__(self, env_path):
+        self.env_path = env_path
+        self._lock = threading.Lock()
+        self._env_loaded = False
+        self._env_mtime = None
+        self._api_keys = []
+        self._pool = None
+        self._service = None
+
+    def _get_env_mtime(self):
+        try:
+            return os.path.getmtime(self.env_path)
+        except OSError:
+            return None
+
+    def get_api_keys(self):
+        """獲取所有 API Key，只在 .env 檔案變更時重新讀取"""
+        mtime = self._get_env_mtime()
+        if self._env_loaded and mtime == self._env_mtime:
+            return self._api_keys
+        
+        with self._lock:
+            if not self._env_loaded or mtime != self._env_mtime:
+                if mtime is not None:
+                    load_dotenv(self.env_path, override=True)
+                raw_keys = os.getenv('YOUTUBE_API_KEYS') or os.getenv('YOUTUBE_API_KEY') or ''
+                api_keys = []
+                for api_key in raw_keys.split(','):
+                    api_key = api_key.strip()
+                    if api_key and api_key not in api_keys:
+                        api_keys.append(api_key)
+                self._api_keys = api_keys
+                self._env_mtime = mtime
+                self._env_loaded = True
+                for api_key in api_keys:
+                    print(f"🔍 讀取到的 API Key: {api_key[:15] + '...' if len(api_key) > 15 else api_key}")
+            return self._api_keys
+
+    def get_api_key(self):
+        """獲取第一組 API Key"""
+        api_keys = self.get_api_keys()
+        return api_keys[0] if api_keys else None
+
+    def get_pool(self):
+        """取得 Key 池，API Key 改變時才重新建立"""
+        api_keys = self.get_api_keys()
+        pool = self._pool
+        if pool is not None and pool.api_keys == [key for key in api_keys if is_valid_api_key_format(key)]:
+            return pool
+        
+        with self._lock:
+            valid_keys = [api_key for api_key in api_keys if is_valid_api_key_format(api_key)]
+            if self._pool is not None and self._pool.api_keys == valid_keys:
+                return self._pool
+            
+            if not api_keys or api_keys == ['your_youtube_api_key_here']:
+                raise ValueError("請設定有效的 YouTube API Key")
+            
+            # 檢查 API Key 格式
+            for api_key in api_keys:
+                if not is_valid_api_key_format(api_key):
+                    if len(api_keys) == 1:
+                        raise ValueError(f"API Key 格式錯誤。YouTube API Key 應該以 'AIzaSy' 開頭且長度為 39 字符。目前的 Key: {api_key[:10]}...")
+                    print(f"⚠️  略過格式錯誤的 API Key: {api_key[:10]}...")
+            if not valid_keys:
+                raise ValueError("API Key 格式錯誤。YouTube API Key 應該以 'AIzaSy' 開頭且長度為 39 字符")
+            
+            print(f"🔑 使用 {len(valid_keys)} 組 API Key: {', '.join(mask_api_key(api_key) for api_key in valid_keys)}（連線方式: {YOUTUBE_HTTP_TRANSPORT}）")
+            self._pool = ApiKeyPool(valid_keys, DAILY_QUOTA_LIMIT)
+            self._service = PooledYouTubeService(self._pool)
+            return self._pool
+
+    def get_service(self):
+        """取得 YouTube API 服務（各請求由 Key 池選擇 Key）"""
+        self.get_pool()
+        return self._service
+
+youtube_client = YouTubeClientHolder(ENV_FILE_PATH)
+
 def get_api_key():
-    """獲取 API Key，每次都重新讀取環境變數"""
-    # 重新載入環境變數以確保最新值
-    load_dotenv(override=True)
-    api_key = os.getenv('YOUTUBE_API_KEY')
-    print(f"🔍 讀取到的 API Key: {api_key[:15] + '...' if api_key and len(api_key) > 15 else api_key}")
-    return api_key
+    """獲取第一組 API Key（.env 檔案修改後才會重新讀取）"""
+    return youtube_client.get_api_key()
 
 def get_youtube_service():
-    """建立 YouTube API 服務"""
-    api_key = get_api_key()
+    """取得共用的 YouTube API 服務"""
+    return youtube_client.get_service()
+
+def check_api_circuit():
+    """斷路器開啟中（所有 Key 配額用完或無效）時拋出 YouTubeApiError"""
+    youtube_client.get_pool().breaker.check()
+
+def get_daily_quota_limit():
+    """今日可用的總配額（每組可用的 Key 各 DAILY_QUOTA_LIMIT 單位）"""
+    try:
+        return youtube_client.get_pool().daily_limit() or DAILY_QUOTA_LIMIT
+    except ValueError:
+        return DAILY_QUOTA_LIMIT
+
+def get_db_connection(db_path):
+    """開啟本機 SQLite 資料庫（自動建立目錄，使用 WAL 以支援多執行緒讀寫）"""
+    db_dir = os.path.dirname(db_path)
+    if db_dir:
+        os.makedirs(db_dir, exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    return conn
+
+class SearchPageCache:
+    """search().list 分頁結果的本機快取（SQLite），依 TTL 過期並限制最大筆數"""
+
+    def __init__(self, db_path, ttl, max_entries):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS search_pages (
+                    cache_key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_search_pages_last_access ON search_pages (last_access)')
+
+    @staticmethod
+    def make_key(search_params):
+        """將搜尋參數（含 pageToken）正規化後產生快取鍵"""
+        normalized = {k: v for k, v in search_params.items() if v is not None}
+        if isinstance(normalized.get('q'), str):
+            normalized['q'] = ' '.join(normalized['q'].lower().split())
+        raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, search_params):
+        """讀取快取，過期或不存在時回傳 None"""
+        key = self.make_key(search_params)
+        now = time.time()
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            row = conn.execute(
+                'SELECT response, created_at FROM search_pages WHERE cache_key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute('DELETE FROM search_pages WHERE cache_key = ?', (key,))
+                return None
+            conn.execute('UPDATE search_pages SET last_access = ? WHERE cache_key = ?', (now, key))
+        return json.loads(row[0])
+
+    def set(self, search_params, response):
+        """寫入快取，並清除過期與超出上限的舊資料"""
+        key = self.make_key(search_params)
+        now = time.time()
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO search_pages (cache_key, response, created_at, last_access) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(response, ensure_ascii=False), now, now)
+            )
+            conn.execute('DELETE FROM search_pages WHERE created_at < ?', (now - self.ttl,))
+            overflow = conn.execute('SELECT COUNT(*) FROM search_pages').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    'DELETE FROM search_pages WHERE cache_key IN '
+                    '(SELECT cache_key FROM search_pages ORDER BY last_access ASC LIMIT ?)',
+                    (overflow,)
+                )
+
+def create_search_cache():
+    """依設定建立搜尋快取，失敗時停用快取而不影響搜尋"""
+    if not SEARCH_CACHE_ENABLED or SEARCH_CACHE_TTL <= 0:
+        return None
+    try:
+        return SearchPageCache(SEARCH_CACHE_PATH, SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ENTRIES)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️  無法建立搜尋快取，將停用快取: {e}")
+        return None
+
+search_page_cache = create_search_cache()
+
+def fetch_search_page(youtube, search_params):
+    """執行 search().list，優先使用快取；回傳 (搜尋回應, 是否來自快取)"""
+    if search_page_cache:
+        try:
+            cached_response = search_page_cache.get(search_params)
+        except sqlite3.Error as e:
+            print(f"⚠️  讀取搜尋快取失敗: {e}")
+            cached_response = None
+        if cached_response is not None:
+            print(f"💾 搜尋快取命中 (pageToken={search_params.get('pageToken', '-')})，不消耗配額")
+            return cached_response, True
     
-    if not api_key or api_key == 'your_youtube_api_key_here':
-        raise ValueError("請設定有效的 YouTube API Key")
+    search_response = youtube.search().list(**search_params).execute()
     
-    # 檢查 API Key 格式
-    if not api_key.startswith('AIzaSy') or len(api_key) != 39:
-        raise ValueError(f"API Key 格式錯誤。YouTube API Key 應該以 'AIzaSy' 開頭且長度為 39 字符。目前的 Key: {api_key[:10]}...")
+    # 更新配額使用（搜尋 API 調用）
+    update_quota_usage(search_calls=1)
+    
+    if search_page_cache:
+        try:
+            search_page_cache.set(search_params, search_response)
+        except sqlite3.Error as e:
+            print(f"⚠️  寫入搜尋快取失敗: {e}")
+    
+    return search_response, False
+
+class VideoDetailCache:
+    """影片詳細資訊快取（SQLite），snippet/contentDetails 與 statistics 分開計算 TTL"""
+
+    def __init__(self, db_path, meta_ttl, stats_ttl, max_entries):
+        self.db_path = db_path
+        self.meta_ttl = meta_ttl
+        self.stats_ttl = stats_ttl
+        self.max_entries = max_entries
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS video_details (
+                    video_id TEXT PRIMARY KEY,
+                    snippet TEXT NOT NULL,
+                    content_details TEXT NOT NULL,
+                    statistics TEXT NOT NULL,
+                    meta_fetched_at REAL NOT NULL,
+                    stats_fetched_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_video_details_stats_fetched ON video_details (stats_fetched_at)')
+
+    def lookup(self, video_ids):
+        """查詢快取，回傳 {video_id: (item, 基本資料是否有效, 統計資料是否有效)}
+
+        item 的 statsFetchedAt 為統計資料實際向 API 取得的時間，供觀看速度追蹤使用。
+        """
+        now = time.time()
+        found = {}
+        with closing(get_db_connection(self.db_path)) as conn:
+            for i in range(0, len(video_ids), 500):
+                chunk = video_ids[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = conn.execute(
+                    f'SELECT video_id, snippet, content_details, statistics, meta_fetched_at, stats_fetched_at '
+                    f'FROM video_details WHERE video_id IN ({placeholders})',
+                    chunk
+                ).fetchall()
+                for video_id, snippet, content_details, statistics, meta_fetched_at, stats_fetched_at in rows:
+                    item = {
+                        'id': video_id,
+                        'snippet': json.loads(snippet),
+                        'contentDetails': json.loads(content_details),
+                        'statistics': json.loads(statistics),
+                        'statsFetchedAt': stats_fetched_at
+                    }
+                    found[video_id] = (
+                        item,
+                        now - meta_fetched_at <= self.meta_ttl,
+                        now - stats_fetched_at <= self.stats_ttl
+                    )
+        return found
+
+    def store_items(self, items):
+        """寫入完整的影片資料（snippet、statistics、contentDetails）"""
+        now = time.time()
+        rows = [(
+            item['id'],
+            json.dumps(item.get('snippet', {}), ensure_ascii=False),
+            json.dumps(item.get('contentDetails', {}), ensure_ascii=False),
+            json.dumps(item.get('statistics', {}), ensure_ascii=False),
+            now, now
+        ) for item in items]
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO video_details '
+                '(video_id, snippet, content_details, statistics, meta_fetched_at, stats_fetched_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            overflow = conn.execute('SELECT COUNT(*) FROM video_details').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                conn.execute(
+                    'DELETE FROM video_details WHERE video_id IN '
+                    '(SELECT video_id FROM video_details ORDER BY stats_fetched_at ASC LIMIT ?)',
+                    (overflow,)
+                )
+
+    def store_statistics(self, items):
+        """只更新統計資料（觀看數、按讚數、留言數）"""
+        now = time.time()
+        rows = [(json.dumps(item.get('statistics', {}), ensure_ascii=False), now, item['id']) for item in items]
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.executemany(
+                'UPDATE video_details SET statistics = ?, stats_fetched_at = ? WHERE video_id = ?',
+                rows
+            )
+
+def create_video_cache():
+    """依設定建立影片詳細資訊快取，失敗時停用快取而不影響搜尋"""
+    if not VIDEO_CACHE_ENABLED:
+        return None
+    try:
+        return VideoDetailCache(VIDEO_CACHE_PATH, VIDEO_META_TTL, VIDEO_STATS_TTL, VIDEO_CACHE_MAX_ENTRIES)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️  無法建立影片快取，將停用快取: {e}")
+        return None
+
+video_detail_cache = create_video_cache()
+
+# 全程序共用、有上限的影片詳細資訊查詢執行緒池
+detail_executor = ThreadPoolExecutor(max_workers=DETAIL_FETCH_WORKERS, thread_name_prefix='video-detail')
+# 多地區搜尋時並行取得各地區搜尋頁的執行緒池
+region_executor = ThreadPoolExecutor(max_workers=REGION_SEARCH_WORKERS, thread_name_prefix='region-search')
+
+def fetch_video_details(youtube, video_ids):
+    """取得影片詳細資訊，只向 API 查詢快取中缺少或過期的影片
+
+    回傳 (依 video_ids 順序排列的影片資料, 成功的 videos.list 呼叫次數)
+    """
+    cached = {}
+    if video_detail_cache:
+        try:
+            cached = video_detail_cache.lookup(video_ids)
+        except sqlite3.Error as e:
+            print(f"⚠️  讀取影片快取失敗: {e}")
+    
+    # 基本資料缺少或過期：重新取得完整資料；只有統計資料過期：只更新 statistics
+    full_ids = [vid for vid in video_ids if vid not in cached or not cached[vid][1]]
+    stats_ids = [vid for vid in video_ids if vid in cached and cached[vid][1] and not cached[vid][2]]
+    items_by_id = {vid: entry[0] for vid, entry in cached.items()}
+    call_count = 0
+    
+    if len(full_ids) + len(stats_ids) < len(video_ids):
+        print(f"💾 影片快取命中 {len(video_ids) - len(full_ids) - len(stats_ids)} 個，"
+              f"需查詢完整資料 {len(full_ids)} 個、更新統計 {len(stats_ids)} 個")
+    
+    for part, ids in (('snippet,statistics,contentDetails', full_ids), ('statistics', stats_ids)):
+        for i in range(0, len(ids), VIDEO_BATCH_SIZE):
+            batch_ids = ids[i:i + VIDEO_BATCH_SIZE]
+            try:
+                videos_response = youtube.videos().list(
+                    part=part,
+                    id=','.join(batch_ids),
+                    fields=build_video_fields_param(part.split(','))
+                ).execute()
+            except YouTubeApiError as e:
+                # 短暫性錯誤已重試過；只有統計資料更新失敗時沿用快取中的舊資料，其他情況交給呼叫端處理
+                if part != 'statistics' or e.kind in ('quota', 'auth'):
+                    raise
+                print(f"⚠️ 影片統計更新失敗，沿用快取資料 ({len(batch_ids)} 個): {e}")
+                continue
+            
+            items = videos_response.get('items', [])
+            call_count += 1
+            fetched_at = time.time()
+            
+            # 更新配額使用（影片詳情 API 調用，每次最多 50 個影片 1 單位）
+            update_quota_usage(video_calls=1)
+            
+            if part == 'statistics':
+                for item in items:
+                    if item['id'] in items_by_id:
+                        items_by_id[item['id']]['statistics'] = item.get('statistics', {})
+                        items_by_id[item['id']]['statsFetchedAt'] = fetched_at
+            else:
+                for item in items:
+                    item['statsFetchedAt'] = fetched_at
+                    items_by_id[item['id']] = item
+            
+            if video_detail_cache and items:
+                try:
+                    if part == 'statistics':
+                        video_detail_cache.store_statistics(items)
+                    else:
+                        video_detail_cache.store_items(items)
+                except sqlite3.Error as e:
+                    print(f"⚠️  寫入影片快取失敗: {e}")
+    
+    return [items_by_id[vid] for vid in video_ids if vid in items_by_id], call_count
+
+def api_calls_cost(api_calls):
+    """依本次搜尋的 API 呼叫次數估算已使用的配額單位"""
+    return api_calls['search_count'] * 100 + api_calls['video_details_count'] + api_calls['categories_call']
+
+def collect_search_candidates(youtube, search_params, categories, ranking, api_calls, unit_budget,
+                              summary_fields=None):
+    """逐頁搜尋並篩選候選影片，取得足夠符合條件的影片或達到預算上限時提早停止
+
+    每頁的新影片交給背景執行緒查詢詳細資訊，同時依目前的篩選通過率估算是否還需要下一頁：
+    預估不夠時先取得下一頁（與詳細資訊查詢並行），預估足夠時等待結果確認後再決定。
+    過程中產生進度與符合條件影片的事件（供串流顯示），
+    結束時回傳 (依搜尋順序排列的候選影片, 搜尋統計)，呼叫端以 yield from 取得。
+    """
+    candidates = []
+    seen_ids = set()
+    pending = deque()  # (影片數, 詳細資訊查詢 future)，依頁序處理
+    resolved = {'ids': 0, 'streamed': 0}
+    max_results = ranking.limit
+    
+    def dispatch_page(items):
+        page_ids = []
+        for item in items:
+            video_id = item['id']['videoId']
+            if video_id not in seen_ids:
+                page_ids.append(video_id)
+                seen_ids.add(video_id)
+        if page_ids:
+            pending.append((len(page_ids), detail_executor.submit(fetch_video_details, youtube, page_ids)))
+    
+    def resolve_next():
+        id_count, future = pending.popleft()
+        page_items, detail_calls = future.result()
+        # 記錄影片詳情 API 呼叫次數用於配額計算
+        api_calls['video_details_count'] += detail_calls
+        resolved['ids'] += id_count
+        events = []
+        for item in page_items:
+            video = Video.from_item(item, categories)
+            candidates.append(video)
+            # 符合全部條件的影片先送出預覽，最終排序以結果事件為準
+            if ranking.add(video) == 'strict' and resolved['streamed'] < max_results:
+                resolved['streamed'] += 1
+                events.append({'type': 'video', 'video': serialize_videos([video], summary_fields)[0]})
+        return events
+    
+    def progress_event():
+        return {
+            'type': 'progress',
+            'searchPages': search_pages,
+            'candidateIds': len(seen_ids),
+            'candidates': len(candidates),
+            'qualified': ranking.counts['strict']
+        }
+    
+    def projected_qualified():
+        # 尚未有任何結果時無法估算，視為可能足夠以等待第一頁結果
+        if not resolved['ids']:
+            return float('inf')
+        pending_ids = sum(id_count for id_count, _ in pending)
+        return ranking.counts['strict'] * (1 + pending_ids / resolved['ids'])
+    
+    search_pages = 0
+    stop_reason = 'no_more_pages'
+    while True:
+        search_response, from_cache = fetch_search_page(youtube, search_params)
+        search_pages += 1
+        if not from_cache:
+            api_calls['search_count'] += 1
+        dispatch_page(search_response.get('items', []))
+        yield progress_event()
+        
+        # 已完成的詳細資訊先處理，讓結果儘早顯示
+        while pending and pending[0][1].done():
+            yield from resolve_next()
+        
+        next_page_token = search_response.get('nextPageToken')
+        if not next_page_token:
+            break
+        if search_pages >= MAX_SEARCH_PAGES:
+            print(f"⚠️ 已達到搜尋頁數上限 ({MAX_SEARCH_PAGES}頁)，停止搜尋")
+            stop_reason = 'page_limit'
+            break
+        
+        # 預估已足夠時等待詳細資訊結果確認
+        while pending and projected_qualified() >= max_results:
+            yield from resolve_next()
+        if ranking.counts['strict'] >= max_results:
+            print(f"🎯 已取得 {ranking.counts['strict']} 個符合條件的影片，提早停止搜尋")
+            stop_reason = 'enough_results'
+            break
+        
+        # 預估下一頁成本（尚未完成的影片詳情查詢 + 下一頁搜尋與影片詳情），超過預算則停止
+        estimated_cost = api_calls_cost(api_calls) + len(pending) * VIDEO_PAGE_DETAIL_UNITS + SEARCH_PAGE_UNITS
+        if estimated_cost > unit_budget:
+            print(f"💰 下一頁預估累計 {estimated_cost} 單位，超過本次預算 {unit_budget} 單位，停止搜尋")
+            stop_reason = 'budget'
+            break
+        
+        print(f"📄 已取得 {search_pages} 頁，符合條件 {ranking.counts['strict']}/{max_results} 個，繼續獲取...")
+        search_params['pageToken'] = next_page_token
+    
+    # 依搜尋頁順序合併剩餘的詳細資訊
+    while pending:
+        yield from resolve_next()
+    yield progress_event()
+    
+    stats = {
+        'searchPages': search_pages,
+        'candidateIds': len(seen_ids),
+        'candidates': len(candidates),
+        'stopReason': stop_reason
+    }
+    return candidates, stats
+
+def collect_multi_region_candidates(youtube, region_params, ranking, api_calls, unit_budget,
+                                    summary_fields=None):
+    """多地區同時搜尋相同條件，依輪次並行取得各地區的下一頁
+
+    每一輪以 region_executor（有上限的執行緒池）同時取得各地區的搜尋頁，跨地區去除重複的影片 ID
+    後才查詢詳細資訊，多個地區都搜尋到的影片只付一次配額。各地區取得足夠符合條件的影片、
+    沒有下一頁或預算不足時停止。影片的 regions 記錄搜尋到它的地區（依地區順序），
+    類別名稱使用第一個搜尋到它的地區的類別表。
+    產生的事件與 collect_search_candidates 相同，結束時回傳 (候選影片, 搜尋統計, 各地區候選影片與統計)。
+    """
+    candidates = []
+    videos_by_id = {}
+    region_results = {
+        region: {
+            'candidates': [],
+            'seen': set(),
+            'ranking': TieredFilter(ranking.min_views, ranking.max_duration_seconds, ranking.limit),
+            'stats': {'searchPages': 0, 'candidateIds': 0, 'stopReason': 'no_more_pages'}
+        }
+        for region in region_params
+    }
+    region_order = {region: index for index, region in enumerate(region_params)}
+    # 類別 ID 的名稱依地區而不同，各地區分別取得類別表（依地區快取）
+    region_categories = {}
+    for region in region_params:
+        region_categories[region], categories_called = category_cache.get(youtube, region)
+        if categories_called:
+            api_calls['categories_call'] += 1
+    first_region = {}
+    active = list(region_params)
+    search_pages = 0
+    shared_ids = 0
+    streamed = 0
+    stop_reason = 'all_regions_done'
+    
+    while active:
+        # 預算不足以讓所有地區再搜尋一頁（搜尋 100 單位 + 影片詳情）時，只保留預算內的地區
+        affordable = max(0, (unit_budget - api_calls_cost(api_calls)) // SEARCH_PAGE_UNITS)
+        if affordable < len(active):
+            for region in active[affordable:]:
+                region_results[region]['stats']['stopReason'] = 'budget'
+            print(f"💰 剩餘預算只夠再搜尋 {affordable} 個地區，停止搜尋: {', '.join(active[affordable:])}")
+            stop_reason = 'budget'
+            active = active[:affordable]
+            if not active:
+                break
+        
+        futures = [
+            (region, region_executor.submit(fetch_search_page, youtube, dict(region_params[region])))
+            for region in active
+        ]
+        page_ids = {}
+        new_ids = []
+        new_id_set = set()
+        for region, future in futures:
+            search_response, from_cache = future.result()
+            search_pages += 1
+            if not from_cache:
+                api_calls['search_count'] += 1
+            result = region_results[region]
+            result['stats']['searchPages'] += 1
+            ids = []
+            for item in search_response.get('items', []):
+                video_id = item['id']['videoId']
+                if video_id in result['seen']:
+                    continue
+                result['seen'].add(video_id)
+                ids.append(video_id)
+                if video_id in videos_by_id or video_id in new_id_set:
+                    shared_ids += 1
+                else:
+                    new_ids.append(video_id)
+                    new_id_set.add(video_id)
+                    first_region[video_id] = region
+            page_ids[region] = ids
+            result['stats']['candidateIds'] = len(result['seen'])
+            result['nextPageToken'] = search_response.get('nextPageToken')
+        
+        # 只查詢各地區都還沒取得的影片，分批並行查詢
+        detail_futures = [
+            detail_executor.submit(fetch_video_details, youtube, new_ids[i:i + VIDEO_BATCH_SIZE])
+            for i in range(0, len(new_ids), VIDEO_BATCH_SIZE)
+        ]
+        for future in detail_futures:
+            page_items, detail_calls = future.result()
+            api_calls['video_details_count'] += detail_calls
+            for item in page_items:
+                video = Video.from_item(item, region_categories[first_region[item['id']]])
+                video.regions = []
+                videos_by_id[video.videoId] = video
+                candidates.append(video)
+                if ranking.add(video) == 'strict' and streamed < ranking.limit:
+                    streamed += 1
+                    yield {'type': 'video', 'video': serialize_videos([video], summary_fields)[0]}
+        
+        for region in active:
+            result = region_results[region]
+            for video_id in page_ids[region]:
+                video = videos_by_id.get(video_id)
+                if video is None:
+                    continue
+                video.regions.append(region)
+                result['candidates'].append(video)
+                result['ranking'].add(video)
+        
+        yield {
+            'type': 'progress',
+            'searchPages': search_pages,
+            'candidateIds': len(videos_by_id),
+            'candidates': len(candidates),
+            'qualified': ranking.counts['strict']
+        }
+        
+        print(f"🌏 {len(active)} 個地區各搜尋 1 頁，新影片 {len(new_ids)} 個，跨地區重複 {shared_ids} 個（累計）不重複查詢")
+        still_active = []
+        for region in active:
+            result = region_results[region]
+            stats = result['stats']
+            if not result['nextPageToken']:
+                stats['stopReason'] = 'no_more_pages'
+            elif stats['searchPages'] >= MAX_SEARCH_PAGES:
+                stats['stopReason'] = 'page_limit'
+            elif result['ranking'].counts['strict'] >= ranking.limit:
+                stats['stopReason'] = 'enough_results'
+            else:
+                region_params[region]['pageToken'] = result['nextPageToken']
+                still_active.append(region)
+        active = still_active
+    
+    for video in candidates:
+        video.regions.sort(key=region_order.get)
+    
+    stats = {
+        'searchPages': search_pages,
+        'candidateIds': len(videos_by_id),
+        'candidates': len(candidates),
+        'sharedIds': shared_ids,
+        'stopReason': stop_reason
+    }
+    regions = {
+        region: {'candidates': result['candidates'], 'stats': dict(result['stats'], candidates=len(result['candidates']))}
+        for region, result in region_results.items()
+    }
+    return candidates, stats, regions
+
+def collect_trending_candidates(youtube, region_code, category_filter, categories, ranking, api_calls,
+                                published_after=None, summary_fields=None):
+    """讀取地區熱門影片榜作為候選影片（videos().list chart=mostPopular，每頁 1 單位且已包含詳細資訊）
+
+    熱門榜不支援上傳時間條件，published_after（時間戳）在本機篩選。產生的事件與
+    collect_search_candidates 相同，結束時回傳 (候選影片, 搜尋統計)。
+    """
+    candidates = []
+    seen_ids = set()
+    streamed = 0
+    parts = ['snippet', 'statistics', 'contentDetails']
+    list_params = {
+        'part': ','.join(parts),
+        'chart': 'mostPopular',
+        'regionCode': region_code,
+        'maxResults': VIDEO_BATCH_SIZE,
+        'fields': 'nextPageToken,' + build_video_fields_param(parts)
+    }
+    if category_filter != 'all':
+        list_params['videoCategoryId'] = category_filter
+    
+    pages = 0
+    stop_reason = 'no_more_pages'
+    while True:
+        response = youtube.videos().list(**list_params).execute()
+        pages += 1
+        api_calls['video_details_count'] += 1
+        update_quota_usage(video_calls=1)
+        
+        items = [item for item in response.get('items', []) if item['id'] not in seen_ids]
+        seen_ids.update(item['id'] for item in items)
+        # 熱門榜資料同時寫入影片快取，之後搜尋到相同影片時不必再查詢
+        if video_detail_cache and items:
+            try:
+                video_detail_cache.store_items(items)
+            except sqlite3.Error as e:
+                print(f"⚠️  寫入影片快取失敗: {e}")
+        
+        for item in items:
+            video = Video.from_item(item, categories)
+            if published_after and (video.publishedTimestamp or 0) < published_after:
+                continue
+            candidates.append(video)
+            if ranking.add(video) == 'strict' and streamed < ranking.limit:
+                streamed += 1
+                yield {'type': 'video', 'video': serialize_videos([video], summary_fields)[0]}
+        
+        yield {
+            'type': 'progress',
+            'searchPages': pages,
+            'candidateIds': len(seen_ids),
+            'candidates': len(candidates),
+            'qualified': ranking.counts['strict']
+        }
+        
+        next_page_token = response.get('nextPageToken')
+        if not next_page_token:
+            break
+        if pages >= TRENDING_MAX_PAGES:
+            stop_reason = 'page_limit'
+            break
+        list_params['pageToken'] = next_page_token
     
-    print(f"🔑 使用 API Key: {api_key[:15]}...{api_key[-5:]}")
-    return build(YOUTUBE_API_SERVICE_NAME, YOUTUBE_API_VERSION, developerKey=api_key)
+    print(f"🔥 {region_code} 熱門影片榜: {pages} 頁、{len(seen_ids)} 個影片，時間範圍內 {len(candidates)} 個")
+    stats = {
+        'searchPages': pages,
+        'candidateIds': len(seen_ids),
+        'candidates': len(candidates),
+        'stopReason': stop_reason
+    }
+    return candidates, stats
+
+def get_search_anchor_time():
+    """取得搜尋用的基準時間（UTC）；確定性模式下對齊到快取時間窗起點，讓同一時間窗內的查詢參數一致"""
+    now = time.time()
+    if search_page_cache and SEARCH_CACHE_DETERMINISTIC:
+        now -= now % SEARCH_CACHE_TTL
+    return datetime.fromtimestamp(now, timezone.utc)
+
+def get_search_random(*seed_parts):
+    """取得搜尋多樣化用的亂數產生器；確定性模式下同一查詢在同一快取時間窗內結果固定"""
+    if search_page_cache and SEARCH_CACHE_DETERMINISTIC:
+        window = int(time.time() // SEARCH_CACHE_TTL)
+        return random.Random('|'.join(str(part) for part in seed_parts + (window,)))
+    return random
 
 def get_time_filter(hours):
     """根據小時數產生時間過濾器"""
-    if hours == 24:
-        published_after = datetime.utcnow() - timedelta(hours=24)
-    elif hours == 12:
-        published_after = datetime.utcnow() - timedelta(hours=12)
-    elif hours == 6:
-        published_after = datetime.utcnow() - timedelta(hours=6)
+    if hours in (24, 12, 6):
+        published_after = get_search_anchor_time() - timedelta(hours=hours)
     else:
         return None
     
@@ -69,18 +1311,21 @@ def format_duration(duration):
     """將 ISO 8601 格式的時間轉換為可讀格式"""
     try:
         parsed_duration = isodate.parse_duration(duration)
-        total_seconds = int(parsed_duration.total_seconds())
-        hours = total_seconds // 3600
-        minutes = (total_seconds % 3600) // 60
-        seconds = total_seconds % 60
-        
-        if hours > 0:
-            return f"{hours}:{minutes:02d}:{seconds:02d}"
-        else:
-            return f"{minutes}:{seconds:02d}"
+        return format_duration_seconds(int(parsed_duration.total_seconds()))
     except:
         return duration
 
+def format_duration_seconds(total_seconds):
+    """將秒數轉換為可讀格式（h:mm:ss 或 m:ss）"""
+    hours = total_seconds // 3600
+    minutes = (total_seconds % 3600) // 60
+    seconds = total_seconds % 60
+    
+    if hours > 0:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    else:
+        return f"{minutes}:{seconds:02d}"
+
 def get_duration_seconds(duration):
     """將 ISO 8601 格式的時間轉換為秒數"""
     try:
@@ -103,89 +1348,1250 @@ def format_view_count(view_count):
         return view_count
 
 def get_video_categories(youtube, region_code='TW'):
-    """獲取YouTube影片類別清單"""
-    try:
-        categories_response = youtube.videoCategories().list(
-            part='snippet',
-            regionCode=region_code
-        ).execute()
-        
-        categories = {}
-        for item in categories_response['items']:
-            categories[item['id']] = item['snippet']['title']
+    """向 API 獲取YouTube影片類別清單（失敗時拋出例外）"""
+    categories_response = youtube.videoCategories().list(
+        part='snippet',
+        regionCode=region_code,
+        fields='items(id,snippet/title)'
+    ).execute()
+    
+    # 更新配額使用（類別 API 調用）
+    update_quota_usage(category_calls=1)
+    
+    categories = {}
+    for item in categories_response['items']:
+        categories[item['id']] = item['snippet']['title']
+    
+    return categories
+
+class CategoryCache:
+    """各地區影片類別表的快取，查詢失敗時沿用上次成功取得的類別表"""
+
+    def __init__(self, ttl, retry_interval):
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        # region -> {'categories': dict, 'fetched_at': float, 'failed_at': float}
+        self._tables = {}
+
+    def get(self, youtube, region_code):
+        """取得地區類別表；回傳 (類別表, 是否成功呼叫了 API)"""
+        region_code = (region_code or 'TW').upper()
+        now = time.time()
+        entry = self._tables.get(region_code)
+        if entry and entry['categories'] and now - entry['fetched_at'] <= self.ttl:
+            return entry['categories'], False
+        if entry and now - entry.get('failed_at', 0) < self.retry_interval:
+            return entry['categories'], False
         
-        return categories
-    except Exception as e:
-        print(f"⚠️  無法獲取類別資訊: {e}")
-        return {}
+        with self._lock:
+            # 等待鎖的期間其他執行緒可能已經更新
+            entry = self._tables.get(region_code)
+            if entry and entry['categories'] and now - entry['fetched_at'] <= self.ttl:
+                return entry['categories'], False
+            
+            try:
+                categories = get_video_categories(youtube, region_code)
+            except Exception as e:
+                print(f"⚠️  無法獲取 {region_code} 類別資訊: {e}")
+                stale = entry['categories'] if entry else {}
+                if stale:
+                    print(f"♻️  沿用上次取得的 {region_code} 類別表（{len(stale)} 個類別）")
+                self._tables[region_code] = {
+                    'categories': stale,
+                    'fetched_at': entry['fetched_at'] if entry else 0,
+                    'failed_at': time.time()
+                }
+                # 與影片詳細資訊一致，失敗的呼叫不計入配額與 API 呼叫次數
+                return stale, False
+            
+            self._tables[region_code] = {'categories': categories, 'fetched_at': time.time(), 'failed_at': 0}
+            return categories, True
+
+    def warm_up(self, youtube, regions):
+        """預先載入指定地區的類別表"""
+        for region_code in regions:
+            categories, _ = self.get(youtube, region_code)
+            print(f"🏷️  預先載入 {region_code} 類別: {len(categories)} 個")
+
+category_cache = CategoryCache(CATEGORY_CACHE_TTL, CATEGORY_RETRY_INTERVAL)
+
+def warm_up_category_cache():
+    """啟動時在背景預先載入常用地區的類別表，失敗不影響啟動"""
+    def _warm_up():
+        try:
+            category_cache.warm_up(get_youtube_service(), CATEGORY_WARMUP_REGIONS)
+        except Exception as e:
+            print(f"⚠️  預先載入類別失敗: {e}")
+    
+    if CATEGORY_WARMUP_REGIONS:
+        threading.Thread(target=_warm_up, name='category-warmup', daemon=True).start()
 
 def get_category_name(category_id, categories_dict):
     """根據類別ID獲取類別名稱"""
     return categories_dict.get(category_id, f'未知類別 ({category_id})')
 
-def update_quota_usage(search_calls=0, video_calls=0, category_calls=0):
-    """更新真實的 API 配額使用量"""
-    global daily_quota_usage
-    
-    # 檢查是否是新的一天，如果是則重置
-    today = datetime.now().strftime('%Y-%m-%d')
-    if daily_quota_usage['date'] != today:
-        print(f"🗓️ 新的一天開始，重置配額計算")
-        daily_quota_usage = {
-            'date': today,
-            'search_calls': 0,
-            'video_calls': 0,
-            'category_calls': 0,
-            'total_cost': 0
+def parse_published_timestamp(published_at):
+    """將 ISO 8601 上傳時間轉換為 Unix 時間戳，無法解析時回傳 0"""
+    try:
+        return datetime.fromisoformat(published_at.replace('Z', '+00:00')).timestamp()
+    except (AttributeError, ValueError):
+        return 0.0
+
+# to_item 之外需要保存的影片欄位
+VIDEO_RECORD_EXTRA_FIELDS = ('categoryName', 'filterTier', 'viewVelocity', 'viewAcceleration', 'regions')
+
+class Video:
+    """單一影片的搜尋結果紀錄
+
+    每個 API 回傳項目只解析一次：觀看/按讚/留言數轉為整數，長度秒數與上傳時間戳預先計算，
+    可讀格式（觀看數、長度）只在輸出 JSON 時才產生。欄位名稱與輸出的 JSON 欄位一致。
+    """
+
+    __slots__ = ('videoId',) + tuple(name for _, name, _ in VIDEO_FIELD_SCHEMA) + (
+        'categoryName', 'durationSeconds', 'publishedTimestamp', 'filterTier', 'viewVelocity', 'viewAcceleration',
+        'regions', 'statsFetchedAt'
+    )
+
+    @classmethod
+    def from_item(cls, item, categories):
+        """依欄位定義解析 API 回傳的影片資料"""
+        video = cls()
+        video.videoId = item['id']
+        for part, name, default in VIDEO_FIELD_SCHEMA:
+            value = item.get(part, {}).get(name, default)
+            if type(default) is int:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    value = default
+            setattr(video, name, value)
+        
+        video.categoryName = get_category_name(video.categoryId, categories)
+        video.durationSeconds = get_duration_seconds(video.duration)
+        video.publishedTimestamp = parse_published_timestamp(video.publishedAt)
+        video.filterTier = None
+        video.viewVelocity = None
+        video.viewAcceleration = None
+        video.regions = None
+        # 統計資料向 API 取得的時間（來自影片快取時為當時查詢的時間，未知時為 None）
+        video.statsFetchedAt = item.get('statsFetchedAt')
+        return video
+
+    @property
+    def url(self):
+        return f"https://www.youtube.com/watch?v={self.videoId}"
+
+    @property
+    def formattedViewCount(self):
+        return format_view_count(self.viewCount)
+
+    @property
+    def formattedDuration(self):
+        if self.durationSeconds:
+            return format_duration_seconds(self.durationSeconds)
+        return format_duration(self.duration)
+
+    @property
+    def thumbnail(self):
+        """單一縮圖網址（優先使用中尺寸）"""
+        thumbnails = self.thumbnails or {}
+        for size in ('medium', 'default'):
+            url = thumbnails.get(size, {}).get('url')
+            if url:
+                return url
+        return ''
+
+    def to_item(self):
+        """轉回 API 回傳項目的格式（from_item 的反向），供本機資料庫保存"""
+        item = {'id': self.videoId}
+        for part, name, _ in VIDEO_FIELD_SCHEMA:
+            item.setdefault(part, {})[name] = getattr(self, name)
+        return item
+
+    def to_record(self):
+        """可存成 JSON 的完整紀錄（to_item 加上類別名稱、分級、觀看速度與地區），供共用的結果暫存使用"""
+        record = self.to_item()
+        for name in VIDEO_RECORD_EXTRA_FIELDS:
+            record[name] = getattr(self, name)
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        """還原 to_record 的紀錄"""
+        video = cls.from_item(record, {})
+        for name in VIDEO_RECORD_EXTRA_FIELDS:
+            setattr(video, name, record.get(name))
+        return video
+
+    def to_summary(self, fields):
+        """只輸出指定欄位的精簡格式（數量欄位為整數，未放寬篩選時省略 filterTier）"""
+        summary = {}
+        for name in fields:
+            value = getattr(self, name)
+            if name == 'filterTier' and value in (None, 'strict'):
+                continue
+            summary[name] = value
+        return summary
+
+    def to_dict(self):
+        """轉換為搜尋結果 JSON 格式（數量欄位維持字串以相容既有格式）"""
+        video_info = {'videoId': self.videoId}
+        for _, name, default in VIDEO_FIELD_SCHEMA:
+            value = getattr(self, name)
+            video_info[name] = str(value) if type(default) is int else value
+        
+        video_info['categoryName'] = self.categoryName
+        video_info['url'] = self.url
+        video_info['formattedViewCount'] = self.formattedViewCount
+        video_info['formattedDuration'] = self.formattedDuration
+        if self.filterTier:
+            video_info['filterTier'] = self.filterTier
+        if self.viewVelocity is not None:
+            video_info['viewVelocity'] = self.viewVelocity
+            video_info['viewAcceleration'] = self.viewAcceleration
+        if self.regions:
+            video_info['regions'] = self.regions
+        return video_info
+
+# 可在摘要與 /results 中選取的欄位
+VIDEO_RESULT_FIELDS = Video.__slots__ + ('url', 'thumbnail', 'formattedViewCount', 'formattedDuration')
+
+for name in RESULT_SUMMARY_FIELDS:
+    if name not in VIDEO_RESULT_FIELDS:
+        print(f"⚠️  RESULT_SUMMARY_FIELDS 中的欄位 {name} 不存在，已忽略")
+RESULT_SUMMARY_FIELDS = [name for name in RESULT_SUMMARY_FIELDS if name in VIDEO_RESULT_FIELDS]
+
+# /results 可用的排序欄位
+VIDEO_SORT_KEYS = {
+    'viewCount': attrgetter('viewCount'),
+    'likeCount': attrgetter('likeCount'),
+    'commentCount': attrgetter('commentCount'),
+    'publishedAt': attrgetter('publishedTimestamp'),
+    'duration': attrgetter('durationSeconds'),
+    'velocity': lambda video: video.viewVelocity or 0,
+    'acceleration': lambda video: video.viewAcceleration or 0,
+}
+
+# 搜尋結果的排名依據：觀看次數、每小時觀看增加數或觀看加速度
+RANKING_KEYS = ('viewCount', 'velocity', 'acceleration')
+
+def parse_int_param(data, name, default):
+    """讀取整數參數；未提供或為 null 時使用預設值，無法轉換成整數時拋出 ValueError"""
+    value = data.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'參數 {name} 必須是整數: {value!r}') from None
+
+def parse_result_fields(value, default):
+    """解析逗號分隔的欄位清單；'all' 代表完整資料（回傳 None），不認得的欄位拋出 ValueError"""
+    if not value:
+        return default
+    if value == 'all':
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in VIDEO_RESULT_FIELDS]
+    if unknown:
+        raise ValueError(f"不支援的欄位: {', '.join(unknown)}")
+    return fields
+
+def serialize_videos(videos, fields):
+    """依欄位清單輸出影片；fields 為 None 時輸出完整資料"""
+    if fields is None:
+        return [video.to_dict() for video in videos]
+    return [video.to_summary(fields) for video in videos]
+
+# 篩選分級（由嚴到寬）：符合全部條件、只符合觀看次數（放寬長度）、只符合長度（放寬觀看次數）
+FILTER_TIERS = ('strict', 'relaxed_duration', 'relaxed_views')
+
+class TieredFilter:
+    """單次掃描的分級篩選與 Top-K 排名
+
+    每個候選影片只檢查一次並標記它符合的最嚴格分級，各分級以大小為 limit 的最小堆積
+    保留排名最高的影片，不需要對整個候選清單排序。
+    """
+
+    def __init__(self, min_views, max_duration_seconds, limit, sort_key=attrgetter('viewCount')):
+        self.min_views = min_views
+        self.max_duration_seconds = max_duration_seconds
+        self.limit = limit
+        self.sort_key = sort_key
+        self.counts = dict.fromkeys(FILTER_TIERS, 0)
+        self._heaps = {tier: [] for tier in FILTER_TIERS}
+        self._seq = 0
+
+    def classify(self, video):
+        """回傳影片符合的最嚴格分級，都不符合時回傳 None"""
+        views_ok = video.viewCount >= self.min_views
+        duration_ok = self.max_duration_seconds is None or video.durationSeconds <= self.max_duration_seconds
+        if views_ok and duration_ok:
+            return 'strict'
+        if views_ok:
+            return 'relaxed_duration'
+        if duration_ok:
+            return 'relaxed_views'
+        return None
+
+    def add(self, video):
+        """加入一個候選影片，回傳其分級"""
+        tier = self.classify(video)
+        if tier is None or self.limit <= 0:
+            return tier
+        
+        self.counts[tier] += 1
+        # 同分時保留較早出現的影片（與穩定排序結果一致）
+        self._seq += 1
+        entry = (self.sort_key(video), -self._seq, video)
+        heap = self._heaps[tier]
+        if len(heap) < self.limit:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+        return tier
+
+    def add_all(self, videos):
+        for video in videos:
+            self.add(video)
+        return self
+
+    def top(self, tier):
+        """依排名由高到低回傳指定分級的影片（已標記分級）"""
+        ranked = [entry[2] for entry in sorted(self._heaps[tier], key=lambda entry: entry[:2], reverse=True)]
+        for video in ranked:
+            video.filterTier = tier
+        return ranked
+
+    def select(self):
+        """依分級選出最終結果，回傳 (影片清單, 使用到的最寬鬆分級)
+
+        符合全部條件的影片少於要求的一半時補上放寬長度的影片；
+        兩者都沒有時才使用只符合長度的影片。
+        """
+        videos = self.top('strict')
+        if videos and len(videos) >= self.limit // 2:
+            return videos, 'strict'
+        
+        relaxed = self.top('relaxed_duration')
+        if relaxed:
+            return (videos + relaxed)[:self.limit], 'relaxed_duration'
+        if videos:
+            return videos, 'strict'
+        
+        return self.top('relaxed_views'), 'relaxed_views'
+
+def estimate_video_size(video):
+    """粗估單一影片資料佔用的記憶體（位元組），用於限制結果暫存的總量"""
+    size = 512  # 物件本身與數值欄位
+    for name in Video.__slots__:
+        value = getattr(video, name, None)
+        if isinstance(value, str):
+            size += 50 + len(value) * 2
+        elif isinstance(value, list):
+            size += 56 + sum(50 + len(str(item)) * 2 for item in value)
+    return size
+
+class ResultStore:
+    """搜尋結果暫存：以搜尋編號保存每次搜尋的結果與條件
+
+    取代全域的「最後一次搜尋結果」，多位使用者同時搜尋時匯出不會互相覆蓋。
+    超過有效時間的結果會過期，筆數或總大小超過上限時淘汰最久未使用的結果。
+    """
+
+    def __init__(self, ttl, max_entries, max_bytes):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # search_id -> {'videos': list, 'candidates': list, 'params': dict, 'created_at': float, 'size': int}
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+
+    def put(self, videos, params, candidates=()):
+        """保存搜尋結果與篩選前的候選影片（供 /refine 重新篩選），回傳搜尋編號"""
+        search_id = uuid.uuid4().hex
+        # 結果影片通常也在候選影片中，同一物件只計算一次
+        unique_videos = {id(video): video for video in list(videos) + list(candidates)}
+        entry = {
+            'videos': list(videos),
+            'candidates': list(candidates),
+            'params': dict(params),
+            'created_at': time.time(),
+            'size': sum(estimate_video_size(video) for video in unique_videos.values()) + 1024
         }
+        with self._lock:
+            self._entries[search_id] = entry
+            self._total_bytes += entry['size']
+            self._evict()
+        return search_id
+
+    def get(self, search_id):
+        """取得搜尋結果；不存在或已過期時回傳 None"""
+        if not search_id:
+            return None
+        with self._lock:
+            entry = self._entries.get(search_id)
+            if entry is None:
+                return None
+            if time.time() - entry['created_at'] > self.ttl:
+                self._remove(search_id)
+                return None
+            self._entries.move_to_end(search_id)
+            return entry
+
+    def _remove(self, search_id):
+        entry = self._entries.pop(search_id)
+        self._total_bytes -= entry['size']
+
+    def _evict(self):
+        """移除過期結果，再依最久未使用的順序淘汰到符合筆數與大小上限"""
+        now = time.time()
+        for search_id in [key for key, entry in self._entries.items() if now - entry['created_at'] > self.ttl]:
+            self._remove(search_id)
+        # 至少保留最新的一筆，避免單次大量結果被立即淘汰
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+class SqliteResultStore:
+    """以 SQLite 保存的搜尋結果暫存，多個工作程序共用（介面與 ResultStore 相同）
+
+    候選影片以 JSON 保存，結果影片只記錄影片編號與分級。保存後內容不會改變，
+    各程序另外保留最近讀取的少量已解析結果，重複分頁或匯出時不必重新解析。
+    """
+
+    def __init__(self, db_path, ttl, max_entries, max_bytes, local_entries=16):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.local_entries = local_entries
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS search_results (
+                    search_id TEXT PRIMARY KEY,
+                    params TEXT NOT NULL,
+                    videos TEXT NOT NULL,
+                    candidates TEXT NOT NULL,
+                    candidate_count INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_search_results_last_access ON search_results (last_access)')
+
+    def put(self, videos, params, candidates=()):
+        """保存搜尋結果與篩選前的候選影片（供 /refine 重新篩選），回傳搜尋編號"""
+        search_id = uuid.uuid4().hex
+        videos = list(videos)
+        candidates = list(candidates)
+        # 結果影片一律能從候選影片取回
+        candidate_ids = {video.videoId for video in candidates}
+        records = [video.to_record() for video in candidates]
+        records.extend(video.to_record() for video in videos if video.videoId not in candidate_ids)
+        params_json = json.dumps(params, ensure_ascii=False)
+        videos_json = json.dumps([[video.videoId, video.filterTier] for video in videos])
+        candidates_json = json.dumps(records, ensure_ascii=False)
+        size = len(params_json) + len(videos_json) + len(candidates_json)
+        now = time.time()
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute(
+                'INSERT INTO search_results '
+                '(search_id, params, videos, candidates, candidate_count, size, created_at, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (search_id, params_json, videos_json, candidates_json, len(candidates), size, now, now)
+            )
+            self._evict(conn, now)
+        return search_id
+
+    def get(self, search_id):
+        """取得搜尋結果；不存在或已過期時回傳 None"""
+        if not search_id:
+            return None
+        now = time.time()
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            cursor = conn.execute(
+                'UPDATE search_results SET last_access = ? WHERE search_id = ? AND created_at > ?',
+                (now, search_id, now - self.ttl)
+            )
+            if not cursor.rowcount:
+                return None
+            with self._lock:
+                entry = self._local.get(search_id)
+                if entry is not None:
+                    self._local.move_to_end(search_id)
+                    return entry
+            row = conn.execute(
+                'SELECT params, videos, candidates, candidate_count, size, created_at FROM search_results '
+                'WHERE search_id = ?',
+                (search_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        
+        params_json, videos_json, candidates_json, candidate_count, size, created_at = row
+        records = [Video.from_record(record) for record in json.loads(candidates_json)]
+        candidates_by_id = {video.videoId: video for video in records}
+        videos = []
+        for video_id, filter_tier in json.loads(videos_json):
+            video = copy.copy(candidates_by_id[video_id])
+            video.filterTier = filter_tier
+            videos.append(video)
+        entry = {
+            'videos': videos,
+            'candidates': records[:candidate_count],
+            'params': json.loads(params_json),
+            'created_at': created_at,
+            'size': size
+        }
+        with self._lock:
+            self._local[search_id] = entry
+            while len(self._local) > self.local_entries:
+                self._local.popitem(last=False)
+        return entry
+
+    def _evict(self, conn, now):
+        """移除過期結果，再依最久未使用的順序淘汰到符合筆數與大小上限（至少保留最新的一筆）"""
+        conn.execute('DELETE FROM search_results WHERE created_at <= ?', (now - self.ttl,))
+        count, total_bytes = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM search_results').fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+        rows = conn.execute('SELECT search_id, size FROM search_results ORDER BY last_access ASC').fetchall()
+        evicted = []
+        for search_id, size in rows[:-1]:
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            evicted.append((search_id,))
+            count -= 1
+            total_bytes -= size
+        conn.executemany('DELETE FROM search_results WHERE search_id = ?', evicted)
+
+def create_result_store():
+    """依 STATE_BACKEND 建立搜尋結果暫存：sqlite 供多個工作程序共用，memory 只在單一程序內有效"""
+    max_bytes = RESULT_STORE_MAX_MB * 1024 * 1024
+    if STATE_BACKEND == 'sqlite':
+        try:
+            return SqliteResultStore(STATE_DB_PATH, RESULT_STORE_TTL, RESULT_STORE_MAX_ENTRIES, max_bytes)
+        except (sqlite3.Error, OSError) as e:
+            print(f"⚠️  無法建立共用的結果暫存資料庫，改用記憶體暫存: {e}")
+    return ResultStore(RESULT_STORE_TTL, RESULT_STORE_MAX_ENTRIES, max_bytes)
+
+result_store = create_result_store()
+
+class VideoIndex:
+    """本機影片資料庫（SQLite），保存取得過的影片並以 FTS5 索引標題、描述與標籤
+
+    每次取得影片時寫入最新資料與統計快照，另記錄影片出現過的地區，
+    之後可不呼叫 API 直接以關鍵字、地區、類別與上傳時間查詢。
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS indexed_videos (
+                    video_id TEXT PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    tags TEXT NOT NULL,
+                    category_id TEXT,
+                    category_name TEXT,
+                    published_ts REAL,
+                    duration_seconds INTEGER NOT NULL,
+                    view_count INTEGER NOT NULL,
+                    item TEXT NOT NULL,
+                    first_seen_at REAL NOT NULL,
+                    fetched_at REAL NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_indexed_videos_views ON indexed_videos (view_count)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS video_regions (
+                    video_id TEXT NOT NULL,
+                    region_code TEXT NOT NULL,
+                    last_seen_at REAL NOT NULL,
+                    PRIMARY KEY (video_id, region_code)
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_video_regions_region ON video_regions (region_code)')
+            # trigram 斷詞可搜尋中日韓文字的任意片段（3 個字以上）
+            conn.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(
+                    title, description, tags,
+                    content='indexed_videos', content_rowid='rowid', tokenize='trigram'
+                )
+            ''')
+            conn.executescript('''
+                CREATE TRIGGER IF NOT EXISTS indexed_videos_ai AFTER INSERT ON indexed_videos BEGIN
+                    INSERT INTO videos_fts (rowid, title, description, tags)
+                    VALUES (new.rowid, new.title, new.description, new.tags);
+                END;
+                CREATE TRIGGER IF NOT EXISTS indexed_videos_ad AFTER DELETE ON indexed_videos BEGIN
+                    INSERT INTO videos_fts (videos_fts, rowid, title, description, tags)
+                    VALUES ('delete', old.rowid, old.title, old.description, old.tags);
+                END;
+                CREATE TRIGGER IF NOT EXISTS indexed_videos_au AFTER UPDATE OF title, description, tags ON indexed_videos BEGIN
+                    INSERT INTO videos_fts (videos_fts, rowid, title, description, tags)
+                    VALUES ('delete', old.rowid, old.title, old.description, old.tags);
+                    INSERT INTO videos_fts (rowid, title, description, tags)
+                    VALUES (new.rowid, new.title, new.description, new.tags);
+                END;
+            ''')
+
+    def add(self, videos, region_code=None):
+        """寫入或更新影片資料，並記錄影片出現的地區"""
+        now = time.time()
+        rows = [(
+            video.videoId,
+            video.title,
+            video.description,
+            ' '.join(video.tags or []),
+            video.categoryId,
+            video.categoryName,
+            video.publishedTimestamp,
+            video.durationSeconds,
+            video.viewCount,
+            json.dumps(video.to_item(), ensure_ascii=False),
+            now, now
+        ) for video in videos]
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.executemany(
+                'INSERT INTO indexed_videos '
+                '(video_id, title, description, tags, category_id, category_name, published_ts, '
+                'duration_seconds, view_count, item, first_seen_at, fetched_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (video_id) DO UPDATE SET '
+                'title = excluded.title, description = excluded.description, tags = excluded.tags, '
+                'category_id = excluded.category_id, '
+                'category_name = COALESCE(excluded.category_name, indexed_videos.category_name), '
+                'published_ts = excluded.published_ts, duration_seconds = excluded.duration_seconds, '
+                'view_count = excluded.view_count, item = excluded.item, fetched_at = excluded.fetched_at',
+                rows
+            )
+            if region_code:
+                conn.executemany(
+                    'INSERT OR REPLACE INTO video_regions (video_id, region_code, last_seen_at) VALUES (?, ?, ?)',
+                    [(video.videoId, region_code, now) for video in videos]
+                )
+
+    def search(self, keyword='', region_code=None, category_id=None, published_after=None, limit=VIDEO_INDEX_QUERY_LIMIT):
+        """依關鍵字與地區、類別、上傳時間查詢，回傳依觀看次數由高到低排列的影片"""
+        conditions = []
+        params = []
+        joins = ''
+        if region_code:
+            joins = 'JOIN video_regions r ON r.video_id = v.video_id AND r.region_code = ?'
+            params.append(region_code)
+        
+        # 3 個字以上的詞使用全文索引，較短的詞（例如兩個字的中文）改用 LIKE 比對
+        terms = keyword.split()
+        fts_terms = ['"' + term.replace('"', '""') + '"' for term in terms if len(term) >= 3]
+        if fts_terms:
+            conditions.append('v.rowid IN (SELECT rowid FROM videos_fts WHERE videos_fts MATCH ?)')
+            params.append(' AND '.join(fts_terms))
+        for term in terms:
+            if len(term) < 3:
+                pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                conditions.append(
+                    "(v.title LIKE ? ESCAPE '\\' OR v.description LIKE ? ESCAPE '\\' OR v.tags LIKE ? ESCAPE '\\')"
+                )
+                params.extend([pattern] * 3)
+        
+        if category_id:
+            conditions.append('v.category_id = ?')
+            params.append(category_id)
+        if published_after:
+            conditions.append('v.published_ts >= ?')
+            params.append(published_after)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with closing(get_db_connection(self.db_path)) as conn:
+            rows = conn.execute(
+                f'SELECT v.item, v.category_name FROM indexed_videos v {joins} {where} '
+                f'ORDER BY v.view_count DESC LIMIT ?',
+                params + [limit]
+            ).fetchall()
+        
+        videos = []
+        for item_json, category_name in rows:
+            item = json.loads(item_json)
+            category_id = item.get('snippet', {}).get('categoryId')
+            videos.append(Video.from_item(item, {category_id: category_name} if category_name else {}))
+        return videos
+
+    def count(self):
+        """資料庫中的影片總數"""
+        with closing(get_db_connection(self.db_path)) as conn:
+            return conn.execute('SELECT COUNT(*) FROM indexed_videos').fetchone()[0]
+
+def create_video_index():
+    """依設定建立本機影片資料庫，失敗時停用而不影響搜尋"""
+    if not VIDEO_INDEX_ENABLED:
+        return None
+    try:
+        return VideoIndex(VIDEO_INDEX_PATH)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️  無法建立本機影片資料庫，將停用: {e}")
+        return None
+
+video_index = create_video_index()
+
+def index_videos(videos, region_code=None):
+    """將取得的影片寫入本機資料庫，失敗時只記錄錯誤"""
+    if not video_index or not videos:
+        return
+    try:
+        video_index.add(videos, region_code)
+    except sqlite3.Error as e:
+        print(f"⚠️  寫入本機影片資料庫失敗: {e}")
+
+def compute_view_velocity(times, views, published_ts=None, min_interval=0):
+    """由觀看數快照計算 (每小時觀看增加數, 每小時的增加數變化)
+
+    有兩筆以上快照時以最近兩筆計算速度，三筆以上才計算加速度，兩筆快照間隔需至少 min_interval 秒；
+    只有一筆快照時以上傳至今的平均速度代替，無法計算時為 None。
+    """
+    velocity = acceleration = None
+    min_interval = max(1, min_interval)
+    if len(times) >= 2:
+        if times[-1] - times[-2] >= min_interval:
+            velocity = (views[-1] - views[-2]) * 3600 / (times[-1] - times[-2])
+        if velocity is not None and len(times) >= 3 and times[-2] - times[-3] >= min_interval:
+            previous = (views[-2] - views[-3]) * 3600 / (times[-2] - times[-3])
+            acceleration = round((velocity - previous) * 3600 * 2 / (times[-1] - times[-3]), 2)
+    elif times and published_ts and times[-1] > published_ts:
+        velocity = views[-1] * 3600 / (times[-1] - published_ts)
+    if velocity is not None:
+        velocity = round(velocity, 2)
+    return velocity, acceleration
+
+class ViewVelocityTracker:
+    """觀看速度追蹤（SQLite），每個影片的觀看數快照以壓縮陣列保存
+
+    時間（uint32 秒）與觀看數（uint64）各自打包成一個 BLOB，每個影片一列，
+    只保留最近 max_snapshots 筆，追蹤數量超過上限時停止追蹤最久未出現在搜尋結果的影片。
+    """
+
+    def __init__(self, db_path, max_tracked, max_snapshots, track_ttl, min_snapshot_interval):
+        self.db_path = db_path
+        self.max_tracked = max_tracked
+        self.max_snapshots = max_snapshots
+        self.track_ttl = track_ttl
+        self.min_snapshot_interval = min_snapshot_interval
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS view_tracking (
+                    video_id TEXT PRIMARY KEY,
+                    published_ts REAL,
+                    last_seen_at REAL NOT NULL,
+                    last_polled_at REAL NOT NULL,
+                    times BLOB NOT NULL,
+                    views BLOB NOT NULL
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_view_tracking_polled ON view_tracking (last_polled_at)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_view_tracking_seen ON view_tracking (last_seen_at)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS poller_lease (
+                    name TEXT PRIMARY KEY,
+                    owner TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            ''')
+
+    @staticmethod
+    def _unpack(times_blob, views_blob):
+        times = array('I')
+        times.frombytes(times_blob)
+        views = array('Q')
+        views.frombytes(views_blob)
+        return times, views
+
+    def observe(self, view_counts, watch=False, polled=False):
+        """記錄觀看數快照
+
+        view_counts 為 [(video_id, 觀看數, 上傳時間戳, 觀看數取得時間)]，取得時間為 None 時視為現在。
+        已追蹤的影片加入新快照；watch=True 時同時開始追蹤尚未追蹤的影片並更新最後出現時間；
+        polled=True 表示為背景查詢結果。來自影片快取的觀看數以當時的取得時間記錄，不會產生重複的快照。
+        """
+        now = int(time.time())
+        with closing(get_db_connection(self.db_path)) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                for i in range(0, len(view_counts), 500):
+                    chunk = view_counts[i:i + 500]
+                    placeholders = ','.join('?' * len(chunk))
+                    existing = {
+                        row[0]: row[1:]
+                        for row in conn.execute(
+                            f'SELECT video_id, times, views FROM view_tracking WHERE video_id IN ({placeholders})',
+                            [video_id for video_id, _, _, _ in chunk]
+                        )
+                    }
+                    for video_id, view_count, published_ts, observed_at in chunk:
+                        if video_id in existing:
+                            times, views = self._unpack(*existing[video_id])
+                        elif watch:
+                            times, views = array('I'), array('Q')
+                        else:
+                            continue
+                        observed_at = int(observed_at) if observed_at else now
+                        if not times or observed_at - times[-1] >= self.min_snapshot_interval:
+                            times.append(observed_at)
+                            views.append(max(0, view_count))
+                        elif observed_at > times[-1] and len(times) > 1:
+                            # 間隔太短的快照取代前一筆，避免連續搜尋產生雜訊；只有一筆時保留作為計算基準
+                            times[-1], views[-1] = observed_at, max(0, view_count)
+                        del times[:-self.max_snapshots]
+                        del views[:-self.max_snapshots]
+                        conn.execute(
+                            'INSERT INTO view_tracking (video_id, published_ts, last_seen_at, last_polled_at, times, views) '
+                            'VALUES (?, ?, ?, ?, ?, ?) '
+                            'ON CONFLICT (video_id) DO UPDATE SET times = excluded.times, views = excluded.views, '
+                            'last_seen_at = CASE WHEN ? THEN excluded.last_seen_at ELSE view_tracking.last_seen_at END, '
+                            'last_polled_at = CASE WHEN ? THEN excluded.last_polled_at ELSE view_tracking.last_polled_at END',
+                            (video_id, published_ts, now, now, times.tobytes(), views.tobytes(), watch, polled)
+                        )
+                if watch:
+                    self._prune(conn, now)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def _prune(self, conn, now):
+        """停止追蹤太久未出現的影片，並把追蹤數量限制在上限內"""
+        conn.execute('DELETE FROM view_tracking WHERE last_seen_at < ?', (now - self.track_ttl,))
+        overflow = conn.execute('SELECT COUNT(*) FROM view_tracking').fetchone()[0] - self.max_tracked
+        if overflow > 0:
+            conn.execute(
+                'DELETE FROM view_tracking WHERE video_id IN '
+                '(SELECT video_id FROM view_tracking ORDER BY last_seen_at ASC LIMIT ?)',
+                (overflow,)
+            )
+
+    def annotate(self, videos):
+        """計算影片的觀看速度與加速度（寫入 viewVelocity、viewAcceleration）"""
+        now = time.time()
+        snapshots = {}
+        with closing(get_db_connection(self.db_path)) as conn:
+            for i in range(0, len(videos), 500):
+                chunk = [video.videoId for video in videos[i:i + 500]]
+                placeholders = ','.join('?' * len(chunk))
+                for video_id, times_blob, views_blob in conn.execute(
+                    f'SELECT video_id, times, views FROM view_tracking WHERE video_id IN ({placeholders})', chunk
+                ):
+                    snapshots[video_id] = self._unpack(times_blob, views_blob)
+        
+        for video in videos:
+            times, views = snapshots.get(video.videoId) or ([now], [video.viewCount])
+            video.viewVelocity, video.viewAcceleration = compute_view_velocity(
+                times, views, video.publishedTimestamp, self.min_snapshot_interval
+            )
+
+    def due_ids(self, limit, polled_before):
+        """取得最久未重新查詢、且超過查詢間隔的影片 ID"""
+        with closing(get_db_connection(self.db_path)) as conn:
+            return [row[0] for row in conn.execute(
+                'SELECT video_id FROM view_tracking WHERE last_polled_at < ? ORDER BY last_polled_at ASC LIMIT ?',
+                (polled_before, limit)
+            )]
+
+    def acquire_lease(self, name, owner, ttl):
+        """取得或續約背景工作的租約，多個工作程序同時只有一個會執行"""
+        now = time.time()
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            cursor = conn.execute(
+                'INSERT INTO poller_lease (name, owner, expires_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at '
+                'WHERE poller_lease.owner = excluded.owner OR poller_lease.expires_at < ?',
+                (name, owner, now + ttl, now)
+            )
+            return cursor.rowcount > 0
+
+    def mark_polled(self, video_ids):
+        """標記已查詢（已刪除或不公開的影片不會回傳資料，也視為已查詢）"""
+        now = time.time()
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.executemany(
+                'UPDATE view_tracking SET last_polled_at = ? WHERE video_id = ?',
+                [(now, video_id) for video_id in video_ids]
+            )
+
+def create_velocity_tracker():
+    """依設定建立觀看速度追蹤，失敗時停用而不影響搜尋"""
+    if not VELOCITY_TRACKING_ENABLED:
+        return None
+    try:
+        return ViewVelocityTracker(
+            VELOCITY_DB_PATH, VELOCITY_MAX_TRACKED, VELOCITY_MAX_SNAPSHOTS,
+            VELOCITY_TRACK_TTL, VELOCITY_MIN_SNAPSHOT_INTERVAL
+        )
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️  無法建立觀看速度追蹤資料庫，將停用: {e}")
+        return None
+
+velocity_tracker = create_velocity_tracker()
+
+def update_view_velocity(candidates):
+    """以本次取得的觀看數更新已追蹤影片的快照，並計算所有候選影片的觀看速度"""
+    if not velocity_tracker or not candidates:
+        return
+    try:
+        velocity_tracker.observe(
+            [(v.videoId, v.viewCount, v.publishedTimestamp, v.statsFetchedAt) for v in candidates]
+        )
+        velocity_tracker.annotate(candidates)
+    except sqlite3.Error as e:
+        print(f"⚠️  觀看速度計算失敗: {e}")
+
+def watch_view_velocity(videos):
+    """開始追蹤搜尋結果中的影片"""
+    if not velocity_tracker or not videos:
+        return
+    try:
+        velocity_tracker.observe(
+            [(v.videoId, v.viewCount, v.publishedTimestamp, v.statsFetchedAt) for v in videos], watch=True
+        )
+    except sqlite3.Error as e:
+        print(f"⚠️  加入觀看速度追蹤失敗: {e}")
+
+def poll_view_statistics(youtube):
+    """重新查詢追蹤中影片的觀看數（每 50 個 ID 1 單位），每輪使用的配額依每日上限平均分配
+
+    回傳本輪查詢的影片數。
+    """
+    units = max(1, VELOCITY_DAILY_UNITS * VELOCITY_POLL_INTERVAL // 86400)
+    video_ids = velocity_tracker.due_ids(units * VIDEO_BATCH_SIZE, time.time() - VELOCITY_POLL_INTERVAL)
+    if not video_ids:
+        return 0
+    
+    reservation_id, reserved_units = quota_ledger.reserve(
+        -(-len(video_ids) // VIDEO_BATCH_SIZE), 1, get_daily_quota_limit()
+    )
+    if reservation_id is None:
+        print("💰 今日剩餘配額不足，暫停觀看速度追蹤")
+        return 0
+    
+    polled = 0
+    try:
+        for i in range(0, min(len(video_ids), reserved_units * VIDEO_BATCH_SIZE), VIDEO_BATCH_SIZE):
+            batch_ids = video_ids[i:i + VIDEO_BATCH_SIZE]
+            response = youtube.videos().list(
+                part='statistics',
+                id=','.join(batch_ids),
+                fields='items(id,statistics)'
+            ).execute()
+            update_quota_usage(video_calls=1)
+            
+            items = response.get('items', [])
+            velocity_tracker.observe([
+                (item['id'], int(item.get('statistics', {}).get('viewCount', 0)), None, None) for item in items
+            ], polled=True)
+            velocity_tracker.mark_polled(batch_ids)
+            if video_detail_cache and items:
+                video_detail_cache.store_statistics(items)
+            polled += len(batch_ids)
+    finally:
+        quota_ledger.release(reservation_id)
+    return polled
+
+def start_velocity_poller():
+    """在背景定期重新查詢追蹤中影片的觀看數（無法記錄配額時停用，避免超出每日上限）"""
+    if not velocity_tracker or not quota_ledger or VELOCITY_DAILY_UNITS <= 0:
+        return
+    
+    # 多個工作程序各自啟動時，只有持有租約的程序查詢，避免重複消耗配額
+    owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    
+    def _poll_loop():
+        while True:
+            time.sleep(VELOCITY_POLL_INTERVAL)
+            try:
+                if not velocity_tracker.acquire_lease('velocity-poller', owner, VELOCITY_POLL_INTERVAL * 2):
+                    continue
+                polled = poll_view_statistics(get_youtube_service())
+                if polled:
+                    print(f"📈 觀看速度追蹤: 已更新 {polled} 個影片的觀看數")
+            except Exception as e:
+                print(f"⚠️  觀看速度追蹤查詢失敗: {e}")
     
-    # 累積使用量
-    daily_quota_usage['search_calls'] += search_calls
-    daily_quota_usage['video_calls'] += video_calls
-    daily_quota_usage['category_calls'] += category_calls
+    threading.Thread(target=_poll_loop, name='velocity-poller', daemon=True).start()
+
+def get_pacific_now():
+    """取得目前的美國太平洋時間（YouTube API 配額在太平洋時間午夜重置）"""
+    utc_now = datetime.now(timezone.utc)
+    year = utc_now.year
+    # 夏令時間：3 月第二個星期日 02:00 PST（UTC 10:00）至 11 月第一個星期日 02:00 PDT（UTC 09:00）
+    march_8 = datetime(year, 3, 8, 10, tzinfo=timezone.utc)
+    dst_start = march_8 + timedelta(days=(6 - march_8.weekday()) % 7)
+    november_1 = datetime(year, 11, 1, 9, tzinfo=timezone.utc)
+    dst_end = november_1 + timedelta(days=(6 - november_1.weekday()) % 7)
+    offset_hours = -7 if dst_start <= utc_now < dst_end else -8
+    return (utc_now + timedelta(hours=offset_hours)).replace(tzinfo=None)
+
+def get_quota_day():
+    """取得配額計算用的日期（太平洋時間）"""
+    return get_pacific_now().strftime('%Y-%m-%d')
+
+class QuotaLedger:
+    """每日 API 配額帳本（SQLite），支援多執行緒/多程序的原子更新與搜尋前的配額保留"""
+
+    def __init__(self, db_path, daily_limit, reservation_timeout):
+        self.db_path = db_path
+        self.daily_limit = daily_limit
+        self.reservation_timeout = reservation_timeout
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS quota_usage (
+                    day TEXT PRIMARY KEY,
+                    search_calls INTEGER NOT NULL DEFAULT 0,
+                    video_calls INTEGER NOT NULL DEFAULT 0,
+                    category_calls INTEGER NOT NULL DEFAULT 0,
+                    total_cost INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS quota_reservations (
+                    reservation_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    day TEXT NOT NULL,
+                    units INTEGER NOT NULL,
+                    spent INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL
+                )
+            ''')
+            # 各 API Key 的用量（key_id 為 Key 的雜湊值）
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS key_usage (
+                    day TEXT NOT NULL,
+                    key_id TEXT NOT NULL,
+                    units INTEGER NOT NULL DEFAULT 0,
+                    exhausted INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, key_id)
+                )
+            ''')
+
+    def record(self, search_calls=0, video_calls=0, category_calls=0):
+        """累加使用量（搜尋 100 單位，其他 1 單位），回傳當日使用量
+
+        已使用的單位同時從進行中的保留量扣除（依保留先後），避免同一筆配額在使用量與保留量中重複計算。
+        """
+        day = get_quota_day()
+        cost = search_calls * 100 + video_calls + category_calls
+        with closing(get_db_connection(self.db_path)) as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('''
+                    INSERT INTO quota_usage (day, search_calls, video_calls, category_calls, total_cost)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(day) DO UPDATE SET
+                        search_calls = search_calls + excluded.search_calls,
+                        video_calls = video_calls + excluded.video_calls,
+                        category_calls = category_calls + excluded.category_calls,
+                        total_cost = total_cost + excluded.total_cost
+                ''', (day, search_calls, video_calls, category_calls, cost))
+                remaining = cost
+                for reservation_id, outstanding in conn.execute(
+                    'SELECT reservation_id, units - spent FROM quota_reservations '
+                    'WHERE day = ? AND spent < units AND created_at > ? ORDER BY reservation_id',
+                    (day, time.time() - self.reservation_timeout)
+                ).fetchall():
+                    if remaining <= 0:
+                        break
+                    charged = min(remaining, outstanding)
+                    conn.execute(
+                        'UPDATE quota_reservations SET spent = spent + ? WHERE reservation_id = ?',
+                        (charged, reservation_id)
+                    )
+                    remaining -= charged
+                usage = self._usage(conn, day)
+                conn.execute('COMMIT')
+                return usage
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def usage(self):
+        """取得當日使用量"""
+        with closing(get_db_connection(self.db_path)) as conn:
+            return self._usage(conn, get_quota_day())
+
+    def _usage(self, conn, day):
+        row = conn.execute(
+            'SELECT search_calls, video_calls, category_calls, total_cost FROM quota_usage WHERE day = ?', (day,)
+        ).fetchone() or (0, 0, 0, 0)
+        reserved = conn.execute(
+            'SELECT COALESCE(SUM(units - spent), 0) FROM quota_reservations WHERE day = ? AND created_at > ?',
+            (day, time.time() - self.reservation_timeout)
+        ).fetchone()[0]
+        return {
+            'date': day,
+            'search_calls': row[0],
+            'video_calls': row[1],
+            'category_calls': row[2],
+            'total_cost': row[3],
+            'reserved': reserved
+        }
+
+    def record_key(self, key_id, units):
+        """累加單一 API Key 的用量"""
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('''
+                INSERT INTO key_usage (day, key_id, units) VALUES (?, ?, ?)
+                ON CONFLICT(day, key_id) DO UPDATE SET units = units + excluded.units
+            ''', (get_quota_day(), key_id, units))
+
+    def mark_key_exhausted(self, key_id):
+        """標記 API Key 今日配額已用完（API 回報 quotaExceeded）"""
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('''
+                INSERT INTO key_usage (day, key_id, exhausted) VALUES (?, ?, 1)
+                ON CONFLICT(day, key_id) DO UPDATE SET exhausted = 1
+            ''', (get_quota_day(), key_id))
+
+    def key_usage(self):
+        """取得各 API Key 當日用量，回傳 {key_id: (單位數, 是否已用完)}"""
+        with closing(get_db_connection(self.db_path)) as conn:
+            rows = conn.execute(
+                'SELECT key_id, units, exhausted FROM key_usage WHERE day = ?', (get_quota_day(),)
+            ).fetchall()
+        return {key_id: (units, bool(exhausted)) for key_id, units, exhausted in rows}
+
+    def reserve(self, requested_units, minimum_units, daily_limit=None):
+        """為一次搜尋保留配額
+
+        剩餘配額（扣除其他進行中的搜尋尚未用掉的保留量）不足 requested_units 時縮減保留量，
+        連 minimum_units 都不足時不保留。回傳 (保留編號, 保留單位數)，無法保留時為 (None, 0)。
+        daily_limit 未指定時使用建立帳本時的每日上限。
+        """
+        daily_limit = daily_limit or self.daily_limit
+        day = get_quota_day()
+        with closing(get_db_connection(self.db_path)) as conn:
+            # IMMEDIATE 交易讓多個程序的保留動作依序進行
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute(
+                    'DELETE FROM quota_reservations WHERE created_at <= ? OR day != ?',
+                    (time.time() - self.reservation_timeout, day)
+                )
+                usage = self._usage(conn, day)
+                available = daily_limit - usage['total_cost'] - usage['reserved']
+                units = min(requested_units, available)
+                if units < minimum_units:
+                    conn.execute('COMMIT')
+                    return None, 0
+                cursor = conn.execute(
+                    'INSERT INTO quota_reservations (day, units, created_at) VALUES (?, ?, ?)',
+                    (day, units, time.time())
+                )
+                conn.execute('COMMIT')
+                return cursor.lastrowid, units
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+
+    def release(self, reservation_id):
+        """搜尋結束後釋放保留的配額（實際使用量已由 record 記錄）"""
+        if reservation_id is None:
+            return
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('DELETE FROM quota_reservations WHERE reservation_id = ?', (reservation_id,))
+
+def create_quota_ledger():
+    """建立配額帳本，失敗時停用配額記錄與搜尋前的配額檢查而不影響搜尋"""
+    try:
+        return QuotaLedger(QUOTA_LEDGER_PATH, DAILY_QUOTA_LIMIT, QUOTA_RESERVATION_TIMEOUT)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️  無法建立配額記錄資料庫，將停用配額記錄: {e}")
+        return None
+
+quota_ledger = create_quota_ledger()
+
+class QuotaExhaustedError(Exception):
+    """今日剩餘配額不足以進行搜尋"""
+
+def admit_search(unit_budget, minimum_units=SEARCH_PAGE_UNITS + 1, region_count=1):
+    """搜尋開始前檢查並保留配額
+
+    剩餘配額不足本次預算時縮減預算，連一頁搜尋（預設為搜尋 + 一批影片詳情 + 類別）都不夠時拋出
+    QuotaExhaustedError，避免搜尋到一半才遇到 quotaExceeded。多地區搜尋的預算上限依地區數增加。
+    回傳 (保留編號, 本次可用預算)。
+    """
+    max_units = region_count * MAX_SEARCH_PAGES * SEARCH_PAGE_UNITS + 1
+    requested_units = max(minimum_units, min(unit_budget, max_units))
+    if not quota_ledger:
+        return None, unit_budget
+    try:
+        reservation_id, reserved_units = quota_ledger.reserve(requested_units, minimum_units, get_daily_quota_limit())
+    except sqlite3.Error as e:
+        print(f"⚠️  配額檢查失敗，略過配額保留: {e}")
+        return None, unit_budget
     
-    # 計算總成本（搜尋 100 單位，其他 1 單位）
-    total_cost = (daily_quota_usage['search_calls'] * 100 + 
-                  daily_quota_usage['video_calls'] * 1 + 
-                  daily_quota_usage['category_calls'] * 1)
-    daily_quota_usage['total_cost'] = total_cost
+    if reservation_id is None:
+        raise QuotaExhaustedError(f'今日剩餘配額不足 {minimum_units} 單位，無法進行搜尋，請於太平洋時間午夜配額重置後再試')
+    if reserved_units < requested_units:
+        print(f"💰 今日剩餘配額不足，本次搜尋預算由 {requested_units} 縮減為 {reserved_units} 單位")
+    return reservation_id, min(unit_budget, reserved_units)
+
+def update_quota_usage(search_calls=0, video_calls=0, category_calls=0):
+    """更新真實的 API 配額使用量"""
+    if not quota_ledger:
+        return None
+    try:
+        usage = quota_ledger.record(search_calls, video_calls, category_calls)
+    except sqlite3.Error as e:
+        # 記帳失敗不應讓已經付出配額的搜尋失敗
+        print(f"⚠️  配額記錄失敗: {e}")
+        return None
     
-    print(f"📊 配額更新: 搜尋{daily_quota_usage['search_calls']}次, 影片{daily_quota_usage['video_calls']}個, 類別{daily_quota_usage['category_calls']}次 = {total_cost}單位")
+    print(f"📊 配額更新: 搜尋{usage['search_calls']}次, 影片{usage['video_calls']}次, 類別{usage['category_calls']}次 = {usage['total_cost']}單位")
     
-    return daily_quota_usage
+    return usage
 
 def get_current_quota_info():
     """獲取當前配額資訊"""
-    global daily_quota_usage
-    
-    # 檢查日期
-    today = datetime.now().strftime('%Y-%m-%d')
-    if daily_quota_usage['date'] != today:
-        update_quota_usage()  # 重置到新一天
+    if quota_ledger:
+        usage = quota_ledger.usage()
+    else:
+        usage = {'date': get_quota_day(), 'search_calls': 0, 'video_calls': 0, 'category_calls': 0, 'total_cost': 0}
+    daily_limit = get_daily_quota_limit()
     
-    total_cost = daily_quota_usage['total_cost']
-    remaining_quota = 10000 - total_cost
+    total_cost = usage['total_cost']
+    remaining_quota = daily_limit - total_cost
     
-    # 計算還能做幾次搜尋（假設每次搜尋 25 個結果 = 125 單位）
-    estimated_searches_left = max(0, remaining_quota // 125)
+    # 計算還能做幾次搜尋（假設每次搜尋一頁 + 類別 = SEARCH_PAGE_UNITS + 1 單位）
+    estimated_searches_left = max(0, remaining_quota // (SEARCH_PAGE_UNITS + 1))
     
     return {
         'current_cost': total_cost,
         'remaining_quota': remaining_quota,
         'estimated_searches_left': estimated_searches_left,
-        'quota_percentage': round((total_cost / 10000) * 100, 1),
+        'quota_percentage': round((total_cost / daily_limit) * 100, 1),
         'video_count': 0,  # 這個會在調用時更新
-        'search_calls': daily_quota_usage['search_calls'],
-        'video_calls': daily_quota_usage['video_calls'],
-        'category_calls': daily_quota_usage['category_calls']
+        'search_calls': usage['search_calls'],
+        'video_calls': usage['video_calls'],
+        'category_calls': usage['category_calls'],
+        'quota_date': usage['date'],
+        'api_keys': get_api_key_quota_info()
     }
 
+def get_api_key_quota_info():
+    """各 API Key 今日用量（尚未設定 Key 時為空清單）"""
+    try:
+        return youtube_client.get_pool().key_quota_info()
+    except ValueError:
+        return []
+
 def calculate_quota_cost(search_count=0, video_details_count=0, categories_call=0):
     """計算 API 配額消耗
     
     YouTube Data API v3 配額消耗:
     - search().list(): 100 單位
-    - videos().list(): 1 單位 (每個影片)
+    - videos().list(): 1 單位 (每次，最多 50 個影片)
     - videoCategories().list(): 1 單位
     """
     search_cost = search_count * 100
@@ -198,7 +2604,7 @@ def calculate_quota_cost(search_count=0, video_details_count=0, categories_call=
         'video_details_cost': video_details_cost,
         'categories_cost': categories_cost,
         'total_cost': total_cost,
-        'remaining_quota': 10000 - total_cost  # 假設每日配額 10,000
+        'remaining_quota': get_daily_quota_limit() - total_cost
     }
 
 def format_quota_info(quota_info, video_count):
@@ -207,13 +2613,13 @@ def format_quota_info(quota_info, video_count):
     remaining = quota_info['remaining_quota']
     
     # 計算還能做幾次搜尋
-    estimated_searches_left = remaining // 125  # 假設每次搜尋 25 個結果
+    estimated_searches_left = remaining // (SEARCH_PAGE_UNITS + 1)  # 假設每次搜尋一頁 + 類別
     
     return {
         'current_cost': total_cost,
         'remaining_quota': remaining,
         'estimated_searches_left': max(0, estimated_searches_left),
-        'quota_percentage': round((total_cost / 10000) * 100, 1),
+        'quota_percentage': round((total_cost / get_daily_quota_limit()) * 100, 1),
         'video_count': video_count
     }
 
@@ -234,6 +2640,10 @@ def generate_excel_filename(search_params):
         if safe_keyword:  # 確保清理後還有內容
             parts.append(safe_keyword[:20])  # 限制長度
     
+    # 熱門模式
+    if search_params.get('mode') == 'trending':
+        parts.append('熱門')
+    
     # 類別
     category_filter = search_params.get('category_filter', 'all')
     if category_filter != 'all':
@@ -304,6 +2714,10 @@ def generate_csv_filename(search_params):
         if safe_keyword:  # 確保清理後還有內容
             parts.append(safe_keyword[:20])  # 限制長度
     
+    # 熱門模式
+    if search_params.get('mode') == 'trending':
+        parts.append('trending')
+    
     # 類別 - 使用英文避免編碼問題
     category_filter = search_params.get('category_filter', 'all')
     if category_filter != 'all':
@@ -357,567 +2771,1246 @@ def generate_csv_filename(search_params):
     
     return filename
 
-@app.route('/')
+# 匯出欄位（CSV 與 Excel 共用）
+EXPORT_HEADERS = [
+    '影片ID', '影片標題', '頻道名稱', '頻道ID', '影片類別', '上傳時間',
+    '觀看次數', '按讚數', '留言數', '每小時觀看增加', '觀看加速度', '影片長度', '畫質', '字幕', 
+    '授權內容', '影片連結', '影片描述', '標籤'
+]
+# 匯出時每累積此筆數送出一次
+EXPORT_CHUNK_ROWS = 500
+
+def build_export_row(video):
+    """將影片資料轉為匯出用的一列（觀看/按讚/留言數維持數字）"""
+    # 處理時間格式
+    if video.publishedTimestamp:
+        formatted_date = datetime.fromtimestamp(video.publishedTimestamp, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    else:
+        formatted_date = video.publishedAt
+    
+    # 清理描述文字中的換行符
+    description = video.description.replace('\n', ' ').replace('\r', ' ')
+    if len(description) > 500:
+        description = description[:500] + '...'
+    
+    return [
+        video.videoId,
+        video.title,
+        video.channelTitle,
+        video.channelId,
+        video.categoryName or '未知',
+        formatted_date,
+        video.viewCount,
+        video.likeCount,
+        video.commentCount,
+        round(video.viewVelocity, 1) if video.viewVelocity is not None else '',
+        round(video.viewAcceleration, 1) if video.viewAcceleration is not None else '',
+        video.formattedDuration,
+        video.definition,
+        '有' if video.caption == 'true' else '無',
+        '是' if video.licensedContent else '否',
+        video.url,
+        description,
+        ', '.join(video.tags) if video.tags else '無'
+    ]
+
+def build_attachment_headers(filename):
+    """下載檔案的 Content-Disposition 標頭，中文檔名另以 UTF-8 編碼提供"""
+    try:
+        filename.encode('ascii')
+        return {'Content-Disposition': f'attachment; filename="{filename}"'}
+    except UnicodeEncodeError:
+        from urllib.parse import quote
+        import unicodedata
+        simple = unicodedata.normalize('NFKD', filename).encode('ascii', 'ignore').decode('ascii')
+        return {'Content-Disposition': f"attachment; filename=\"{simple}\"; filename*=UTF-8''{quote(filename)}"}
+
+class StreamSink:
+    """只能寫入的輸出緩衝，讓 zipfile 邊壓縮邊交出資料（不需要可 seek 的檔案）"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """取出目前累積的資料並清空緩衝"""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+XLSX_SHEET_NAME = '搜尋結果'
+# 超過此列數時工作表未壓縮前可能超過 4 GB，才需要以 Zip64 格式寫入
+XLSX_ZIP64_ROWS = 500000
+# XML 不允許的控制字元
+XML_ILLEGAL_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_STATIC_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        f'<sheets><sheet name="{XLSX_SHEET_NAME}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # 樣式 1 為標題列粗體，樣式 2 為千分位數字
+    'xl/styles.xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '<xf numFmtId="3" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '</styleSheet>'
+    ),
+}
+
+def xlsx_column_name(index):
+    """欄位索引（從 0 開始）轉為 Excel 欄名，例如 0 -> A、26 -> AA"""
+    name = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+XLSX_COLUMN_NAMES = [xlsx_column_name(index) for index in range(len(EXPORT_HEADERS))]
+
+def build_xlsx_row(row_number, values, style=0):
+    """產生工作表中的一列 XML；數字欄位寫成數值，其餘寫成內嵌字串"""
+    style_attr = f' s="{style}"' if style else ''
+    cells = []
+    for column, value in zip(XLSX_COLUMN_NAMES, values):
+        if type(value) in (int, float):
+            cells.append(f'<c r="{column}{row_number}" s="2"><v>{value}</v></c>')
+        else:
+            text = xml_escape(XML_ILLEGAL_CHARS.sub('', str(value)))
+            cells.append(f'<c r="{column}{row_number}"{style_attr} t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>')
+    return f'<row r="{row_number}">{"".join(cells)}</row>'
+
+@bp.route('/')
 def index():
     """首頁"""
     return render_template('index.html')
 
-@app.route('/search', methods=['POST'])
-def search_videos():
-    """搜尋影片"""
-    global last_search_results, last_search_params  # 在函數開頭統一宣告
+def get_relaxed_message(used_tier, video_count):
+    """放寬篩選條件時顯示給使用者的說明，未放寬時回傳 None"""
+    if used_tier == 'relaxed_duration':
+        return f'已放寬長度限制，找到 {video_count} 個影片'
+    if used_tier == 'relaxed_views':
+        return '已放寬搜尋條件以顯示更多結果'
+    return None
+
+def build_search_params(keyword, region_filter, category_filter, time_filter):
+    """產生 search().list 的查詢參數（排序方式與時間範圍在快取時間窗內固定）"""
+    print(f"🔎 使用關鍵字搜尋: {keyword}")
+    
+    # 為了獲得足夠的結果，我們先搜尋更多的影片
+    # 印度等大市場需要更多搜尋量才能篩選出符合條件的影片
+    search_batch_size = 50  # YouTube API 單次最大限制
+    
+    # 使用搜尋 API - 增加排序選項以獲得不同結果
+    search_random = get_search_random(keyword, region_filter, category_filter, time_filter)
+    
+    # 隨機選擇排序方式以獲得更多樣化的結果
+    order_options = ['relevance', 'date', 'viewCount', 'rating']
+    selected_order = search_random.choice(order_options)
+    
+    search_params = {
+        'part': SEARCH_LIST_PART,
+        'fields': SEARCH_LIST_FIELDS,
+        'q': keyword,
+        'type': 'video',
+        'videoDuration': 'short',  # 直接篩選短影片（< 4分鐘）
+        'order': selected_order,  # 使用隨機排序
+        'maxResults': search_batch_size,
+        'regionCode': region_filter
+    }
+    
+    print(f"🎲 使用排序方式: {selected_order}")
+    
+    # 根據地區設定語言偏好
+    language = REGION_LANGUAGES.get(region_filter)
+    if language:
+        search_params['relevanceLanguage'] = language
+    
+    # 添加分類過濾器
+    if category_filter != 'all':
+        search_params['videoCategoryId'] = category_filter
+        print(f"🏷️  使用分類過濾: {category_filter}")
+    
+    # 添加時間過濾器
+    if time_filter != 'all':
+        hours = int(time_filter)
+        published_after = get_time_filter(hours)
+        if published_after:
+            search_params['publishedAfter'] = published_after
+            print(f"📅 使用時間範圍: {published_after}")
+    else:
+        # 即使沒指定時間篩選，也隨機添加一些時間範圍以增加結果多樣性
+        anchor_time = get_search_anchor_time()
+        time_variations = [
+            None,  # 不限制 (40% 機率)
+            None,
+            (anchor_time - timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),   # 最近1天
+            (anchor_time - timedelta(days=3)).strftime('%Y-%m-%dT%H:%M:%SZ'),   # 最近3天
+            (anchor_time - timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%SZ'),   # 最近7天
+        ]
+        random_time = search_random.choice(time_variations)
+        if random_time:
+            search_params['publishedAfter'] = random_time
+            print(f"📅 隨機時間範圍: 從 {random_time} 之後")
     
+    return search_params
+
+def build_region_breakdown(regions, region_stats, candidates, ranking, summary_fields):
+    """多地區搜尋的各地區排名：依影片的 regions 分組，以與 ranking 相同的條件各自排名"""
+    breakdown = []
+    for region in regions:
+        region_ranking = TieredFilter(
+            ranking.min_views, ranking.max_duration_seconds, ranking.limit, sort_key=ranking.sort_key
+        ).add_all(video for video in candidates if region in (video.regions or ()))
+        region_videos, _ = region_ranking.select()
+        breakdown.append(dict(
+            region_stats.get(region, {}),
+            region=region,
+            videos=serialize_videos(region_videos, summary_fields),
+            totalResults=len(region_videos),
+            tierCounts=region_ranking.counts
+        ))
+    return breakdown
+
+def rerank_candidates(candidates, min_views, max_duration_seconds, max_results, sort_by):
+    """以已保存的候選影片重新篩選排名（不呼叫 API），回傳 (候選影片複本, 影片清單, 使用到的分級, 排名)
+
+    分級標記會寫回影片物件，使用複本以免改動原搜尋結果。
+    """
+    copies = [copy.copy(video) for video in candidates]
+    ranking = TieredFilter(min_views, max_duration_seconds, max_results, sort_key=VIDEO_SORT_KEYS[sort_by])
+    ranking.add_all(copies)
+    videos, used_tier = ranking.select()
+    return copies, videos, used_tier, ranking
+
+# 搜尋因這些原因停止時，候選影片只是搜尋結果的一部分，重新搜尋可能找到更多
+TRUNCATED_STOP_REASONS = ('enough_results', 'budget')
+
+def is_candidate_pool_truncated(params):
+    """保存的候選影片是否因提早停止或預算而不完整（含多地區搜尋的各地區）"""
+    reasons = [params.get('stop_reason')]
+    reasons.extend(stats.get('stopReason') for stats in (params.get('region_stats') or {}).values())
+    return any(reason in TRUNCATED_STOP_REASONS for reason in reasons)
+
+def rank_stored_candidates(stored):
+    """依保存的搜尋條件排名全部候選影片（與 rerank_candidates 相同分級，依序為符合全部條件、放寬長度、放寬觀看次數），
+    不符合任何分級的影片不列入"""
+    params = stored['params']
+    candidates = stored['candidates']
+    max_duration = str(params['max_duration'])
+    max_duration_seconds = int(max_duration) if max_duration != 'all' else None
+    sort_by = params.get('sort_by', 'viewCount')
+    _, _, _, ranking = rerank_candidates(candidates, int(params['min_views']), max_duration_seconds,
+                                         len(candidates), sort_by)
+    return ranking.top('strict') + ranking.top('relaxed_duration') + ranking.top('relaxed_views')
+
+def parse_search_regions(value, default_region):
+    """解析多地區搜尋的地區清單（陣列或逗號分隔字串），未指定時使用單一地區"""
+    if not value:
+        return [default_region]
+    if isinstance(value, str):
+        value = value.split(',')
+    regions = []
+    for region in value:
+        region = str(region).strip().upper()
+        if region and region not in regions:
+            regions.append(region)
+    if not regions:
+        return [default_region]
+    if len(regions) > MAX_SEARCH_REGIONS:
+        raise ValueError(f'一次最多搜尋 {MAX_SEARCH_REGIONS} 個地區')
+    return regions
+
+def parse_search_request(data):
+    """解析並檢查搜尋請求的參數，不正確時拋出 ValueError
+
+    在加入進行中的相同搜尋之前呼叫，參數錯誤只會回給發出該請求的呼叫端。
+    """
+    mode = data.get('mode', 'search')  # search：關鍵字搜尋；trending：地區熱門影片
+    if mode not in ('search', 'trending'):
+        raise ValueError(f'不支援的搜尋模式: {mode}')
+    sort_by = data.get('sortBy', 'viewCount')  # 排名依據：觀看次數、觀看速度或加速度
+    if sort_by not in RANKING_KEYS:
+        raise ValueError(f"不支援的排名依據: {sort_by}，可用: {', '.join(RANKING_KEYS)}")
+    regions = parse_search_regions(data.get('regions'), data.get('regionFilter', 'TW'))  # 多地區同時搜尋
+    if len(regions) > 1 and mode != 'search':
+        raise ValueError('熱門影片榜一次只能選擇一個地區')
+    max_duration = str(data.get('maxDuration', 'all'))
+    if max_duration != 'all' and not max_duration.isdigit():
+        raise ValueError(f'不正確的最大長度: {max_duration}')
+    time_filter = str(data.get('timeFilter', 'all'))
+    if time_filter != 'all' and not time_filter.isdigit():
+        raise ValueError(f'不正確的時間範圍: {time_filter}')
+    summary_fields = parse_result_fields(data.get('fields'), RESULT_SUMMARY_FIELDS)  # 回傳的影片欄位
+    if len(regions) > 1 and summary_fields is not None and 'regions' not in summary_fields:
+        summary_fields = summary_fields + ['regions']
+    return {
+        'keyword': str(data.get('keyword', '')).strip(),
+        'category_filter': data.get('categoryFilter', 'all'),
+        'regions': regions,
+        'time_filter': time_filter,
+        'min_views': parse_int_param(data, 'minViews', 1000),  # 預設最少觀看次数1千（從1萬降低）
+        'max_duration': max_duration,
+        'max_results': parse_int_param(data, 'maxResults', 25),
+        'mode': mode,
+        'sort_by': sort_by,
+        # 本次搜尋的配額預算；多地區搜尋未指定預算時，每個地區各有一次搜尋的預設預算
+        'unit_budget': parse_int_param(data, 'unitBudget', None) or SEARCH_UNIT_BUDGET * len(regions),
+        'summary_fields': summary_fields
+    }
+
+def execute_search(data):
+    """執行一次搜尋，依序產生進度、符合條件的影片預覽與最終結果事件"""
+    reservation_id = None
     try:
         # 取得搜尋參數
-        data = request.get_json()
-        keyword = data.get('keyword', '').strip()
-        category_filter = data.get('categoryFilter', 'all')
-        region_filter = data.get('regionFilter', 'TW')
-        time_filter = data.get('timeFilter', 'all')
-        min_views = data.get('minViews', 1000)  # 預設最少觀看次数1千（從1萬降低）
-        max_duration = data.get('maxDuration', 'all')
-        max_results = data.get('maxResults', 25)
-        
-        # 儲存搜尋條件用於檔案命名
-        last_search_params = {
-            'keyword': keyword if keyword else 'shorts',
+        request_params = parse_search_request(data)
+        keyword = request_params['keyword']
+        category_filter = request_params['category_filter']
+        regions = request_params['regions']
+        region_filter = regions[0]
+        time_filter = request_params['time_filter']
+        min_views = request_params['min_views']
+        max_duration = request_params['max_duration']
+        max_results = request_params['max_results']
+        mode = request_params['mode']
+        sort_by = request_params['sort_by']
+        unit_budget = request_params['unit_budget']
+        summary_fields = request_params['summary_fields']
+        
+        # 搜尋條件隨結果一起保存，用於匯出檔案命名
+        search_record_params = {
+            'keyword': keyword if keyword and mode == 'search' else 'shorts',
             'category_filter': category_filter,
             'region_filter': region_filter,
+            'regions': regions,
             'time_filter': time_filter,
             'min_views': min_views,
             'max_duration': max_duration,
-            'max_results': max_results
+            'max_results': max_results,
+            'mode': mode,
+            'sort_by': sort_by
         }
         
-        # 如果沒有關鍵字，使用預設的 shorts 關鍵字
-        if not keyword:
+        # 如果沒有關鍵字，使用預設的 shorts 關鍵字（熱門模式不使用關鍵字）
+        if not keyword and mode == 'search':
             keyword = 'shorts'
             print("🎥 使用預設關鍵字: shorts")
         
-        print(f"🔍 搜尋參數: 關鍵字='{keyword}', 類別={category_filter}, 地區={region_filter}, 時間={time_filter}, 最少觀看={min_views}, 最大長度={max_duration}")
+        print(f"🔍 搜尋參數: 關鍵字='{keyword}', 類別={category_filter}, 地區={','.join(regions)}, 時間={time_filter}, 最少觀看={min_views}, 最大長度={max_duration}")
         
         # 建立 YouTube 服務
         youtube = get_youtube_service()
+        # 配額用完或 Key 無效的斷路器開啟中時直接失敗，不保留配額也不呼叫 API
+        check_api_circuit()
         
-        # 獲取影片類別資訊
-        print("📊 獲取影片類別資訊...")
-        categories = get_video_categories(youtube)
-        print(f"🏷️  獲取到 {len(categories)} 個類別")
+        # 搜尋前保留配額，剩餘配額不足時縮減預算或拒絕搜尋
+        if mode == 'trending':
+            reservation_id, unit_budget = admit_search(TRENDING_MAX_PAGES + 1, minimum_units=2)
+        else:
+            reservation_id, unit_budget = admit_search(unit_budget, region_count=len(regions))
         
-        # 更新配額使用（類別 API 調用）
-        update_quota_usage(category_calls=1)
+        # 獲取影片類別資訊（依地區快取）
+        categories, categories_called = category_cache.get(youtube, region_filter)
+        print(f"🏷️  {region_filter} 類別: {len(categories)} 個{'' if categories_called else '（快取）'}")
         
         # 記錄 API 呼叫次數用於配額計算
         api_calls = {
             'search_count': 0,
             'video_details_count': 0,
-            'categories_call': 1  # 獲取類別資訊
-        }
-        
-        print(f"🔎 使用關鍵字搜尋: {keyword}")
-        
-        # 為了獲得足夠的結果，我們先搜尋更多的影片
-        # 印度等大市場需要更多搜尋量才能篩選出符合條件的影片
-        search_batch_size = 50  # YouTube API 單次最大限制
-        
-        # 使用搜尋 API - 增加排序選項以獲得不同結果
-        import random
-        
-        # 隨機選擇排序方式以獲得更多樣化的結果
-        order_options = ['relevance', 'date', 'viewCount', 'rating']
-        selected_order = random.choice(order_options)
-        
-        search_params = {
-            'part': 'snippet',
-            'q': keyword,
-            'type': 'video',
-            'videoDuration': 'short',  # 直接篩選短影片（< 4分鐘）
-            'order': selected_order,  # 使用隨機排序
-            'maxResults': search_batch_size,
-            'regionCode': region_filter
+            'categories_call': 1 if categories_called else 0  # 獲取類別資訊
         }
         
-        print(f"🎲 使用排序方式: {selected_order}")
-        
-        # 根據地區設定語言偏好
-        if region_filter in ['TW', 'CN', 'HK', 'SG']:
-            search_params['relevanceLanguage'] = 'zh'
-        elif region_filter == 'JP':
-            search_params['relevanceLanguage'] = 'ja'
-        elif region_filter == 'KR':
-            search_params['relevanceLanguage'] = 'ko'
-        elif region_filter in ['NO']:
-            search_params['relevanceLanguage'] = 'no'
-        elif region_filter in ['CH', 'DE']:
-            search_params['relevanceLanguage'] = 'de'
-        elif region_filter in ['DK']:
-            search_params['relevanceLanguage'] = 'da'
-        elif region_filter in ['AE', 'SA']:
-            search_params['relevanceLanguage'] = 'ar'
-        elif region_filter in ['US', 'GB', 'CA', 'AU', 'IN']:
-            search_params['relevanceLanguage'] = 'en'
-        elif region_filter in ['FR']:
-            search_params['relevanceLanguage'] = 'fr'
-        elif region_filter in ['RU']:
-            search_params['relevanceLanguage'] = 'ru'
-        
-        # 添加分類過濾器
-        if category_filter != 'all':
-            search_params['videoCategoryId'] = category_filter
-            print(f"🏷️  使用分類過濾: {category_filter}")
-        
-        # 添加時間過濾器
-        if time_filter != 'all':
-            hours = int(time_filter)
-            published_after = get_time_filter(hours)
-            if published_after:
-                search_params['publishedAfter'] = published_after
-                print(f"📅 使用時間範圍: {published_after}")
+        # 每個影片只解析一次並即時分級篩選
+        max_duration_seconds = int(max_duration) if max_duration != 'all' else None
+        ranking = TieredFilter(min_views, max_duration_seconds, max_results)
+        region_results = None
+        if len(regions) > 1:
+            # 多地區模式：各地區並行搜尋，重複的影片只查詢一次詳細資訊
+            search_params = {}
+            region_params = {
+                region: build_search_params(keyword, region, category_filter, time_filter)
+                for region in regions
+            }
+            candidates, search_stats, region_results = yield from collect_multi_region_candidates(
+                youtube, region_params, ranking, api_calls, unit_budget, summary_fields
+            )
+        elif mode == 'trending':
+            # 熱門模式：直接讀取地區熱門影片榜（每頁 1 單位，已包含詳細資訊）
+            search_params = {}
+            published_after = time.time() - int(time_filter) * 3600 if time_filter != 'all' else None
+            candidates, search_stats = yield from collect_trending_candidates(
+                youtube, region_filter, category_filter, categories, ranking, api_calls, published_after,
+                summary_fields
+            )
         else:
-            # 即使沒指定時間篩選，也隨機添加一些時間範圍以增加結果多樣性
-            time_variations = [
-                None,  # 不限制 (40% 機率)
-                None,
-                (datetime.now() - timedelta(days=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),   # 最近1天
-                (datetime.now() - timedelta(days=3)).strftime('%Y-%m-%dT%H:%M:%SZ'),   # 最近3天
-                (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%dT%H:%M:%SZ'),   # 最近7天
-            ]
-            random_time = random.choice(time_variations)
-            if random_time:
-                search_params['publishedAfter'] = random_time
-                print(f"📅 隨機時間範圍: 從 {random_time} 之後")
-        
-        # 執行初次搜尋
-        search_response = youtube.search().list(**search_params).execute()
-        api_calls['search_count'] = 1
-        
-        # 更新配額使用（搜尋 API 調用）
-        update_quota_usage(search_calls=1)
-        
-        # 收集所有影片ID並去除重複
-        all_video_ids = []
-        seen_ids = set()
+            # 逐頁搜尋，取得足夠結果即停止
+            search_params = build_search_params(keyword, region_filter, category_filter, time_filter)
+            candidates, search_stats = yield from collect_search_candidates(
+                youtube, search_params, categories, ranking, api_calls, unit_budget, summary_fields
+            )
+        print(f"🎥 共 {search_stats['searchPages']} 頁、{search_stats['candidateIds']} 個唯一影片 ID，"
+              f"成功獲取 {search_stats['candidates']} 個影片詳細資訊")
         
-        for item in search_response['items']:
-            video_id = item['id']['videoId']
-            if video_id not in seen_ids:
-                all_video_ids.append(video_id)
-                seen_ids.add(video_id)
-        
-        # 如果結果不夠，嘗試獲取下一頁（大幅提高上限以應對印度等大市場）
-        target_video_count = min(max_results * 5, 200)  # 目標獲取更多影片以便篩選
-        while len(all_video_ids) < target_video_count and 'nextPageToken' in search_response:
-            print(f"📄 當前有 {len(all_video_ids)} 個影片，目標 {target_video_count} 個，繼續獲取...")
-            search_params['pageToken'] = search_response['nextPageToken']
-            search_response = youtube.search().list(**search_params).execute()
-            api_calls['search_count'] += 1
-            
-            # 更新配額使用
-            update_quota_usage(search_calls=1)
-            
-            for item in search_response['items']:
-                video_id = item['id']['videoId']
-                if video_id not in seen_ids:
-                    all_video_ids.append(video_id)
-                    seen_ids.add(video_id)
-            
-            # 提高 API 呼叫上限，確保大市場有足夠結果
-            if api_calls['search_count'] >= 10:  # 從 3 次提高到 10 次
-                print(f"⚠️ 已達到 API 呼叫上限 (10次)，停止搜尋")
-                break
-        
-        print(f"🎥 總共獲取到 {len(all_video_ids)} 個唯一影片 ID")
-        
-        if not all_video_ids:
+        if not search_stats['candidateIds']:
             print("⚠️  沒有獲取到任何影片 ID")
-            return jsonify({
+            yield {
+                'type': 'result',
                 'success': True,
                 'videos': [],
                 'totalResults': 0
-            })
-        
-        # 分批取得影片詳細資訊（YouTube API 限制每次最多50個ID）
-        batch_size = 50
-        all_video_items = []
+            }
+            return
         
-        for i in range(0, len(all_video_ids), batch_size):
-            batch_ids = all_video_ids[i:i + batch_size]
-            print(f"📊 處理第 {i//batch_size + 1} 批影片，共 {len(batch_ids)} 個")
-            
-            try:
-                videos_response = youtube.videos().list(
-                    part='snippet,statistics,contentDetails',
-                    id=','.join(batch_ids)
-                ).execute()
-                
-                all_video_items.extend(videos_response.get('items', []))
-                # 記錄實際處理的影片數量用於配額計算
-                api_calls['video_details_count'] += len(batch_ids)
-                
-                # 更新配額使用（影片詳情 API 調用）
-                update_quota_usage(video_calls=len(batch_ids))
-                
-            except Exception as e:
-                print(f"⚠️ 批次 {i//batch_size + 1} 處理失敗: {e}")
-                continue
+        # 計算觀看速度；依速度或加速度排名時以相同篩選條件重新排名（分級數量不變）
+        update_view_velocity(candidates)
+        if sort_by != 'viewCount':
+            ranking = TieredFilter(min_views, max_duration_seconds, max_results, sort_key=VIDEO_SORT_KEYS[sort_by])
+            ranking.add_all(candidates)
         
-        print(f"📊 成功獲取到 {len(all_video_items)} 個影片詳細資訊")
+        videos, used_tier = ranking.select()
         
-        videos = []
-        for item in all_video_items:
-            video_data = item['snippet']
-            statistics = item['statistics']
-            content_details = item['contentDetails']
-            
-            # 檢查觀看次數過濾器
-            view_count = int(statistics.get('viewCount', 0))
-            if view_count < min_views:
-                print(f"⏭️  跳過影片 {item['id']}: 觀看次數 {view_count} < {min_views}")
-                continue
-            
-            # 檢查影片長度過濾器
-            if max_duration != 'all':
-                duration_seconds = get_duration_seconds(content_details.get('duration', ''))
-                max_duration_seconds = int(max_duration)
-                if duration_seconds > max_duration_seconds:
-                    print(f"⏭️  跳過影片 {item['id']}: 長度 {duration_seconds}秒 > {max_duration_seconds}秒")
-                    continue
-            
-            print(f"✅ 包含影片 {item['id']}: {video_data['title'][:50]}... (觀看: {view_count}, 長度: {get_duration_seconds(content_details.get('duration', ''))}秒)")
-            
-            # 獲取類別名稱
-            category_id = video_data.get('categoryId', '')
-            category_name = get_category_name(category_id, categories)
-            
-            video_info = {
-                'videoId': item['id'],
-                'title': video_data['title'],
-                'description': video_data['description'],
-                'channelTitle': video_data['channelTitle'],
-                'channelId': video_data['channelId'],
-                'publishedAt': video_data['publishedAt'],
-                'thumbnails': video_data['thumbnails'],
-                'categoryId': category_id,
-                'categoryName': category_name,
-                'defaultLanguage': video_data.get('defaultLanguage', ''),
-                'defaultAudioLanguage': video_data.get('defaultAudioLanguage', ''),
-                'tags': video_data.get('tags', []),
-                'viewCount': statistics.get('viewCount', '0'),
-                'likeCount': statistics.get('likeCount', '0'),
-                'commentCount': statistics.get('commentCount', '0'),
-                'duration': content_details.get('duration', ''),
-                'definition': content_details.get('definition', ''),
-                'caption': content_details.get('caption', ''),
-                'licensedContent': content_details.get('licensedContent', False),
-                'projection': content_details.get('projection', ''),
-                'url': f"https://www.youtube.com/watch?v={item['id']}",
-                'formattedViewCount': format_view_count(statistics.get('viewCount', '0')),
-                'formattedDuration': format_duration(content_details.get('duration', ''))
-            }
-            videos.append(video_info)
+        # 各地區以相同條件各自排名（影片物件與合併結果共用）
+        region_breakdown = []
+        if region_results:
+            region_breakdown = build_region_breakdown(
+                regions, {region: region_results[region]['stats'] for region in regions}, candidates,
+                TieredFilter(min_views, max_duration_seconds, max_results, sort_key=VIDEO_SORT_KEYS[sort_by]),
+                summary_fields
+            )
+        print(f"✅ 篩選結果: 符合全部條件 {ranking.counts['strict']} 個, "
+              f"只符合觀看次數 {ranking.counts['relaxed_duration']} 個, "
+              f"只符合長度 {ranking.counts['relaxed_views']} 個")
         
-        # 根據觀看次數排序並限制結果數量
-        videos.sort(key=lambda x: int(x['viewCount']), reverse=True)
-        videos = videos[:max_results]  # 確保返回請求的結果數量
+        if used_tier == 'relaxed_duration':
+            print("🔄 符合全部條件的結果少於要求的一半，已放寬長度限制")
+        message = get_relaxed_message(used_tier, len(videos))
         
-        print(f"✅ 篩選後獲得 {len(videos)} 個符合條件的影片")
-
-        # 如果結果數量不足，嘗試放寬條件
-        if len(videos) < max_results // 2:  # 如果結果少於要求的一半，啟動放寬模式
-            print(f"🔄 結果數量 {len(videos)} 少於要求的一半，嘗試放寬搜尋條件...")
-            
-            # 嘗試放寬長度限制，但保持最低觀看次數要求
-            relaxed_videos = []
-            for item in all_video_items:
-                video_data = item['snippet']
-                statistics = item['statistics']
-                content_details = item['contentDetails']
-                
-                # 仍然檢查觀看次數，但放寬長度限制
-                view_count = int(statistics.get('viewCount', 0))
-                if view_count < min_views:
-                    continue  # 跳過觀看次數不足的影片
-                
-                category_id = video_data.get('categoryId', '')
-                category_name = get_category_name(category_id, categories)
-                
-                video_info = {
-                    'videoId': item['id'],
-                    'title': video_data['title'],
-                    'description': video_data['description'],
-                    'channelTitle': video_data['channelTitle'],
-                    'channelId': video_data['channelId'],
-                    'publishedAt': video_data['publishedAt'],
-                    'thumbnails': video_data['thumbnails'],
-                    'categoryId': category_id,
-                    'categoryName': category_name,
-                    'defaultLanguage': video_data.get('defaultLanguage', ''),
-                    'defaultAudioLanguage': video_data.get('defaultAudioLanguage', ''),
-                    'tags': video_data.get('tags', []),
-                    'viewCount': statistics.get('viewCount', '0'),
-                    'likeCount': statistics.get('likeCount', '0'),
-                    'commentCount': statistics.get('commentCount', '0'),
-                    'duration': content_details.get('duration', ''),
-                    'definition': content_details.get('definition', ''),
-                    'caption': content_details.get('caption', ''),
-                    'licensedContent': content_details.get('licensedContent', False),
-                    'projection': content_details.get('projection', ''),
-                    'url': f"https://www.youtube.com/watch?v={item['id']}",
-                    'formattedViewCount': format_view_count(statistics.get('viewCount', '0')),
-                    'formattedDuration': format_duration(content_details.get('duration', ''))
-                }
-                relaxed_videos.append(video_info)
-            
-            relaxed_videos.sort(key=lambda x: int(x['viewCount']), reverse=True)
+        # 如果連放寬後都沒有找到影片，移除時間限制重新搜尋一次
+        if (not videos and 'publishedAfter' in search_params
+                and (min_views > 0 or max_duration != 'all' or time_filter != 'all')
+                and api_calls_cost(api_calls) + SEARCH_PAGE_UNITS <= unit_budget):
+            print("🔄 沒有找到符合條件的影片，移除時間限制重新搜尋...")
             
-            # 確保返回請求的結果數量
-            relaxed_videos.sort(key=lambda x: int(x['viewCount']), reverse=True)
-            relaxed_videos = relaxed_videos[:max_results]  # 限制放寬模式的結果數量
-            
-            if relaxed_videos:
-                print(f"✅ 放寬條件後找到 {len(relaxed_videos)} 個影片")
-                
-                # 合併原有結果和放寬條件的結果
-                existing_ids = {v['videoId'] for v in videos}
-                additional_videos = [v for v in relaxed_videos if v['videoId'] not in existing_ids]
-                combined_videos = videos + additional_videos
-                combined_videos = combined_videos[:max_results]  # 確保不超過請求數量
-                
-                # 儲存合併後的結果
-                last_search_results = combined_videos.copy()
-                
-                # 使用真實的配額追蹤
-                quota_info = get_current_quota_info()
-                quota_info['video_count'] = len(combined_videos)
-                
-                return jsonify({
-                    'success': True,
-                    'videos': combined_videos,
-                    'totalResults': len(combined_videos),
-                    'relaxed': True,
-                    'message': f'已放寬長度限制，找到 {len(combined_videos)} 個影片',
-                    'quota_info': quota_info,
-                    'can_export': len(combined_videos) > 0
-                })
-        
-        # 根據觀看次數排序
-        videos.sort(key=lambda x: int(x['viewCount']), reverse=True)
-        
-        # 如果沒有找到影片，嘗試放寬條件
-        if len(videos) == 0 and (min_views > 0 or max_duration != 'all' or time_filter != 'all'):
-            print("🔄 沒有找到符合條件的影片，嘗試放寬搜尋條件...")
-            
-            # 重新搜尋，放寬條件
             relaxed_params = search_params.copy()
-            if 'publishedAfter' in relaxed_params:
-                del relaxed_params['publishedAfter']  # 移除時間限制
+            relaxed_params.pop('pageToken', None)
+            del relaxed_params['publishedAfter']  # 移除時間限制
             
-            relaxed_response = youtube.search().list(**relaxed_params).execute()
-            
-            relaxed_video_ids = []
-            for item in relaxed_response['items']:
-                relaxed_video_ids.append(item['id']['videoId'])
+            relaxed_response, from_cache = fetch_search_page(youtube, relaxed_params)
+            if not from_cache:
+                api_calls['search_count'] += 1
             
+            relaxed_video_ids = [item['id']['videoId'] for item in relaxed_response['items']]
             if relaxed_video_ids:
-                relaxed_videos_response = youtube.videos().list(
-                    part='snippet,statistics,contentDetails',
-                    id=','.join(relaxed_video_ids)
-                ).execute()
+                relaxed_video_items, detail_calls = fetch_video_details(youtube, relaxed_video_ids)
+                api_calls['video_details_count'] += detail_calls
                 
-                for item in relaxed_videos_response['items']:
-                    video_data = item['snippet']
-                    statistics = item['statistics']
-                    content_details = item['contentDetails']
-                    
-                    # 只檢查長度限制，放寬觀看次數要求
-                    if max_duration != 'all':
-                        duration_seconds = get_duration_seconds(content_details.get('duration', ''))
-                        max_duration_seconds = int(max_duration)
-                        if duration_seconds > max_duration_seconds:
-                            continue
-                    
-                    video_info = {
-                        'videoId': item['id'],
-                        'title': video_data['title'],
-                        'description': video_data['description'],
-                        'channelTitle': video_data['channelTitle'],
-                        'channelId': video_data['channelId'],
-                        'publishedAt': video_data['publishedAt'],
-                        'thumbnails': video_data['thumbnails'],
-                        'categoryId': video_data.get('categoryId', ''),
-                        'defaultLanguage': video_data.get('defaultLanguage', ''),
-                        'defaultAudioLanguage': video_data.get('defaultAudioLanguage', ''),
-                        'tags': video_data.get('tags', []),
-                        'viewCount': statistics.get('viewCount', '0'),
-                        'likeCount': statistics.get('likeCount', '0'),
-                        'commentCount': statistics.get('commentCount', '0'),
-                        'duration': content_details.get('duration', ''),
-                        'definition': content_details.get('definition', ''),
-                        'caption': content_details.get('caption', ''),
-                        'licensedContent': content_details.get('licensedContent', False),
-                        'projection': content_details.get('projection', ''),
-                        'url': f"https://www.youtube.com/watch?v={item['id']}",
-                        'formattedViewCount': format_view_count(statistics.get('viewCount', '0')),
-                        'formattedDuration': format_duration(content_details.get('duration', ''))
-                    }
-                    videos.append(video_info)
+                # 只檢查長度限制，放寬觀看次數要求
+                relaxed_videos = [Video.from_item(item, categories) for item in relaxed_video_items]
+                update_view_velocity(relaxed_videos)
+                relaxed_ranking = TieredFilter(0, max_duration_seconds, max_results, sort_key=VIDEO_SORT_KEYS[sort_by])
+                relaxed_ranking.add_all(relaxed_videos)
+                videos = relaxed_ranking.top('strict')
+                for video in videos:
+                    video.filterTier = 'relaxed_views'
+                used_tier = 'relaxed_views'
+                message = get_relaxed_message(used_tier, len(videos))
                 
-                videos.sort(key=lambda x: int(x['viewCount']), reverse=True)
-                
-                return jsonify({
-                    'success': True,
-                    'videos': videos,
-                    'totalResults': len(videos),
-                    'relaxed': True,
-                    'message': '已放寬搜尋條件以顯示更多結果'
-                })
+                # 放寬搜尋取得的影片也加入候選影片，供之後重新篩選
+                seen_ids = {video.videoId for video in candidates}
+                candidates.extend(video for video in relaxed_videos if video.videoId not in seen_ids)
+        
+        print(f"✅ 篩選後獲得 {len(videos)} 個影片")
         
-        # 儲存搜尋結果以供匯出使用
-        last_search_results = videos.copy()
+        # 所有取得的影片寫入本機資料庫，之後可離線搜尋；結果中的影片加入觀看速度追蹤
+        if region_results:
+            for region in regions:
+                index_videos(region_results[region]['candidates'], region)
+        else:
+            index_videos(candidates, region_filter)
+        watch_view_velocity(videos)
+        
+        # 儲存搜尋結果以供匯出使用；停止原因供重新篩選判斷候選影片是否足夠
+        search_record_params['stop_reason'] = search_stats['stopReason']
+        if region_results:
+            search_record_params['region_stats'] = {region: region_results[region]['stats'] for region in regions}
+        search_id = result_store.put(videos, search_record_params, candidates)
         
         # 使用真實的配額追蹤
         quota_info = get_current_quota_info()
         quota_info['video_count'] = len(videos)  # 更新影片數量
         
-        return jsonify({
+        result = {
+            'type': 'result',
             'success': True,
-            'videos': videos,
+            'searchId': search_id,
+            'videos': serialize_videos(videos, summary_fields),
             'totalResults': len(videos),
+            'tierCounts': ranking.counts,
+            'searchStats': search_stats,
             'quota_info': quota_info,
             'can_export': len(videos) > 0
-        })
+        }
+        if region_breakdown:
+            result['regions'] = regions
+            result['regionBreakdown'] = region_breakdown
+        if used_tier != 'strict':
+            result['relaxed'] = True
+            result['message'] = message
+        yield result
+    
+    finally:
+        if quota_ledger:
+            quota_ledger.release(reservation_id)
+
+def get_search_flight_key(request_params):
+    """進行中搜尋的合併鍵：parse_search_request 正規化後會影響 API 呼叫的搜尋條件（含預算）
+
+    排名依據與回傳欄位不影響取得的候選影片，不列入；筆數會影響提早停止，由 join 只讓筆數不超過
+    執行者的請求加入。加入的請求以共用的候選影片自行重新排名。
+    """
+    mode = request_params['mode']
+    keyword = request_params['keyword'].lower() if mode == 'search' else ''
+    return json.dumps([
+        mode,
+        keyword or ('shorts' if mode == 'search' else ''),
+        str(request_params['category_filter']),
+        request_params['regions'],
+        str(request_params['time_filter']),
+        request_params['min_views'],
+        request_params['max_duration'],
+        request_params['unit_budget']
+    ])
+
+class SearchFlight:
+    """一次進行中的搜尋，結束時記錄最終結果事件或錯誤並通知等待中的請求"""
+
+    __slots__ = ('done', 'result', 'error', 'joiners', 'max_results')
+
+    def __init__(self, max_results=0):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.joiners = 0
+        self.max_results = max_results
+
+    def wait(self, timeout):
+        """等待搜尋結束，逾時回傳 False"""
+        return self.done.wait(timeout)
+
+class SearchFlights:
+    """相同條件的搜尋同時進行時只向 API 執行一次（single-flight），其餘請求等待並共用結果（單一程序）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def join(self, key, max_results):
+        """回傳 (搜尋, 是否由此請求執行)
+
+        進行中的搜尋只在筆數不少於此請求時共用（候選影片依執行者的筆數提早停止）；
+        要求更多筆數時另外執行，之後的相同請求改為等待筆數較多的搜尋。
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight.max_results >= max_results:
+                flight.joiners += 1
+                return flight, False
+            flight = self._flights[key] = SearchFlight(max_results)
+            return flight, True
+
+    def finish(self, key, flight, result=None, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+def encode_search_error(error):
+    """將搜尋錯誤轉為可跨程序保存的格式"""
+    return {
+        'type': type(error).__name__,
+        'message': str(error),
+        'kind': getattr(error, 'kind', None),
+        'retryAfter': getattr(error, 'retry_after', None)
+    }
+
+def decode_search_error(data):
+    """還原 encode_search_error 保存的錯誤（保留 search_error_response 需要的類型）"""
+    if data.get('type') == 'YouTubeApiError':
+        return YouTubeApiError(data['message'], data.get('kind'), data.get('retryAfter'))
+    if data.get('type') == 'QuotaExhaustedError':
+        return QuotaExhaustedError(data['message'])
+    if data.get('type') == 'ValueError':
+        return ValueError(data['message'])
+    return RuntimeError(data['message'])
+
+class SqliteSearchFlight:
+    """由資料庫協調的一次搜尋，等待者以輪詢取得結果"""
+
+    __slots__ = ('flights', 'key', 'owner', 'result', 'error', 'joiners', 'max_results')
+
+    def __init__(self, flights, key, owner, max_results, joiners=0):
+        self.flights = flights
+        self.key = key
+        self.owner = owner
+        self.result = None
+        self.error = None
+        self.joiners = joiners
+        self.max_results = max_results
+
+    def wait(self, timeout):
+        """等待搜尋結束，執行的請求中斷或逾時回傳 False"""
+        return self.flights.wait(self, timeout)
+
+class SqliteSearchFlights:
+    """以 SQLite 協調的 single-flight：多個工作程序之間相同條件的搜尋也只執行一次
+
+    執行的請求在資料庫登記，結束時寫入最終結果事件或錯誤；其他程序的相同搜尋輪詢等待。
+    資料庫無法使用時改為各自搜尋，不影響搜尋本身。
+    """
+
+    poll_interval = 0.2  # 秒
+    finished_ttl = 60  # 已結束的搜尋保留秒數，讓等待者讀取結果
+
+    def __init__(self, db_path, timeout):
+        self.db_path = db_path
+        self.timeout = timeout
+        with closing(get_db_connection(self.db_path)) as conn, conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS search_flights (
+                    flight_key TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    max_results INTEGER NOT NULL,
+                    started_at REAL NOT NULL,
+                    joiners INTEGER NOT NULL DEFAULT 0,
+                    finished_at REAL,
+                    result TEXT,
+                    error TEXT,
+                    PRIMARY KEY (flight_key, owner)
+                )
+            ''')
+
+    def join(self, key, max_results):
+        """回傳 (搜尋, 是否由此請求執行)；與 SearchFlights 相同，只加入筆數不少於此請求的搜尋"""
+        now = time.time()
+        try:
+            with closing(get_db_connection(self.db_path)) as conn:
+                # IMMEDIATE 交易讓同一條件同時只有一個請求登記為執行者
+                conn.execute('BEGIN IMMEDIATE')
+                try:
+                    # 已結束超過保留時間、或執行超過等待上限（程序可能已中斷）的紀錄
+                    conn.execute(
+                        'DELETE FROM search_flights WHERE finished_at < ? OR (finished_at IS NULL AND started_at < ?)',
+                        (now - self.finished_ttl, now - self.timeout)
+                    )
+                    row = conn.execute(
+                        'SELECT owner, max_results, joiners FROM search_flights '
+                        'WHERE flight_key = ? AND finished_at IS NULL AND max_results >= ? '
+                        'ORDER BY max_results ASC LIMIT 1',
+                        (key, max_results)
+                    ).fetchone()
+                    if row:
+                        conn.execute(
+                            'UPDATE search_flights SET joiners = joiners + 1 WHERE flight_key = ? AND owner = ?',
+                            (key, row[0])
+                        )
+                        conn.execute('COMMIT')
+                        return SqliteSearchFlight(self, key, row[0], row[1], row[2] + 1), False
+                    owner = uuid.uuid4().hex
+                    conn.execute(
+                        'INSERT INTO search_flights (flight_key, owner, max_results, started_at) VALUES (?, ?, ?, ?)',
+                        (key, owner, max_results, now)
+                    )
+                    conn.execute('COMMIT')
+                    return SqliteSearchFlight(self, key, owner, max_results), True
+                except Exception:
+                    conn.execute('ROLLBACK')
+                    raise
+        except sqlite3.Error as e:
+            print(f"⚠️  無法登記進行中的搜尋，改為各自搜尋: {e}")
+            return SearchFlight(max_results), True
+
+    def finish(self, key, flight, result=None, error=None):
+        if isinstance(flight, SearchFlight):
+            flight.done.set()
+            return
+        try:
+            result_json = json.dumps(result, ensure_ascii=False) if result is not None else None
+            error_json = json.dumps(encode_search_error(error), ensure_ascii=False) if error is not None else None
+            with closing(get_db_connection(self.db_path)) as conn, conn:
+                if result_json is None and error_json is None:
+                    # 執行的請求被中斷，刪除登記讓等待者自行搜尋
+                    conn.execute('DELETE FROM search_flights WHERE flight_key = ? AND owner = ?', (key, flight.owner))
+                else:
+                    conn.execute(
+                        'UPDATE search_flights SET finished_at = ?, result = ?, error = ? '
+                        'WHERE flight_key = ? AND owner = ?',
+                        (time.time(), result_json, error_json, key, flight.owner)
+                    )
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"⚠️  無法記錄搜尋結果供其他請求共用: {e}")
+
+    def wait(self, flight, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                with closing(get_db_connection(self.db_path)) as conn:
+                    row = conn.execute(
+                        'SELECT finished_at, result, error FROM search_flights WHERE flight_key = ? AND owner = ?',
+                        (flight.key, flight.owner)
+                    ).fetchone()
+            except sqlite3.Error as e:
+                print(f"⚠️  讀取進行中的搜尋失敗: {e}")
+                return False
+            if row is None:
+                return False
+            finished_at, result_json, error_json = row
+            if finished_at is not None:
+                flight.result = json.loads(result_json) if result_json else None
+                flight.error = decode_search_error(json.loads(error_json)) if error_json else None
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(self.poll_interval)
+
+def create_search_flights():
+    """依 STATE_BACKEND 建立進行中搜尋的協調方式，資料庫無法使用時改為單一程序內協調"""
+    if STATE_BACKEND == 'sqlite':
+        try:
+            return SqliteSearchFlights(STATE_DB_PATH, SEARCH_COALESCE_TIMEOUT)
+        except (sqlite3.Error, OSError) as e:
+            print(f"⚠️  無法建立共用的搜尋協調資料庫，改為單一程序內協調: {e}")
+    return SearchFlights()
+
+search_flights = create_search_flights()
+
+def build_joined_result(leader_result, request_params):
+    """以進行中搜尋保存的候選影片，依加入者自己的筆數、排名依據與欄位產生結果事件；結果已不存在時回傳 None"""
+    if not leader_result.get('searchId'):
+        # 沒有任何候選影片的結果可直接共用
+        return dict(leader_result, type='result', coalesced=True)
+    stored = result_store.get(leader_result['searchId'])
+    if not stored:
+        return None
+    
+    params = stored['params']
+    max_results = request_params['max_results']
+    sort_by = request_params['sort_by']
+    summary_fields = request_params['summary_fields']
+    regions = params.get('regions') or [params['region_filter']]
+    max_duration = params['max_duration']
+    max_duration_seconds = int(max_duration) if max_duration != 'all' else None
+    
+    candidates, videos, used_tier, ranking = rerank_candidates(
+        stored['candidates'], params['min_views'], max_duration_seconds, max_results, sort_by
+    )
+    joined_params = dict(params, max_results=max_results, sort_by=sort_by)
+    search_id = result_store.put(videos, joined_params, stored['candidates'])
+    print(f"🤝 共用進行中的相同搜尋結果: 候選影片 {len(candidates)} 個，結果 {len(videos)} 個（未呼叫 API）")
+    
+    quota_info = get_current_quota_info()
+    quota_info['video_count'] = len(videos)
+    result = {
+        'type': 'result',
+        'success': True,
+        'searchId': search_id,
+        'coalesced': True,
+        'videos': serialize_videos(videos, summary_fields),
+        'totalResults': len(videos),
+        'tierCounts': ranking.counts,
+        'searchStats': leader_result.get('searchStats'),
+        'quota_info': quota_info,
+        'can_export': len(videos) > 0
+    }
+    if leader_result.get('regionBreakdown'):
+        region_stats = {
+            item['region']: {name: item[name] for name in ('searchPages', 'candidateIds', 'candidates', 'stopReason')}
+            for item in leader_result['regionBreakdown']
+        }
+        result['regions'] = regions
+        result['regionBreakdown'] = build_region_breakdown(regions, region_stats, candidates, ranking, summary_fields)
+    if used_tier != 'strict':
+        result['relaxed'] = True
+        result['message'] = get_relaxed_message(used_tier, len(videos))
+    return result
+
+def run_search(data):
+    """執行搜尋並產生事件；相同條件的搜尋正在進行時改為等待並共用它的候選影片
+
+    /search 只取最終結果回傳，/search_stream 則把每個事件即時送到瀏覽器。
+    執行搜尋的請求中途失敗時，等待中的請求收到相同的錯誤（參數錯誤除外）；執行的請求被中斷
+    （例如瀏覽器斷線）或等待逾時，等待中的請求改為自行搜尋。
+    """
+    data = data or {}
+    # 先檢查此請求自己的參數，錯誤不會經由合併傳給其他請求
+    request_params = parse_search_request(data)
+    key = get_search_flight_key(request_params)
+    flight, is_leader = search_flights.join(key, request_params['max_results'])
+    if is_leader:
+        result = None
+        error = None
+        try:
+            for event in execute_search(data):
+                if event['type'] == 'result':
+                    result = event
+                yield event
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            # 未正常結束（例如串流被中斷）時兩者皆為 None，等待中的請求會自行搜尋
+            search_flights.finish(key, flight, result=result, error=error)
+        return
+    
+    print(f"🤝 相同條件的搜尋進行中，等待結果（共 {flight.joiners} 個請求等待）")
+    yield {
+        'type': 'progress',
+        'coalesced': True,
+        'searchPages': 0,
+        'candidateIds': 0,
+        'candidates': 0,
+        'qualified': 0
+    }
+    if flight.wait(SEARCH_COALESCE_TIMEOUT):
+        # 參數錯誤屬於執行者自己的請求，不轉給等待中的請求
+        if flight.error is not None and not isinstance(flight.error, ValueError):
+            raise flight.error
+        if flight.result is not None:
+            result = build_joined_result(flight.result, request_params)
+            if result is not None:
+                yield result
+                return
+    print("⚠️  無法共用進行中的搜尋結果，改為自行搜尋")
+    yield from execute_search(data)
+
+def search_error_response(error):
+    """將搜尋錯誤轉為 (回應內容, HTTP 狀態碼)"""
+    if isinstance(error, ValueError):
+        return {'error': str(error)}, 400
+    if isinstance(error, QuotaExhaustedError):
+        return {'error': str(error), 'quota_info': get_current_quota_info()}, 429
+    if not isinstance(error, YouTubeApiError):
+        return {'error': f'搜尋失敗: {error}'}, 500
+    
+    if error.kind == 'auth':
+        payload, status = {
+            'error': 'API Key 無效',
+            'details': [
+                '請檢查以下項目：',
+                '1. API Key 格式正確 (以 AIzaSy 開頭，39字符)',
+                '2. 已在 Google Cloud Console 啟用 YouTube Data API v3',
+                '3. API Key 有正確的權限設定',
+                '4. 未超過每日配額限制'
+            ]
+        }, 400
+    elif error.kind == 'quota':
+        payload, status = {'error': 'API 配額已用完，請明天再試或升級配額', 'quota_info': get_current_quota_info()}, 429
+    elif error.kind == 'rate_limit':
+        payload, status = {'error': 'YouTube API 請求過於頻繁，請稍後再試'}, 429
+    elif error.kind in ('server', 'network'):
+        payload, status = {'error': f'YouTube API 暫時無法連線，請稍後再試: {error}'}, 503
+    else:
+        payload, status = {'error': f'搜尋失敗: {error}'}, 400
+    payload['errorKind'] = error.kind
+    if error.retry_after:
+        payload['retryAfter'] = error.retry_after
+    return payload, status
+
+@bp.route('/search', methods=['POST'])
+def search_videos():
+    """搜尋影片"""
+    try:
+        result = None
+        for event in run_search(request.get_json()):
+            if event['type'] == 'result':
+                result = event
+        result.pop('type')
+        return jsonify(result)
+    except Exception as e:
+        payload, status = search_error_response(e)
+        return jsonify(payload), status
+
+@bp.route('/search_stream', methods=['POST'])
+def search_videos_stream():
+    """串流搜尋：每行一個 JSON 事件（NDJSON），邊搜尋邊送出進度與符合條件的影片，最後送出排序後的結果"""
+    data = request.get_json()
+    
+    def generate():
+        try:
+            for event in run_search(data):
+                yield json.dumps(event, ensure_ascii=False) + '\n'
+        except Exception as e:
+            payload, status = search_error_response(e)
+            yield json.dumps({'type': 'error', 'status': status, **payload}, ensure_ascii=False) + '\n'
     
+    return Response(
+        generate(),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/refine', methods=['POST'])
+def refine_results():
+    """以已保存的候選影片重新套用觀看次數、長度與筆數條件，不呼叫 YouTube API、不消耗配額
+
+    原搜尋提早停止或受預算限制、且候選影片中符合全部條件的影片不足 maxResults 時，回應含
+    poolExhausted: true，表示重新搜尋可能取得更多結果。
+    """
+    data = request.get_json() or {}
+    stored = result_store.get(data.get('searchId'))
+    if not stored:
+        return jsonify({'error': '搜尋結果不存在或已過期，請重新搜尋'}), 404
+    
+    params = stored['params']
+    try:
+        min_views = parse_int_param(data, 'minViews', params['min_views'])
+        max_duration = str(data.get('maxDuration', params['max_duration']))
+        max_results = parse_int_param(data, 'maxResults', params['max_results'])
+        max_duration_seconds = int(max_duration) if max_duration != 'all' else None
+        summary_fields = parse_result_fields(data.get('fields'), RESULT_SUMMARY_FIELDS)
+        sort_by = data.get('sortBy', params.get('sort_by', 'viewCount'))
+        if sort_by not in RANKING_KEYS:
+            raise ValueError(f"不支援的排名依據: {sort_by}，可用: {', '.join(RANKING_KEYS)}")
     except ValueError as ve:
         return jsonify({'error': str(ve)}), 400
-    except Exception as e:
-        error_msg = str(e)
-        if 'API key not valid' in error_msg:
-            return jsonify({
-                'error': 'API Key 無效',
-                'details': [
-                    '請檢查以下項目：',
-                    '1. API Key 格式正確 (以 AIzaSy 開頭，39字符)',
-                    '2. 已在 Google Cloud Console 啟用 YouTube Data API v3',
-                    '3. API Key 有正確的權限設定',
-                    '4. 未超過每日配額限制'
-                ]
-            }), 400
-        elif 'quotaExceeded' in error_msg:
-            return jsonify({'error': 'API 配額已用完，請明天再試或升級配額'}), 429
-        else:
-            return jsonify({'error': f'搜尋失敗: {error_msg}'}), 500
+    regions = params.get('regions') or [params['region_filter']]
+    if len(regions) > 1 and summary_fields is not None and 'regions' not in summary_fields:
+        summary_fields = summary_fields + ['regions']
+    
+    candidates = stored['candidates']
+    copies, videos, used_tier, ranking = rerank_candidates(
+        candidates, min_views, max_duration_seconds, max_results, sort_by
+    )
+    pool_exhausted = ranking.counts['strict'] < max_results and is_candidate_pool_truncated(params)
+    print(f"🔁 重新篩選 {len(candidates)} 個候選影片: 最少觀看={min_views}, 最大長度={max_duration}, "
+          f"結果 {len(videos)} 個（未呼叫 API）")
+    
+    refined_params = dict(params, min_views=min_views, max_duration=max_duration, max_results=max_results,
+                          sort_by=sort_by)
+    search_id = result_store.put(videos, refined_params, candidates)
+    
+    quota_info = get_current_quota_info()
+    quota_info['video_count'] = len(videos)
+    
+    result = {
+        'success': True,
+        'searchId': search_id,
+        'refined': True,
+        'videos': serialize_videos(videos, summary_fields),
+        'totalResults': len(videos),
+        'candidatePool': len(candidates),
+        'poolExhausted': pool_exhausted,
+        'stopReason': params.get('stop_reason'),
+        'tierCounts': ranking.counts,
+        'quota_info': quota_info,
+        'can_export': len(videos) > 0
+    }
+    if len(regions) > 1:
+        result['regions'] = regions
+        result['regionBreakdown'] = build_region_breakdown(
+            regions, params.get('region_stats') or {}, copies, ranking, summary_fields
+        )
+    if used_tier != 'strict':
+        result['relaxed'] = True
+        result['message'] = get_relaxed_message(used_tier, len(videos))
+    return jsonify(result)
 
-@app.route('/export_csv', methods=['GET'])
-def export_csv():
-    """匯出CSV檔案"""
+@bp.route('/search_local', methods=['POST'])
+def search_local():
+    """在本機影片資料庫中搜尋（不呼叫 YouTube API、不消耗配額），條件與 /search 相同"""
+    if not video_index:
+        return jsonify({'error': '本機影片資料庫未啟用'}), 400
+    
+    data = request.get_json() or {}
+    keyword = data.get('keyword', '').strip()
+    category_filter = data.get('categoryFilter', 'all')
+    region_filter = data.get('regionFilter', 'TW')
+    time_filter = data.get('timeFilter', 'all')
     try:
-        global last_search_results, last_search_params
-        
-        if not last_search_results:
-            return jsonify({'error': '沒有可匯出的搜尋結果'}), 400
-        
-        print(f"📊 開始匯出CSV，共 {len(last_search_results)} 筆資料")
-        print(f"🔍 搜尋參數: {last_search_params}")  # 調試用
-        
-        # 準備CSV數據 - 使用 BytesIO 和 UTF-8 編碼
-        from io import BytesIO
-        output = BytesIO()
-        
-        # 寫入 UTF-8 BOM，讓 Excel 能正確識別編碼
-        output.write('\ufeff'.encode('utf-8'))
-        
-        # 寫入標題行
-        headers = [
-            '影片ID', '影片標題', '頻道名稱', '頻道ID', '影片類別', '上傳時間',
-            '觀看次數', '按讚數', '留言數', '影片長度', '畫質', '字幕', 
-            '授權內容', '影片連結', '影片描述', '標籤'
-        ]
+        min_views = parse_int_param(data, 'minViews', 1000)
+        max_duration = str(data.get('maxDuration', 'all'))
+        max_results = parse_int_param(data, 'maxResults', 25)
+        max_duration_seconds = int(max_duration) if max_duration != 'all' else None
+        published_after = time.time() - int(time_filter) * 3600 if time_filter != 'all' else None
+        summary_fields = parse_result_fields(data.get('fields'), RESULT_SUMMARY_FIELDS)
+        sort_by = data.get('sortBy', 'viewCount')
+        if sort_by not in RANKING_KEYS:
+            raise ValueError(f"不支援的排名依據: {sort_by}，可用: {', '.join(RANKING_KEYS)}")
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    
+    try:
+        candidates = video_index.search(
+            keyword,
+            region_code=region_filter if region_filter != 'all' else None,
+            category_id=category_filter if category_filter != 'all' else None,
+            published_after=published_after
+        )
+        indexed_count = video_index.count()
+        # 本機資料的觀看數可能已過時，只讀取追蹤快照計算速度，不新增快照
+        if velocity_tracker:
+            velocity_tracker.annotate(candidates)
+    except sqlite3.Error as e:
+        print(f"❌ 本機搜尋錯誤: {e}")
+        return jsonify({'error': f'本機搜尋失敗: {str(e)}'}), 500
+    
+    ranking = TieredFilter(min_views, max_duration_seconds, max_results, sort_key=VIDEO_SORT_KEYS[sort_by])
+    ranking.add_all(candidates)
+    videos, used_tier = ranking.select()
+    print(f"🗂️  本機搜尋: 關鍵字='{keyword}', 地區={region_filter}, 類別={category_filter}, "
+          f"符合 {len(candidates)}/{indexed_count} 個，結果 {len(videos)} 個")
+    
+    search_id = result_store.put(videos, {
+        'keyword': keyword if keyword else 'shorts',
+        'category_filter': category_filter,
+        'region_filter': region_filter,
+        'time_filter': time_filter,
+        'min_views': min_views,
+        'max_duration': max_duration,
+        'max_results': max_results,
+        'sort_by': sort_by
+    }, candidates)
+    
+    quota_info = get_current_quota_info()
+    quota_info['video_count'] = len(videos)
+    
+    result = {
+        'success': True,
+        'searchId': search_id,
+        'source': 'local',
+        'videos': serialize_videos(videos, summary_fields),
+        'totalResults': len(videos),
+        'candidatePool': len(candidates),
+        'indexedVideos': indexed_count,
+        'tierCounts': ranking.counts,
+        'quota_info': quota_info,
+        'can_export': len(videos) > 0
+    }
+    if used_tier != 'strict':
+        result['relaxed'] = True
+        result['message'] = get_relaxed_message(used_tier, len(videos))
+    return jsonify(result)
+
+@bp.route('/results/<search_id>', methods=['GET'])
+def get_search_results(search_id):
+    """分頁取得已保存的搜尋結果，可指定 offset、limit、sort（欄位名稱，前加 - 為遞減）、fields、ids
+
+    set=candidates 時改為分頁取得全部候選影片（依搜尋條件分級排名），可取得最終結果以外的影片。
+    """
+    stored = result_store.get(search_id)
+    if not stored:
+        return jsonify({'error': '搜尋結果不存在或已過期，請重新搜尋'}), 404
+    
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(RESULTS_PAGE_MAX, max(1, int(request.args.get('limit', RESULTS_PAGE_LIMIT))))
+        fields = parse_result_fields(request.args.get('fields'), RESULT_SUMMARY_FIELDS)
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+    
+    result_set = request.args.get('set', 'results')
+    if result_set == 'results':
+        videos = stored['videos']
+    elif result_set == 'candidates':
+        videos = rank_stored_candidates(stored)
+    else:
+        return jsonify({'error': f'不支援的結果集: {result_set}，可用: results, candidates'}), 400
+    
+    # 只取指定的影片
+    ids = request.args.get('ids')
+    if ids:
+        wanted = set(ids.split(','))
+        videos = [video for video in videos if video.videoId in wanted]
+    
+    # 未指定排序時維持搜尋結果的排名順序
+    sort = request.args.get('sort')
+    if sort:
+        sort_key = VIDEO_SORT_KEYS.get(sort.lstrip('-'))
+        if sort_key is None:
+            return jsonify({'error': f"不支援的排序欄位: {sort}，可用: {', '.join(VIDEO_SORT_KEYS)}"}), 400
+        videos = sorted(videos, key=sort_key, reverse=sort.startswith('-'))
+    
+    return jsonify({
+        'success': True,
+        'searchId': search_id,
+        'set': result_set,
+        'total': len(videos),
+        'offset': offset,
+        'limit': limit,
+        'videos': serialize_videos(videos[offset:offset + limit], fields)
+    })
+
+@bp.route('/export_csv', methods=['GET'])
+def export_csv():
+    """匯出CSV檔案（邊產生邊下載，記憶體用量不隨資料筆數增加）"""
+    stored = result_store.get(request.args.get('searchId'))
+    if not stored or not stored['videos']:
+        return jsonify({'error': '沒有可匯出的搜尋結果，搜尋結果可能已過期，請重新搜尋'}), 400
+    videos = stored['videos']
+    search_params = stored['params']
+    
+    print(f"📊 開始匯出CSV，共 {len(videos)} 筆資料")
+    print(f"🔍 搜尋參數: {search_params}")  # 調試用
+    
+    # 根據搜尋條件生成檔案名稱
+    filename = generate_csv_filename(search_params)
+    
+    def generate():
+        buffer = StringIO()
+        # 使用 csv 模組處理引號、逗號與換行；每個欄位都加上引號
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
         
-        # 建立 CSV 行
-        csv_lines = []
-        csv_lines.append(','.join([f'"{h}"' for h in headers]))
+        # 先送出 UTF-8 BOM（讓 Excel 能正確識別編碼）與標題行，下載立即開始
+        writer.writerow(EXPORT_HEADERS)
+        yield '\ufeff' + buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
         
-        # 寫入數據行
-        for video in last_search_results:
+        row_count = 0
+        for video in videos:
             try:
-                # 處理時間格式
-                try:
-                    published_date = datetime.fromisoformat(video['publishedAt'].replace('Z', '+00:00'))
-                    formatted_date = published_date.strftime('%Y-%m-%d %H:%M:%S')
-                except:
-                    formatted_date = video['publishedAt']
-                
-                # 處理標籤
-                tags_str = ', '.join(video.get('tags', [])) if video.get('tags') else '無'
-                
-                # 清理描述文字中的換行符和特殊字符
-                description = video['description'].replace('\n', ' ').replace('\r', ' ').replace('"', '""')
-                if len(description) > 500:
-                    description = description[:500] + '...'
-                
-                # 清理標題中的特殊字符
-                title = video['title'].replace('"', '""')
-                channel_title = video['channelTitle'].replace('"', '""')
-                
-                row_data = [
-                    video['videoId'],
-                    title,
-                    channel_title,
-                    video['channelId'],
-                    video.get('categoryName', '未知'),
-                    formatted_date,
-                    str(int(video['viewCount'])),
-                    str(int(video['likeCount'])),
-                    str(int(video['commentCount'])),
-                    video['formattedDuration'],
-                    video['definition'],
-                    '有' if video['caption'] == 'true' else '無',
-                    '是' if video['licensedContent'] else '否',
-                    video['url'],
-                    description,
-                    tags_str
-                ]
-                
-                # 將每個欄位包裹在引號中以處理逗號和特殊字符
-                csv_line = ','.join([f'"{field}"' for field in row_data])
-                csv_lines.append(csv_line)
+                writer.writerow(build_export_row(video))
             except Exception as e:
-                print(f"⚠️ 處理影片 {video.get('videoId', 'unknown')} 時發生錯誤: {e}")
+                print(f"⚠️ 處理影片 {video.videoId} 時發生錯誤: {e}")
                 continue
+            row_count += 1
+            # 累積一批資料列再送出
+            if row_count % EXPORT_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
         
-        # 寫入所有行
-        csv_content = '\n'.join(csv_lines)
-        output.write(csv_content.encode('utf-8'))
-        
-        # 準備下載
-        output.seek(0)
-        
-        # 根據搜尋條件生成檔案名稱（改為 CSV）
-        filename = generate_csv_filename(last_search_params)
-        
-        print(f"✅ CSV檔案生成成功: {filename}，共 {len(csv_lines)-1} 筆資料")
-        
-        # 創建響應 - 使用 send_file 處理二進制數據
-        from flask import send_file
-        from urllib.parse import quote
-        
-        output.seek(0)
-        
-        # URL 編碼檔名以支援中文
-        encoded_filename = quote(filename)
-        
-        return send_file(
-            output,
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=filename
-        )
-        
-    except Exception as e:
-        print(f"❌ CSV匯出錯誤: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': f'匯出失敗: {str(e)}'}), 500
+        yield buffer.getvalue()
+        print(f"✅ CSV檔案匯出完成: {filename}，共 {row_count} 筆資料")
+    
+    return Response(
+        generate(),
+        mimetype='text/csv',
+        headers=build_attachment_headers(filename)
+    )
+
+@bp.route('/export_xlsx', methods=['GET'])
+def export_xlsx():
+    """匯出Excel檔案（以串流方式逐列寫入壓縮檔，不在記憶體中建立整份活頁簿）"""
+    stored = result_store.get(request.args.get('searchId'))
+    if not stored or not stored['videos']:
+        return jsonify({'error': '沒有可匯出的搜尋結果，搜尋結果可能已過期，請重新搜尋'}), 400
+    videos = stored['videos']
+    search_params = stored['params']
+    
+    print(f"📊 開始匯出Excel，共 {len(videos)} 筆資料")
+    
+    filename = generate_excel_filename(search_params)
+    
+    def generate():
+        sink = StreamSink()
+        with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as workbook:
+            for part_name, content in XLSX_STATIC_PARTS.items():
+                workbook.writestr(part_name, content)
+            yield sink.drain()
+            
+            force_zip64 = len(videos) > XLSX_ZIP64_ROWS
+            with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=force_zip64) as sheet:
+                sheet.write((
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                    '<sheetViews><sheetView workbookViewId="0">'
+                    '<pane ySplit="1" topLeftCell="A2" activePane="bottomLeft" state="frozen"/>'
+                    '</sheetView></sheetViews><sheetData>'
+                    + build_xlsx_row(1, EXPORT_HEADERS, style=1)
+                ).encode('utf-8'))
+                
+                rows = []
+                row_count = 0
+                for video in videos:
+                    try:
+                        rows.append(build_xlsx_row(row_count + 2, build_export_row(video)))
+                    except Exception as e:
+                        print(f"⚠️ 處理影片 {video.videoId} 時發生錯誤: {e}")
+                        continue
+                    row_count += 1
+                    # 累積一批資料列再壓縮送出
+                    if len(rows) >= EXPORT_CHUNK_ROWS:
+                        sheet.write(''.join(rows).encode('utf-8'))
+                        rows.clear()
+                        yield sink.drain()
+                
+                sheet.write((''.join(rows) + '</sheetData></worksheet>').encode('utf-8'))
+        yield sink.drain()
+        print(f"✅ Excel檔案匯出完成: {filename}，共 {row_count} 筆資料")
+    
+    return Response(
+        generate(),
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        headers=build_attachment_headers(filename)
+    )
+
+_background_tasks_lock = threading.Lock()
+_background_tasks_started = False
+
+def start_background_tasks():
+    """預先載入影片類別並啟動觀看速度追蹤（每個程序只執行一次）"""
+    global _background_tasks_started
+    with _background_tasks_lock:
+        if _background_tasks_started:
+            return
+        _background_tasks_started = True
+    warm_up_category_cache()
+    start_velocity_poller()
+
+def create_app(start_background=True):
+    """建立 Flask 應用程式，供 WSGI 伺服器（gunicorn、waitress 等）使用
+
+    配額紀錄、影片快取、搜尋結果暫存與進行中的搜尋都保存在 data 目錄的 SQLite 資料庫，
+    多個工作程序共用同一份狀態。
+    """
+    app = Flask(__name__)
+    app.register_blueprint(bp)
+    if start_background:
+        start_background_tasks()
+    return app
 
 if __name__ == '__main__':
     print("=" * 50)
@@ -944,5 +4037,8 @@ if __name__ == '__main__':
         print("✅ API Key 格式看起來正確")
         print()
     
+    # debug 模式的自動重載會啟動兩個程序，只在實際提供服務的子程序預先載入
+    app = create_app(start_background=os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
+    
     print("🚀 啟動伺服器...")
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""測試共用設定：以假的 YouTube 服務取代 API，所有資料庫寫到暫存目錄"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app 在匯入時讀取設定並建立資料庫，必須先設定環境變數
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='shorts-test-')
+os.environ['YOUTUBE_API_KEY'] = 'AIzaSy' + 'x' * 33
+os.environ['SEARCH_CACHE_ENABLED'] = 'false'
+os.environ['VIDEO_CACHE_ENABLED'] = 'false'
+os.environ['VIDEO_INDEX_ENABLED'] = 'false'
+os.environ['VELOCITY_TRACKING_ENABLED'] = 'false'
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+def video_id(n):
+    return f'vid{n:05d}'
+
+
+def video_views(n):
+    """假影片的觀看次數（由編號決定，每次執行都相同）"""
+    return (n * 7919) % 100000
+
+
+def video_seconds(n):
+    return n % 120 + 1
+
+
+def make_item(n, views=None, seconds=None):
+    """產生 videos().list 格式的假影片資料"""
+    return {
+        'id': video_id(n),
+        'snippet': {
+            'title': f'title {n}',
+            'description': f'desc "{n}",\nsecond line',
+            'channelTitle': 'channel',
+            'channelId': 'UC123',
+            'publishedAt': '2026-10-17T00:00:00Z',
+            'thumbnails': {'default': {'url': 'd.jpg'}, 'medium': {'url': 'm.jpg'}},
+            'categoryId': '10',
+            'tags': ['a', 'b'],
+        },
+        'statistics': {
+            'viewCount': str(video_views(n) if views is None else views),
+            'likeCount': '5',
+            'commentCount': '1',
+        },
+        'contentDetails': {
+            'duration': f'PT{video_seconds(n) if seconds is None else seconds}S',
+            'definition': 'hd',
+            'caption': 'false',
+            'licensedContent': True,
+            'projection': 'rectangular',
+        },
+    }
+
+
+class FakeRequest:
+    def __init__(self, response):
+        self._response = response
+
+    def execute(self, **kwargs):
+        if isinstance(self._response, Exception):
+            raise self._response
+        return self._response
+
+
+class FakeCollection:
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+
+    def list(self, **kwargs):
+        self.service.calls.append((self.name, kwargs))
+        return FakeRequest(self.service.respond(self.name, kwargs))
+
+
+class FakeYouTube:
+    """固定回應的 YouTube 服務：每頁 50 個影片，共 pages 頁"""
+
+    def __init__(self, pages=12):
+        self.pages = pages
+        self.calls = []
+
+    def search(self):
+        return FakeCollection(self, 'search')
+
+    def videos(self):
+        return FakeCollection(self, 'videos')
+
+    def videoCategories(self):
+        return FakeCollection(self, 'videoCategories')
+
+    def count(self, name):
+        return sum(1 for call_name, _ in self.calls if call_name == name)
+
+    def respond(self, name, kwargs):
+        if name == 'search':
+            page = int(kwargs.get('pageToken', '0'))
+            response = {'items': [{'id': {'videoId': video_id(page * 50 + j)}} for j in range(50)]}
+            if page + 1 < self.pages:
+                response['nextPageToken'] = str(page + 1)
+            return response
+        if name == 'videos':
+            return {'items': [make_item(int(vid[3:])) for vid in kwargs['id'].split(',')]}
+        if name == 'videoCategories':
+            return {'items': [{'id': '10', 'snippet': {'title': 'Music'}}]}
+        raise AssertionError(f'unexpected call {name}')
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+@pytest.fixture
+def youtube(monkeypatch):
+    service = FakeYouTube()
+    monkeypatch.setattr(app_module, 'get_youtube_service', lambda *args, **kwargs: service)
+    return service
+
+
+@pytest.fixture
+def client(youtube):
+    return app_module.create_app(start_background=False).test_client()
+
+
+def run_generator(generator):
+    """執行產生事件的搜尋函式，回傳 (事件清單, return 值)"""
+    events = []
+    while True:
+        try:
+            events.append(next(generator))
+        except StopIteration as stop:
+            return events, stop.value
@@ -0,0 +1,78 @@
+"""CSV 與 Excel 匯出的檔案結構"""
+import csv
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pytest
+
+SHEET_NS = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+
+@pytest.fixture
+def search_id(app, client, monkeypatch):
+    # 縮小每批筆數，讓測試資料也會分成多批送出
+    monkeypatch.setattr(app, 'EXPORT_CHUNK_ROWS', 7)
+    response = client.post('/search', json={'keyword': 'test', 'minViews': 1000, 'maxResults': 30})
+    return response.get_json()['searchId']
+
+
+def result_videos(client, search_id):
+    return client.get(f'/results/{search_id}?limit=500&fields=all').get_json()['videos']
+
+
+def test_csv_export_rows(app, client, search_id):
+    response = client.get(f'/export_csv?searchId={search_id}')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/csv'
+    assert 'attachment' in response.headers['Content-Disposition']
+    
+    text = response.get_data(as_text=True)
+    assert text.startswith('\ufeff"')
+    rows = list(csv.reader(io.StringIO(text[1:])))
+    assert rows[0] == app.EXPORT_HEADERS
+    videos = result_videos(client, search_id)
+    assert len(rows) == len(videos) + 1 == 31
+    for row, video in zip(rows[1:], videos):
+        assert len(row) == len(app.EXPORT_HEADERS)
+        assert row[0] == video['videoId']
+        assert row[6] == video['viewCount']
+        # 引號與逗號完整保留，換行改為空白
+        assert row[16] == video['description'].replace('\n', ' ')
+
+
+def test_xlsx_export_structure(app, client, search_id):
+    response = client.get(f'/export_xlsx?searchId={search_id}')
+    assert response.status_code == 200
+    
+    with zipfile.ZipFile(io.BytesIO(response.data)) as workbook:
+        assert workbook.testzip() is None
+        assert set(app.XLSX_STATIC_PARTS) | {'xl/worksheets/sheet1.xml'} == set(workbook.namelist())
+        # 資料量不大時不使用 Zip64，舊版試算表軟體也能開啟
+        assert workbook.getinfo('xl/worksheets/sheet1.xml').extract_version < zipfile.ZIP64_VERSION
+        sheet = ET.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+    
+    rows = sheet.findall('s:sheetData/s:row', SHEET_NS)
+    videos = result_videos(client, search_id)
+    assert len(rows) == len(videos) + 1
+    assert [row.get('r') for row in rows] == [str(n) for n in range(1, len(rows) + 1)]
+    header = [cell.find('s:is/s:t', SHEET_NS).text for cell in rows[0]]
+    assert header == app.EXPORT_HEADERS
+    
+    first = {cell.get('r'): cell for cell in rows[1]}
+    assert first['A2'].find('s:is/s:t', SHEET_NS).text == videos[0]['videoId']
+    # 觀看次數寫成數值
+    assert first['G2'].find('s:v', SHEET_NS).text == videos[0]['viewCount']
+
+
+def test_xlsx_uses_zip64_above_threshold(app, client, search_id, monkeypatch):
+    monkeypatch.setattr(app, 'XLSX_ZIP64_ROWS', 10)
+    response = client.get(f'/export_xlsx?searchId={search_id}')
+    with zipfile.ZipFile(io.BytesIO(response.data)) as workbook:
+        assert workbook.getinfo('xl/worksheets/sheet1.xml').extract_version >= zipfile.ZIP64_VERSION
+        assert workbook.testzip() is None
+
+
+@pytest.mark.parametrize('path', ['/export_csv', '/export_xlsx'])
+def test_export_without_results_returns_400(client, path):
+    assert client.get(f'{path}?searchId=missing').status_code == 400
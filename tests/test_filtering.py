@@ -0,0 +1,71 @@
+"""TieredFilter 分級篩選與 Top-K 排名"""
+from conftest import make_item
+
+
+def make_videos(app, specs):
+    """specs 為 (觀看次數, 秒數) 清單，依序產生影片"""
+    return [app.Video.from_item(make_item(n, views, seconds), {}) for n, (views, seconds) in enumerate(specs)]
+
+
+def test_strict_only_when_at_least_half(app):
+    videos = make_videos(app, [(5000, 30)] * 3 + [(5000, 300)] * 5)
+    selected, tier = app.TieredFilter(1000, 60, 6).add_all(videos).select()
+    assert tier == 'strict'
+    assert [video.videoId for video in selected] == ['vid00000', 'vid00001', 'vid00002']
+    assert {video.filterTier for video in selected} == {'strict'}
+
+
+def test_relaxed_duration_fills_up_to_limit(app):
+    videos = make_videos(app, [(5000, 30), (9000, 300), (7000, 300), (8000, 300), (500, 10)])
+    ranking = app.TieredFilter(1000, 60, 4).add_all(videos)
+    selected, tier = ranking.select()
+    assert tier == 'relaxed_duration'
+    # 符合全部條件的影片在前，其餘依觀看次數補足
+    assert [video.viewCount for video in selected] == [5000, 9000, 8000, 7000]
+    assert [video.filterTier for video in selected] == ['strict'] + ['relaxed_duration'] * 3
+    assert ranking.counts == {'strict': 1, 'relaxed_duration': 3, 'relaxed_views': 1}
+
+
+def test_few_strict_without_relaxed_duration_keeps_strict(app):
+    videos = make_videos(app, [(5000, 30), (500, 10), (600, 20)])
+    selected, tier = app.TieredFilter(1000, 60, 10).add_all(videos).select()
+    assert tier == 'strict'
+    assert [video.viewCount for video in selected] == [5000]
+
+
+def test_half_threshold_depends_on_limit(app):
+    videos = make_videos(app, [(5000, 30), (9000, 300), (7000, 300), (8000, 300)])
+    selected, tier = app.TieredFilter(1000, 60, 6).add_all(videos).select()
+    assert tier == 'relaxed_duration'
+    assert len(selected) == 4
+    selected, tier = app.TieredFilter(1000, 60, 2).add_all(videos).select()
+    assert (tier, [video.viewCount for video in selected]) == ('strict', [5000])
+
+
+def test_relaxed_views_only_when_nothing_else(app):
+    videos = make_videos(app, [(500, 10), (900, 20), (700, 300)])
+    selected, tier = app.TieredFilter(1000, 60, 10).add_all(videos).select()
+    assert tier == 'relaxed_views'
+    assert [video.viewCount for video in selected] == [900, 500]
+
+
+def test_top_k_keeps_highest_views_in_order(app):
+    views = [(n * 7919) % 100000 for n in range(200)]
+    videos = make_videos(app, [(view, 30) for view in views])
+    selected, tier = app.TieredFilter(0, None, 10).add_all(videos).select()
+    assert tier == 'strict'
+    assert [video.viewCount for video in selected] == sorted(views, reverse=True)[:10]
+
+
+def test_ties_keep_earlier_video(app):
+    videos = make_videos(app, [(1000, 30)] * 5)
+    selected, _ = app.TieredFilter(0, None, 3).add_all(videos).select()
+    assert [video.videoId for video in selected] == ['vid00000', 'vid00001', 'vid00002']
+
+
+def test_no_duration_limit_and_unmatched(app):
+    ranking = app.TieredFilter(1000, None, 5)
+    long_video, low_video = make_videos(app, [(5000, 3600), (10, 3600)])
+    assert ranking.classify(long_video) == 'strict'
+    assert ranking.classify(low_video) == 'relaxed_views'
+    assert app.TieredFilter(1000, 60, 5).classify(low_video) is None
@@ -0,0 +1,56 @@
+"""多地區同時搜尋的去重複與各地區類別名稱"""
+import pytest
+
+from conftest import FakeYouTube, video_id
+
+# 各地區搜尋結果的起始編號：TW 0-49、JP 25-74（25 個影片兩個地區都有）
+REGION_OFFSETS = {'TW': 0, 'JP': 25}
+
+
+class RegionalYouTube(FakeYouTube):
+    def respond(self, name, kwargs):
+        if name == 'search':
+            offset = REGION_OFFSETS[kwargs['regionCode']]
+            return {'items': [{'id': {'videoId': video_id(offset + j)}} for j in range(50)]}
+        if name == 'videoCategories':
+            return {'items': [{'id': '10', 'snippet': {'title': 'Music-' + kwargs['regionCode']}}]}
+        return super().respond(name, kwargs)
+
+
+@pytest.fixture
+def youtube(app, monkeypatch):
+    service = RegionalYouTube()
+    monkeypatch.setattr(app, 'get_youtube_service', lambda *args, **kwargs: service)
+    monkeypatch.setattr(app, 'category_cache', app.CategoryCache(app.CATEGORY_CACHE_TTL, app.CATEGORY_RETRY_INTERVAL))
+    return service
+
+
+def test_regions_share_detail_lookups_and_keep_own_categories(client, youtube):
+    response = client.post('/search', json={
+        'keyword': 'test', 'regions': ['TW', 'JP'], 'minViews': 0, 'maxResults': 100
+    })
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data['searchStats']['candidateIds'] == 75
+    # 兩個地區都搜尋到的影片只查詢一次詳細資訊
+    requested = [vid for name, kwargs in youtube.calls if name == 'videos' for vid in kwargs['id'].split(',')]
+    assert sorted(requested) == [video_id(n) for n in range(75)]
+    assert youtube.count('videoCategories') == 2
+    
+    videos = client.get(
+        f"/results/{data['searchId']}?limit=500&fields=videoId,categoryName,regions"
+    ).get_json()['videos']
+    by_id = {video['videoId']: video for video in videos}
+    assert len(by_id) == 75
+    assert by_id[video_id(0)]['regions'] == ['TW']
+    assert by_id[video_id(30)]['regions'] == ['TW', 'JP']
+    assert by_id[video_id(60)]['regions'] == ['JP']
+    # 類別名稱取自最先搜尋到該影片的地區
+    assert by_id[video_id(30)]['categoryName'] == 'Music-TW'
+    assert by_id[video_id(60)]['categoryName'] == 'Music-JP'
+
+
+def test_multiple_regions_rejected_for_trending(client, youtube):
+    response = client.post('/search', json={'mode': 'trending', 'regions': ['TW', 'JP']})
+    assert response.status_code == 400
+    assert youtube.calls == []
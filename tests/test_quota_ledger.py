@@ -0,0 +1,110 @@
+"""QuotaLedger 的太平洋時間換日與配額保留"""
+from datetime import datetime, timezone
+
+import pytest
+
+
+@pytest.fixture
+def clock(app, monkeypatch):
+    """固定 app 取得的目前時間（UTC）"""
+    current = {'now': datetime(2026, 10, 18, 12, 0, tzinfo=timezone.utc)}
+
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return current['now'].astimezone(tz) if tz else current['now'].replace(tzinfo=None)
+
+    monkeypatch.setattr(app, 'datetime', FixedDatetime)
+    return current
+
+
+@pytest.fixture
+def ledger(app, tmp_path):
+    return app.QuotaLedger(str(tmp_path / 'quota.db'), 10000, 600)
+
+
+@pytest.mark.parametrize('utc_time, day', [
+    # 夏令時間（UTC-7）
+    (datetime(2026, 10, 18, 6, 59), '2026-10-17'),
+    (datetime(2026, 10, 18, 7, 0), '2026-10-18'),
+    # 標準時間（UTC-8）
+    (datetime(2026, 12, 1, 7, 59), '2026-11-30'),
+    (datetime(2026, 12, 1, 8, 0), '2026-12-01'),
+    # 11 月第一個星期日 09:00 UTC 結束夏令時間
+    (datetime(2026, 11, 1, 8, 59), '2026-11-01'),
+    (datetime(2026, 3, 8, 9, 59), '2026-03-08'),
+])
+def test_quota_day_follows_pacific_time(app, clock, utc_time, day):
+    clock['now'] = utc_time.replace(tzinfo=timezone.utc)
+    assert app.get_quota_day() == day
+
+
+def test_record_accumulates_cost(ledger, clock):
+    ledger.record(search_calls=1)
+    usage = ledger.record(video_calls=3, category_calls=1)
+    assert usage == {
+        'date': '2026-10-18', 'search_calls': 1, 'video_calls': 3,
+        'category_calls': 1, 'total_cost': 104, 'reserved': 0
+    }
+
+
+def test_usage_resets_at_pacific_midnight(ledger, clock):
+    clock['now'] = datetime(2026, 10, 19, 6, 30, tzinfo=timezone.utc)
+    ledger.record(search_calls=5)
+    reservation_id, units = ledger.reserve(2000, 100)
+    assert units == 2000
+    assert ledger.usage()['total_cost'] == 500
+    
+    clock['now'] = datetime(2026, 10, 19, 7, 30, tzinfo=timezone.utc)
+    usage = ledger.usage()
+    assert (usage['date'], usage['total_cost'], usage['reserved']) == ('2026-10-19', 0, 0)
+    # 前一天的保留量不佔用新一天的配額
+    assert ledger.reserve(10000, 100)[1] == 10000
+    assert ledger.reserve(1, 1) == (None, 0)
+
+
+def test_reservations_limit_concurrent_searches(ledger, clock):
+    first_id, first_units = ledger.reserve(3000, 100)
+    assert first_units == 3000
+    assert ledger.reserve(8000, 100)[1] == 7000
+    assert ledger.reserve(100, 100) == (None, 0)
+    
+    ledger.release(first_id)
+    assert ledger.usage()['reserved'] == 7000
+    assert ledger.reserve(5000, 100)[1] == 3000
+
+
+def test_recorded_usage_is_deducted_from_reservations(ledger, clock):
+    first_id, _ = ledger.reserve(3000, 100)
+    second_id, _ = ledger.reserve(500, 100)
+    usage = ledger.record(search_calls=10, video_calls=10)
+    # 已使用的 1010 單位先從較早的保留扣除，不重複計算
+    assert (usage['total_cost'], usage['reserved']) == (1010, 2490)
+    third_id, third_units = ledger.reserve(10000, 100)
+    assert third_units == 10000 - 1010 - 2490
+    
+    # 第一筆保留用完後繼續扣除下一筆保留
+    ledger.release(second_id)
+    usage = ledger.record(search_calls=30)
+    assert (usage['total_cost'], usage['reserved']) == (4010, 6500 - 1010)
+    ledger.release(first_id)
+    assert ledger.usage()['reserved'] == 5490
+    
+    # 保留量全部用完後，使用量只計入總量
+    usage = ledger.record(search_calls=60)
+    assert (usage['total_cost'], usage['reserved']) == (10010, 0)
+    ledger.release(third_id)
+    assert ledger.reserve(1, 1) == (None, 0)
+
+
+def test_expired_reservations_are_ignored(app, ledger, clock, monkeypatch):
+    ledger.reserve(9000, 100)
+    later = app.time.time() + 601
+    monkeypatch.setattr(app.time, 'time', lambda: later)
+    assert ledger.usage()['reserved'] == 0
+    assert ledger.reserve(10000, 100)[1] == 10000
+
+
+def test_reserve_uses_given_daily_limit(ledger, clock):
+    assert ledger.reserve(50000, 100, daily_limit=30000)[1] == 30000
+    assert ledger.reserve(100, 100, daily_limit=30000) == (None, 0)
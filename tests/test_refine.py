@@ -0,0 +1,62 @@
+"""/refine 與 set=candidates 以保存的候選影片重新篩選，不呼叫 API"""
+import pytest
+
+from conftest import video_seconds, video_views
+
+
+@pytest.fixture
+def search_id(client):
+    response = client.post('/search', json={'keyword': 'test', 'minViews': 1000, 'maxResults': 30})
+    assert response.status_code == 200
+    return response.get_json()['searchId']
+
+
+def test_refine_uses_stored_candidates(client, youtube, search_id):
+    calls = len(youtube.calls)
+    response = client.post('/refine', json={
+        'searchId': search_id, 'minViews': 50000, 'maxDuration': '60', 'maxResults': 5, 'fields': 'videoId,viewCount'
+    })
+    data = response.get_json()
+    assert response.status_code == 200
+    assert len(youtube.calls) == calls
+    expected = sorted(
+        (video_views(n) for n in range(50) if video_views(n) >= 50000 and video_seconds(n) <= 60), reverse=True
+    )[:5]
+    assert [video['viewCount'] for video in data['videos']] == expected
+    assert data['candidatePool'] == 50
+    assert data['stopReason'] == 'enough_results'
+
+
+def test_refine_null_parameters_use_stored_values(client, search_id):
+    response = client.post('/refine', json={'searchId': search_id, 'minViews': None, 'maxResults': None})
+    assert response.status_code == 200
+    assert response.get_json()['totalResults'] == 30
+
+
+@pytest.mark.parametrize('payload', [
+    {'minViews': 'many'},
+    {'maxResults': [5]},
+    {'maxResults': {'n': 5}},
+    {'maxDuration': 'long'},
+    {'sortBy': 'likes'},
+])
+def test_refine_bad_parameters_return_400(client, search_id, payload):
+    response = client.post('/refine', json=dict(payload, searchId=search_id))
+    assert response.status_code == 400
+
+
+def test_refine_unknown_search_returns_404(client):
+    assert client.post('/refine', json={'searchId': 'missing'}).status_code == 404
+
+
+def test_candidates_set_ranks_all_candidates(client, search_id):
+    results = client.get(f'/results/{search_id}?limit=500&fields=videoId').get_json()
+    data = client.get(f'/results/{search_id}?set=candidates&limit=500&fields=videoId,viewCount').get_json()
+    assert data['set'] == 'candidates'
+    assert data['total'] == 50
+    # 候選影片的排名前段與最終結果相同
+    assert [video['videoId'] for video in data['videos'][:30]] == [video['videoId'] for video in results['videos']]
+
+
+def test_unknown_result_set_returns_400(client, search_id):
+    assert client.get(f'/results/{search_id}?set=other').status_code == 400
@@ -0,0 +1,61 @@
+"""/results 分頁取得已保存的搜尋結果"""
+import pytest
+
+
+@pytest.fixture
+def search_id(client):
+    response = client.post('/search', json={'keyword': 'test', 'minViews': 1000, 'maxResults': 30})
+    assert response.status_code == 200
+    return response.get_json()['searchId']
+
+
+def test_paging_covers_all_results_once(client, search_id):
+    pages = []
+    for offset in range(0, 30, 7):
+        data = client.get(f'/results/{search_id}?offset={offset}&limit=7&fields=videoId').get_json()
+        assert (data['total'], data['offset'], data['limit']) == (30, offset, 7)
+        pages.append([video['videoId'] for video in data['videos']])
+    assert [len(page) for page in pages] == [7, 7, 7, 7, 2]
+    video_ids = [video_id for page in pages for video_id in page]
+    assert len(set(video_ids)) == 30
+    full = client.get(f'/results/{search_id}?limit=500&fields=videoId').get_json()
+    assert [video['videoId'] for video in full['videos']] == video_ids
+
+
+def test_offset_and_limit_are_clamped(app, client, search_id):
+    data = client.get(f'/results/{search_id}?offset=-5&limit=0').get_json()
+    assert (data['offset'], data['limit'], len(data['videos'])) == (0, 1, 1)
+    data = client.get(f'/results/{search_id}?limit=100000').get_json()
+    assert data['limit'] == app.RESULTS_PAGE_MAX
+    assert client.get(f'/results/{search_id}?offset=100').get_json()['videos'] == []
+
+
+def test_fields_selects_summary_or_full_data(app, client, search_id):
+    video = client.get(f'/results/{search_id}?limit=1&fields=videoId,viewCount').get_json()['videos'][0]
+    assert set(video) == {'videoId', 'viewCount'}
+    video = client.get(f'/results/{search_id}?limit=1').get_json()['videos'][0]
+    # 符合全部條件的影片省略 filterTier
+    assert set(video) == set(app.RESULT_SUMMARY_FIELDS) - {'filterTier'}
+    video = client.get(f'/results/{search_id}?limit=1&fields=all').get_json()['videos'][0]
+    assert {'description', 'tags', 'duration'} <= set(video)
+
+
+@pytest.mark.parametrize('query', ['fields=videoId,nope', 'offset=abc', 'limit=1.5', 'sort=nope'])
+def test_bad_parameters_return_400(client, search_id, query):
+    response = client.get(f'/results/{search_id}?{query}')
+    assert response.status_code == 400
+    assert response.get_json()['error']
+
+
+def test_unknown_search_returns_404(client):
+    assert client.get('/results/does-not-exist').status_code == 404
+
+
+def test_sort_and_ids_filter(client, search_id):
+    videos = client.get(f'/results/{search_id}?limit=500&sort=-likeCount&fields=videoId,viewCount').get_json()['videos']
+    ids = [videos[3]['videoId'], videos[0]['videoId']]
+    data = client.get(f"/results/{search_id}?ids={','.join(ids)}&sort=viewCount&fields=videoId,viewCount").get_json()
+    assert data['total'] == 2
+    assert [video['viewCount'] for video in data['videos']] == sorted(video['viewCount'] for video in data['videos'])
+    assert {video['videoId'] for video in data['videos']} == set(ids)
+
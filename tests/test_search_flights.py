@@ -0,0 +1,126 @@
+"""相同條件的搜尋合併（SqliteSearchFlights）"""
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def flights(app, tmp_path, monkeypatch):
+    flights = app.SqliteSearchFlights(str(tmp_path / 'flights.db'), 30)
+    monkeypatch.setattr(flights, 'poll_interval', 0.01)
+    monkeypatch.setattr(app, 'search_flights', flights)
+    return flights
+
+
+def finish_later(flights, key, flight, **kwargs):
+    """模擬其他程序中的執行者稍後結束搜尋"""
+    def run():
+        if 'make_result' in kwargs:
+            kwargs['result'] = kwargs.pop('make_result')()
+        flights.finish(key, flight, **kwargs)
+    timer = threading.Timer(0.1, run)
+    timer.start()
+    return timer
+
+
+def test_join_picks_smallest_flight_with_enough_results(flights):
+    first, is_leader = flights.join('k', 25)
+    assert is_leader
+    joined, is_leader = flights.join('k', 10)
+    assert (is_leader, joined.owner, joined.joiners) == (False, first.owner, 1)
+    # 要求更多筆數時另外執行
+    larger, is_leader = flights.join('k', 50)
+    assert is_leader and larger.owner != first.owner
+    assert flights.join('k', 40)[0].owner == larger.owner
+    assert flights.join('k', 20)[0].owner == first.owner
+    assert flights.join('other', 10)[1]
+
+
+def test_waiter_receives_result(flights):
+    leader, _ = flights.join('k', 25)
+    waiter, _ = flights.join('k', 25)
+    flights.finish('k', leader, result={'type': 'result', 'searchId': None, 'videos': []})
+    assert waiter.wait(1)
+    assert (waiter.result, waiter.error) == ({'type': 'result', 'searchId': None, 'videos': []}, None)
+    # 結束後的相同搜尋重新執行
+    assert flights.join('k', 25)[1]
+
+
+def test_waiter_receives_leader_error(app, flights):
+    leader, _ = flights.join('k', 25)
+    waiter, _ = flights.join('k', 25)
+    flights.finish('k', leader, error=app.YouTubeApiError('quotaExceeded', 'quota', 60))
+    assert waiter.wait(1)
+    assert isinstance(waiter.error, app.YouTubeApiError)
+    assert (str(waiter.error), waiter.error.kind, waiter.error.retry_after) == ('quotaExceeded', 'quota', 60)
+
+
+def test_interrupted_leader_and_timeout(flights):
+    leader, _ = flights.join('k', 25)
+    waiter, _ = flights.join('k', 25)
+    assert not waiter.wait(0.05)
+    flights.finish('k', leader)
+    assert not waiter.wait(1)
+    assert flights.join('k', 25)[1]
+
+
+def test_stale_leader_is_replaced(app, tmp_path):
+    flights = app.SqliteSearchFlights(str(tmp_path / 'stale.db'), 0)
+    first, _ = flights.join('k', 25)
+    second, is_leader = flights.join('k', 25)
+    assert is_leader and second.owner != first.owner
+
+
+SEARCH = {'keyword': 'test', 'minViews': 1000, 'maxResults': 10}
+
+
+def register_leader(app, flights, max_results):
+    key = app.get_search_flight_key(app.parse_search_request(dict(SEARCH, maxResults=max_results)))
+    flight, is_leader = flights.join(key, max_results)
+    assert is_leader
+    return key, flight
+
+
+def test_joined_search_reranks_leader_candidates(app, flights, youtube):
+    key, flight = register_leader(app, flights, 30)
+    
+    def leader_result():
+        return list(app.execute_search(dict(SEARCH, maxResults=30)))[-1]
+    
+    timer = finish_later(flights, key, flight, make_result=leader_result)
+    events = list(app.run_search(SEARCH))
+    timer.join()
+    # 只有執行者呼叫 API，等待者以共用的候選影片依自己的筆數排名
+    assert youtube.count('search') == 1
+    assert events[0]['coalesced']
+    assert events[-1]['type'] == 'result' and events[-1]['coalesced']
+    assert events[-1]['totalResults'] == 10
+    assert events[-1]['searchId']
+
+
+def test_leader_failure_is_raised_to_waiters(app, flights, youtube, client):
+    key, flight = register_leader(app, flights, 10)
+    timer = finish_later(flights, key, flight, error=app.YouTubeApiError('quotaExceeded', 'quota'))
+    response = client.post('/search', json=SEARCH)
+    timer.join()
+    assert response.status_code == 429
+    assert youtube.count('search') == 0
+
+
+def test_leader_parameter_error_is_not_shared(app, flights, youtube):
+    key, flight = register_leader(app, flights, 10)
+    timer = finish_later(flights, key, flight, error=ValueError('bad leader request'))
+    events = list(app.run_search(SEARCH))
+    timer.join()
+    # 等待者改為自行搜尋
+    assert events[-1]['type'] == 'result'
+    assert youtube.count('search') == 1
+
+
+def test_interrupted_leader_lets_waiters_search(app, flights, youtube):
+    key, flight = register_leader(app, flights, 10)
+    timer = finish_later(flights, key, flight)
+    events = list(app.run_search(SEARCH))
+    timer.join()
+    assert events[-1]['type'] == 'result' and not events[-1].get('coalesced')
+    assert youtube.count('search') == 1
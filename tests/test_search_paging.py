@@ -0,0 +1,76 @@
+"""collect_search_candidates 的分頁、提早停止與預算上限"""
+import pytest
+
+from conftest import FakeYouTube, run_generator, video_id
+
+
+def collect(app, youtube, min_views, limit, unit_budget):
+    api_calls = {'search_count': 0, 'video_details_count': 0, 'categories_call': 0}
+    ranking = app.TieredFilter(min_views, None, limit)
+    events, (candidates, stats) = run_generator(app.collect_search_candidates(
+        youtube, {'part': 'id', 'q': 'test', 'maxResults': 50}, {}, ranking, api_calls, unit_budget
+    ))
+    return events, candidates, stats, api_calls
+
+
+def test_stops_early_with_enough_results(app):
+    youtube = FakeYouTube(pages=12)
+    events, candidates, stats, api_calls = collect(app, youtube, 0, 10, 10000)
+    assert stats == {'searchPages': 1, 'candidateIds': 50, 'candidates': 50, 'stopReason': 'enough_results'}
+    assert api_calls == {'search_count': 1, 'video_details_count': 1, 'categories_call': 0}
+    # 預覽事件最多送出要求的筆數
+    assert sum(1 for event in events if event['type'] == 'video') == 10
+    assert events[-1]['type'] == 'progress'
+
+
+def test_stops_at_unit_budget(app):
+    youtube = FakeYouTube(pages=12)
+    _, _, stats, api_calls = collect(app, youtube, 10 ** 9, 10, 250)
+    assert stats['stopReason'] == 'budget'
+    assert stats['searchPages'] == 2
+    assert app.api_calls_cost(api_calls) <= 250
+    assert youtube.count('search') == 2
+
+
+def test_stops_when_no_more_pages(app):
+    youtube = FakeYouTube(pages=3)
+    events, candidates, stats, _ = collect(app, youtube, 10 ** 9, 10, 10000)
+    assert stats['stopReason'] == 'no_more_pages'
+    assert stats['searchPages'] == 3
+    # 候選影片維持搜尋順序，沒有符合全部條件的影片時不送出預覽
+    assert [video.videoId for video in candidates] == [video_id(n) for n in range(150)]
+    assert not any(event['type'] == 'video' for event in events)
+
+
+@pytest.mark.parametrize('max_pages', [1, 4])
+def test_stops_at_page_limit(app, monkeypatch, max_pages):
+    monkeypatch.setattr(app, 'MAX_SEARCH_PAGES', max_pages)
+    youtube = FakeYouTube(pages=12)
+    _, candidates, stats, _ = collect(app, youtube, 10 ** 9, 10, 100000)
+    assert stats['stopReason'] == 'page_limit'
+    assert stats['searchPages'] == max_pages
+    assert len(candidates) == max_pages * 50
+
+
+def test_search_endpoint_reports_stop_reason(client, youtube):
+    response = client.post('/search', json={'keyword': 'test', 'minViews': 1000, 'maxResults': 10})
+    data = response.get_json()
+    assert response.status_code == 200
+    assert data['searchStats']['stopReason'] == 'enough_results'
+    assert len(data['videos']) == 10
+    views = [video['viewCount'] for video in client.get(f"/results/{data['searchId']}?fields=viewCount")
+             .get_json()['videos']]
+    assert views == sorted(views, reverse=True)
+    assert youtube.count('search') == 1
+
+
+@pytest.mark.parametrize('payload', [
+    {'maxResults': 'abc'},
+    {'minViews': [1]},
+    {'unitBudget': {'a': 1}},
+    {'timeFilter': 'yesterday'},
+])
+def test_search_rejects_bad_parameters(client, youtube, payload):
+    response = client.post('/search', json=dict(payload, keyword='test'))
+    assert response.status_code == 400
+    assert youtube.count('search') == 0
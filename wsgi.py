@@ -0,0 +1,8 @@
+"""正式環境的 WSGI 進入點
+
+Linux:   gunicorn -w 4 -k gthread --threads 8 --timeout 120 -b 0.0.0.0:5000 wsgi:app
+Windows: waitress-serve --listen=0.0.0.0:5000 --threads=8 wsgi:app
+"""
+from app import create_app
+
+app = create_app()